@@ -0,0 +1,96 @@
+"""
+Decodes a large Listing of typed objects with the generic decoder (dicts), with a registered
+dataclass (generic field mapping), and with the class and decode function that codegen
+generates for the same Pkl class. Run with:
+
+    python benchmarks/bench_codegen.py
+"""
+import sys
+import time
+import types
+
+import msgpack
+
+from pkl_python import codegen
+from pkl_python.evaluator.decoder import Decoder
+from pkl_python.evaluator.registry import Registry
+
+MODULE = "file:///config/app.pkl"
+COUNT = 200_000
+ROUNDS = 5
+
+SCHEMA = {
+    "moduleName": "app",
+    "moduleUri": MODULE,
+    "moduleClass": {"name": "app", "qualifiedName": "app", "abstract": False, "properties": []},
+    "classes": [
+        {
+            "name": "Server",
+            "qualifiedName": "app#Server",
+            "abstract": False,
+            "properties": [
+                {"name": name, "type": {"kind": "declared", "name": t, "moduleUri": "pkl:base", "arguments": []}}
+                for name, t in [
+                    ("host", "String"),
+                    ("port", "Int"),
+                    ("weight", "Float"),
+                    ("enabled", "Boolean"),
+                    ("timeout", "Duration"),
+                ]
+            ],
+        }
+    ],
+}
+
+
+def server(i):
+    return [
+        0x1,
+        "app#Server",
+        MODULE,
+        [
+            [0x10, "host", f"host{i}"],
+            [0x10, "port", 8000 + i % 1000],
+            [0x10, "weight", i / COUNT],
+            [0x10, "enabled", i % 2 == 0],
+            [0x10, "timeout", [0x7, i % 60, "s"]],
+        ],
+    ]
+
+
+def load_generated():
+    module = types.ModuleType("generated_app")
+    sys.modules[module.__name__] = module
+    exec(codegen.generate(SCHEMA), module.__dict__)
+    return module
+
+
+def main():
+    data = memoryview(msgpack.packb([0x5, [server(i) for i in range(COUNT)]]))
+    generated = load_generated()
+
+    mapped = Registry()
+    mapped.register(MODULE, "app#Server", generated.Server)
+    specialized = Registry()
+    generated.register_all(specialized)
+    decoders = {
+        "generic (dicts)": Decoder(Registry()),
+        "registered dataclass": Decoder(mapped),
+        "generated decoder": Decoder(specialized),
+    }
+    assert decoders["registered dataclass"].decode(data) == decoders["generated decoder"].decode(data)
+
+    # interleaved, best of ROUNDS, since timings on a shared machine are noisy
+    best = {name: float("inf") for name in decoders}
+    for _ in range(ROUNDS):
+        for name, decoder in decoders.items():
+            start = time.perf_counter()
+            decoder.decode(data)
+            best[name] = min(best[name], time.perf_counter() - start)
+    print(f"{COUNT} objects, best of {ROUNDS}")
+    for name, elapsed in best.items():
+        print(f"{name:>22}: {elapsed * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
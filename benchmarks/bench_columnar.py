@@ -0,0 +1,59 @@
+"""
+Compares decoding large Listings of Floats, Ints and typed objects with Decoder and then
+converting to NumPy by hand against decode_numpy and decode_arrow. Needs numpy and pyarrow.
+Run with:
+
+    python benchmarks/bench_columnar.py
+"""
+import time
+
+import msgpack
+import numpy
+
+from pkl_python.evaluator.columnar import decode_arrow, decode_numpy
+from pkl_python.evaluator.decoder import Decoder
+
+
+def row(i):
+    return [
+        0x1,
+        "Capacity",
+        "file:///config/capacity.pkl",
+        [
+            [0x10, "region", f"region{i % 20}"],
+            [0x10, "cores", i % 512],
+            [0x10, "memory", i * 0.5],
+            [0x10, "utilization", (i % 100) / 100],
+        ],
+    ]
+
+
+def by_hand(data):
+    value = Decoder().decode(data)
+    if value and isinstance(value[0], dict):
+        return {key: numpy.array([item[key] for item in value]) for key in value[0]}
+    return numpy.array(value)
+
+
+def timed(fn, data, rounds=3):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(data)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    payloads = {
+        "Listing<Float> x 2M": msgpack.packb([0x5, [i / 3 for i in range(2_000_000)]]),
+        "Listing<Int> x 2M": msgpack.packb([0x5, list(range(2_000_000))]),
+        "Listing<Int> 1000..1999 x 2M": msgpack.packb([0x5, [1000 + i % 1000 for i in range(2_000_000)]]),
+        "Listing<Capacity> x 200k": msgpack.packb([0x5, [row(i) for i in range(200_000)]]),
+    }
+    print(f"{'payload':<26} {'by hand':>9} {'numpy':>9} {'arrow':>9}")
+    for name, data in payloads.items():
+        times = [timed(fn, data) for fn in (by_hand, decode_numpy, decode_arrow)]
+        print(f"{name:<30} " + " ".join(f"{t * 1000:>7.0f}ms" for t in times))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Compares the single-pass Decoder against the previous two-pass decoder, which unpacked the
+whole result into nested lists before walking it again, on large Listing, Mapping and Dynamic
+payloads. Reports the mean decode time and the peak memory allocated while decoding. Run with:
+
+    python benchmarks/bench_decoder.py
+"""
+import time
+import tracemalloc
+
+import msgpack
+
+from pkl_python.evaluator.decoder import Decoder
+
+
+class TwoPassDecoder:
+    def decode(self, data):
+        return self.decode_any(msgpack.unpackb(data, raw=False, strict_map_key=False))
+
+    def decode_any(self, value):
+        if isinstance(value, list):
+            code, *rest = value
+            return self.decode_code(code, rest)
+        return value
+
+    def decode_code(self, code, rest):
+        if code == 0x1:
+            name, module_uri, members = rest
+            if name == "Dynamic" and module_uri == "pkl:base":
+                return self.decode_dynamic(members)
+            out = {}
+            for member in members:
+                _, key, value = member
+                out[key] = self.decode_any(value)
+            return out
+        if code in [0x2, 0x3]:
+            (map,) = rest
+            return {self.decode_any(k): self.decode_any(v) for k, v in map.items()}
+        if code in [0x4, 0x5]:
+            (list,) = rest
+            return [self.decode_any(item) for item in list]
+        raise ValueError(code)
+
+    def decode_dynamic(self, members):
+        properties, entries, elements = {}, {}, []
+        for member in members:
+            code, *rest = member
+            if code == 0x10:
+                properties[rest[0]] = self.decode_any(rest[1])
+            elif code == 0x11:
+                entries[self.decode_any(rest[0])] = self.decode_any(rest[1])
+            else:
+                elements.append(self.decode_any(rest[1]))
+        return {"properties": properties, "entries": entries, "elements": elements}
+
+
+def dynamic(i):
+    return [
+        0x1,
+        "Dynamic",
+        "pkl:base",
+        [
+            [0x10, "name", f"item{i}"],
+            [0x10, "value", i],
+            [0x10, "tags", [0x5, ["a", "b"]]],
+            [0x12, 0, i / 3],
+        ],
+    ]
+
+
+PAYLOADS = {
+    "Listing<Int> x 500k": [0x5, list(range(500_000))],
+    "Listing<Float> x 500k": [0x5, [i / 7 for i in range(500_000)]],
+    "Mapping<String, String> x 200k": [0x3, {f"key{i}": f"value{i}" for i in range(200_000)}],
+    "Listing<Dynamic> x 100k": [0x5, [dynamic(i) for i in range(100_000)]],
+    "Mapping<String, Listing> x 50k": [0x3, {f"k{i}": [0x5, [i, i + 1, i + 2]] for i in range(50_000)}],
+}
+
+
+def measure(decoder, data, rounds=3):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decoder.decode(data)
+    elapsed = (time.perf_counter() - start) / rounds
+    tracemalloc.start()
+    decoder.decode(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def main():
+    print(f"{'payload':<32} {'two-pass':>18} {'single-pass':>18} {'speedup':>8}")
+    for name, value in PAYLOADS.items():
+        data = msgpack.packb(value)
+        old_time, old_peak = measure(TwoPassDecoder(), data)
+        new_time, new_peak = measure(Decoder(), data)
+        print(
+            f"{name:<32} {old_time * 1000:>7.0f}ms {old_peak:>6.1f}MiB"
+            f" {new_time * 1000:>7.0f}ms {new_peak:>6.1f}MiB {old_time / new_time:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
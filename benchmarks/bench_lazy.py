@@ -0,0 +1,73 @@
+"""
+Reads three properties out of a large result, decoding it eagerly and through a lazy view.
+Run with:
+
+    python benchmarks/bench_lazy.py
+"""
+import time
+import tracemalloc
+
+import msgpack
+
+from pkl_python.evaluator.decoder import Decoder
+from pkl_python.evaluator.lazy import decode_lazy
+
+
+def service(i):
+    return [
+        0x1,
+        "Service",
+        "file:///config/services.pkl",
+        [
+            [0x10, "name", f"service{i}"],
+            [0x10, "replicas", i % 7],
+            [0x10, "env", [0x3, {f"VAR_{j}": f"value{i}-{j}" for j in range(20)}]],
+            [0x10, "ports", [0x5, list(range(8000, 8010))]],
+        ],
+    ]
+
+
+def payload():
+    return [
+        0x1,
+        "Config",
+        "file:///config/app.pkl",
+        [
+            [0x10, "version", "1.2.3"],
+            [0x10, "services", [0x5, [service(i) for i in range(60_000)]]],
+            [0x10, "owner", "platform"],
+        ],
+    ]
+
+
+def measure(read, data):
+    start = time.perf_counter()
+    result = read(data)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    read(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 / 1024
+
+
+def eager(data):
+    value = Decoder().decode(data)
+    return value["version"], value["owner"], value["services"][1234]["name"]
+
+
+def lazy(data):
+    view = decode_lazy(data)
+    return view["version"], view["owner"], view["services"][1234]["name"]
+
+
+def main():
+    data = msgpack.packb(payload())
+    print(f"result size {len(data) / 1024 / 1024:.1f}MiB, reading 3 values")
+    for name, read in [("eager", eager), ("lazy", lazy)]:
+        result, elapsed, peak = measure(read, memoryview(data))
+        print(f"{name:<6} {elapsed * 1000:>7.1f}ms  peak {peak:>7.2f}MiB  {result}")
+
+
+if __name__ == "__main__":
+    main()
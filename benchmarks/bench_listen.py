@@ -0,0 +1,87 @@
+"""
+Compares the throughput of EvaluatorManagerImpl.read_messages against the previous reader loop,
+which read 128 bytes at a time and unpacked at most one message per read.
+
+Messages are written into an OS pipe by a background thread so that reads see real pipe
+chunking. Run with:
+
+    python benchmarks/bench_listen.py
+"""
+import asyncio
+import os
+import threading
+import time
+
+import msgpack
+
+from pkl_python.evaluator.evaluator_manager import EvaluatorManagerImpl, pack_message
+from pkl_python.types.codes import EvaluateResponse
+
+RESULT_SIZES = [1024, 64 * 1024, 1024 * 1024, 5 * 1024 * 1024]
+TOTAL_BYTES = 20 * 1024 * 1024
+
+
+class CountingManager(EvaluatorManagerImpl):
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def handle_decode(self, item):
+        self.count += 1
+
+
+async def legacy_read_messages(manager: CountingManager, stream: asyncio.StreamReader):
+    while not stream.at_eof():
+        try:
+            data = await stream.read(128)
+            manager.unpacker.feed(data)
+            item = manager.unpacker.unpack()
+            manager.handle_decode(item)
+        except msgpack.OutOfData:
+            continue
+    # messages left behind in the unpacker are only seen after EOF
+    for item in manager.unpacker:
+        manager.handle_decode(item)
+
+
+def write_messages(fd: int, payload: bytes, count: int):
+    with os.fdopen(fd, "wb") as f:
+        for _ in range(count):
+            f.write(payload)
+
+
+async def run(reader_loop, result_size: int) -> float:
+    count = max(TOTAL_BYTES // result_size, 1)
+    payload = pack_message(
+        msgpack.Packer(),
+        EvaluateResponse,
+        {"evaluatorId": 1, "requestId": 1, "result": os.urandom(result_size)},
+    )
+    manager = CountingManager()
+    read_fd, write_fd = os.pipe()
+    loop = asyncio.get_running_loop()
+    stream = asyncio.StreamReader(limit=manager.max_read_bytes)
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(stream), os.fdopen(read_fd, "rb")
+    )
+    writer = threading.Thread(target=write_messages, args=(write_fd, payload, count))
+    start = time.perf_counter()
+    writer.start()
+    await reader_loop(manager, stream)
+    elapsed = time.perf_counter() - start
+    writer.join()
+    transport.close()
+    assert manager.count == count, (manager.count, count)
+    return count * len(payload) / elapsed / 1024 / 1024
+
+
+async def main():
+    print(f"{'result size':>12} {'legacy MiB/s':>14} {'bulk MiB/s':>12} {'speedup':>8}")
+    for size in RESULT_SIZES:
+        legacy = await run(legacy_read_messages, size)
+        bulk = await run(lambda m, s: m.read_messages(s), size)
+        print(f"{size:>12} {legacy:>14.1f} {bulk:>12.1f} {bulk / legacy:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""
+Measures the per-message cost of the protocol codec: decoding an EvaluateResponse and a Log
+from their unpacked bodies, and encoding an Evaluate to the dict that gets packed, compared
+with the pydantic models used before. Run with:
+
+    python benchmarks/bench_messages.py
+"""
+import time
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict
+
+from pkl_python.types import codes
+from pkl_python.types.incoming import decode
+from pkl_python.types.outgoing import Evaluate
+
+COUNT = 200_000
+ROUNDS = 5
+
+
+class LegacyEvaluateResponse(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    evaluatorId: int
+    requestId: int
+    result: Optional[memoryview] = None
+    error: Optional[str] = None
+
+
+class LegacyLog(BaseModel):
+    evaluatorId: int
+    level: int
+    message: str
+    frameUri: Optional[str] = None
+
+
+class LegacyEvaluate(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True, exclude_none=True)
+
+    requestId: int
+    evaluatorId: int
+    moduleUri: str
+    expr: Optional[str] = None
+    moduleText: Optional[str] = None
+
+
+def legacy_decode(incoming):
+    code, map = incoming
+    if code == codes.EvaluateResponse:
+        if map.get("result") is not None:
+            map["result"] = memoryview(map["result"])
+        return LegacyEvaluateResponse(**map, code=codes.EvaluateResponse)
+    if code == codes.EvaluateLog:
+        return LegacyLog(**map, code=codes.EvaluateLog)
+    raise ValueError(f"Unknown code: {code}")
+
+
+def evaluate_response():
+    return (codes.EvaluateResponse, {"evaluatorId": 1, "requestId": 7, "result": b"\xa5hello"})
+
+
+def log():
+    return (codes.EvaluateLog, {"evaluatorId": 1, "level": 1, "message": "deprecated", "frameUri": "file:///a.pkl"})
+
+
+def cases():
+    evaluate = dict(requestId=7, evaluatorId=1, moduleUri="file:///a.pkl", expr="output.text")
+    return {
+        "decode EvaluateResponse": (
+            lambda: decode(evaluate_response()),
+            lambda: legacy_decode(evaluate_response()),
+        ),
+        "decode Log": (lambda: decode(log()), lambda: legacy_decode(log())),
+        "encode Evaluate": (
+            lambda: Evaluate(**evaluate).to_dict(),
+            lambda: LegacyEvaluate(**evaluate).model_dump(exclude_none=True),
+        ),
+    }
+
+
+def per_message(fn) -> float:
+    start = time.perf_counter()
+    for _ in range(COUNT):
+        fn()
+    return (time.perf_counter() - start) / COUNT
+
+
+def main():
+    print(f"ns per message, best of {ROUNDS}")
+    for name, (new, legacy) in cases().items():
+        # interleaved, since timings on a shared machine are noisy
+        best_new = best_legacy = float("inf")
+        for _ in range(ROUNDS):
+            best_new = min(best_new, per_message(new))
+            best_legacy = min(best_legacy, per_message(legacy))
+        print(f"{name:>24}: {best_new * 1e9:7.0f} (pydantic {best_legacy * 1e9:7.0f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Decodes the synthetic payloads in nested_corpus with Decoder, which tracks nesting on an explicit
+stack, and with the recursive decoder it replaced, which is kept here for comparison. Deep
+payloads are beyond the recursion limit of the recursive decoder. Run with:
+
+    python benchmarks/bench_nested.py
+"""
+import time
+from typing import Any, Dict, List
+
+from nested_corpus import CORPUS
+from pkl_python.evaluator.decoder import (
+    Decoder,
+    codeClass,
+    codeDataSize,
+    codeDuration,
+    codeIntSeq,
+    codeList,
+    codeListing,
+    codeMap,
+    codeMapping,
+    codeObject,
+    codeObjectMemberElement,
+    codeObjectMemberEntry,
+    codeObjectMemberProperty,
+    codePair,
+    codeRegex,
+    codeSet,
+    codeTypeAlias,
+    header_sizes,
+    kindMap,
+    kindPrimitive,
+    new_unpacker,
+    value_kinds,
+)
+from pkl_python.types.pkl import DataSize, DataSizeUnit, Duration, DurationUnit, IntSeq, Regex
+
+
+class RecursiveDecoder:
+    # the recursive decoder this module replaced, without registry support
+
+    def decode(self, data: bytes) -> Any:
+        self.data = data
+        self.unpacker = new_unpacker(data)
+        try:
+            return self.decode_any()
+        finally:
+            self.data = self.unpacker = None
+
+    def decode_list_at(self, data) -> List[Any]:
+        self.data = data
+        self.unpacker = new_unpacker(data)
+        return self.decode_items()
+
+    def decode_any(self) -> Any:
+        unpacker = self.unpacker
+        kind = value_kinds[self.data[unpacker.tell()]]
+        if kind == kindPrimitive:
+            return unpacker.unpack()
+        if kind == kindMap:
+            raise ValueError(
+                f"unexpected object {unpacker.unpack()} provided to decode_any; expected primitive type or list"
+            )
+        length = unpacker.read_array_header()
+        return self.decode_code(unpacker.unpack(), length)
+
+    def decode_code(self, code: int, length: int) -> Any:
+        unpacker = self.unpacker
+        if code == codeObject:
+            name = unpacker.unpack()
+            module_uri = unpacker.unpack()
+            if name == "Dynamic" and module_uri == "pkl:base":
+                return self.decode_dynamic()
+            return self.decode_object(name, module_uri)
+        elif code == codeMap or code == codeMapping:
+            return self.decode_map()
+        elif code == codeList or code == codeListing:
+            return self.decode_list()
+        elif code == codeSet:
+            return set(self.decode_list())
+        elif code == codeDuration:
+            value = unpacker.unpack()
+            return Duration(value, DurationUnit(unpacker.unpack()))
+        elif code == codeDataSize:
+            value = unpacker.unpack()
+            return DataSize(value, DataSizeUnit(unpacker.unpack()))
+        elif code == codePair:
+            first = self.decode_any()
+            return [first, self.decode_any()]
+        elif code == codeIntSeq:
+            start = unpacker.unpack()
+            end = unpacker.unpack()
+            return IntSeq(start, end, unpacker.unpack())
+        elif code == codeRegex:
+            return Regex(unpacker.unpack())
+        elif code == codeClass or code == codeTypeAlias:
+            for _ in range(length - 1):
+                unpacker.skip()
+            return {}
+        else:
+            raise ValueError(f"encountered unknown object code: {code}")
+
+    def decode_object(self, name: str, module_uri: str) -> Any:
+        unpacker = self.unpacker
+        data = self.data
+        tell = unpacker.tell
+        unpack = unpacker.unpack
+        read_array_header = unpacker.read_array_header
+        decode_any = self.decode_any
+        out = {}
+        for _ in range(read_array_header()):
+            read_array_header()
+            code = unpack()
+            if code == codeObjectMemberProperty:
+                key = unpack()
+                if value_kinds[data[tell()]] == kindPrimitive:
+                    out[key] = unpack()
+                else:
+                    out[key] = decode_any()
+            elif code in [codeObjectMemberEntry, codeObjectMemberElement]:
+                raise ValueError("Unexpected object member entry in non-Dynamic object")
+        return out
+
+    def decode_dynamic(self) -> Dict[str, Any]:
+        unpacker = self.unpacker
+        data = self.data
+        tell = unpacker.tell
+        unpack = unpacker.unpack
+        read_array_header = unpacker.read_array_header
+        decode_any = self.decode_any
+        properties = {}
+        entries = {}
+        elements = []
+        for _ in range(read_array_header()):
+            read_array_header()
+            code = unpack()
+            if code == codeObjectMemberProperty:
+                name = unpack()
+                if not isinstance(name, str):
+                    raise ValueError("object member property keys must be strings")
+                if value_kinds[data[tell()]] == kindPrimitive:
+                    properties[name] = unpack()
+                else:
+                    properties[name] = decode_any()
+            elif code == codeObjectMemberEntry:
+                key = decode_any()
+                entries[key] = decode_any()
+            elif code == codeObjectMemberElement:
+                i = unpack()
+                if not isinstance(i, int):
+                    raise ValueError("object member element indices must be numbers")
+                elements.append(decode_any())
+        return {"properties": properties, "entries": entries, "elements": elements}
+
+    def decode_map(self) -> Dict[Any, Any]:
+        decode_any = self.decode_any
+        out = {}
+        for _ in range(self.unpacker.read_map_header()):
+            key = decode_any()
+            out[key] = decode_any()
+        return out
+
+    def decode_list(self) -> List[Any]:
+        unpacker = self.unpacker
+        start = unpacker.tell()
+        if self.starts_with_primitive(start):
+            # Listings are usually homogeneous, so one that starts with a primitive is unpacked
+            # whole. If it turns out to hold Pkl values after all, its bytes are decoded again
+            # element by element with a separate Decoder.
+            out = unpacker.unpack()
+            if not any(type(item) is list for item in out):
+                return out
+            return RecursiveDecoder().decode_list_at(memoryview(self.data)[start : unpacker.tell()])
+        return self.decode_items()
+
+    def decode_items(self) -> List[Any]:
+        unpacker = self.unpacker
+        data = self.data
+        tell = unpacker.tell
+        unpack = unpacker.unpack
+        decode_any = self.decode_any
+        out = []
+        append = out.append
+        for _ in range(unpacker.read_array_header()):
+            # primitives are by far the most common elements, so unpack them inline
+            if value_kinds[data[tell()]] == kindPrimitive:
+                append(unpack())
+            else:
+                append(decode_any())
+        return out
+
+    def starts_with_primitive(self, start: int) -> bool:
+        # whether the array or map at start is empty or its first item is a primitive
+        data = self.data
+        first = start + header_sizes[data[start]]
+        return first >= len(data) or value_kinds[data[first]] == kindPrimitive
+
+
+def best_of(decoder_classes, data, rounds=15):
+    # rounds alternate between the decoders, so that noise affects them alike
+    best = [float("inf")] * len(decoder_classes)
+    for _ in range(rounds):
+        for i, decoder_class in enumerate(decoder_classes):
+            if best[i] is None:
+                continue
+            start = time.perf_counter()
+            try:
+                decoder_class().decode(data)
+            except RecursionError:
+                best[i] = None
+                continue
+            best[i] = min(best[i], time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'payload':<14} {'size':>9} {'recursive':>11} {'stack':>9} {'speedup':>8}")
+    for name, build in CORPUS.items():
+        data = build()
+        old, new = best_of([RecursiveDecoder, Decoder], data)
+        old_text = "RecursionError" if old is None else f"{old * 1000:.0f}ms"
+        speedup = "" if old is None else f"{old / new:.2f}x"
+        print(f"{name:<14} {len(data) / 1024:>7.0f}KiB {old_text:>11} {new * 1000:>7.0f}ms {speedup:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Writes a large rendered output to a file the way a config-serving endpoint would: by decoding
+the evaluation result into a str and encoding it again, and by passing the payload through
+with write_payload. Run with:
+
+    python benchmarks/bench_output.py
+"""
+import os
+import tempfile
+import time
+
+import msgpack
+
+from pkl_python.evaluator.decoder import Decoder
+from pkl_python.evaluator.output import output_payload, write_payload
+
+SIZE = 64 * 1024 * 1024
+ROUNDS = 5
+
+
+def decode_and_write(data, f):
+    f.write(Decoder().decode(data).encode())
+
+
+def pass_through(data, f):
+    write_payload(output_payload(data), f)
+
+
+def main():
+    data = memoryview(msgpack.packb("key = \"värde\"\n" * (SIZE // 16)))
+    best = {decode_and_write: float("inf"), pass_through: float("inf")}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "out")
+        # interleaved, best of ROUNDS, since timings on a shared machine are noisy
+        for _ in range(ROUNDS):
+            for write in best:
+                with open(path, "wb") as f:
+                    start = time.perf_counter()
+                    write(data, f)
+                    f.flush()
+                    best[write] = min(best[write], time.perf_counter() - start)
+    print(f"{len(data) / 1024 / 1024:.0f} MiB of output, best of {ROUNDS}")
+    for write, elapsed in best.items():
+        print(f"{write.__name__:>17}: {elapsed * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
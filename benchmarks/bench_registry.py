@@ -0,0 +1,75 @@
+"""
+Decodes a large Listing of typed objects into dicts (unregistered class) and into slotted
+dataclasses (registered class), reporting decode time, memory retained by the result and the
+time to read every property back. Run with:
+
+    python benchmarks/bench_registry.py
+"""
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+import msgpack
+
+from pkl_python.evaluator.decoder import Decoder
+from pkl_python.evaluator.registry import Registry
+
+MODULE = "file:///config/app.pkl"
+COUNT = 200_000
+
+
+@dataclass(slots=True)
+class Server:
+    host: str
+    port: int
+    weight: float
+    enabled: bool
+
+
+def server(i):
+    return [
+        0x1,
+        "app#Server",
+        MODULE,
+        [
+            [0x10, "host", f"host{i}"],
+            [0x10, "port", 8000 + i % 1000],
+            [0x10, "weight", i / COUNT],
+            [0x10, "enabled", i % 2 == 0],
+        ],
+    ]
+
+
+def measure(decoder, data, read):
+    start = time.perf_counter()
+    decoder.decode(data)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = decoder.decode(data)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for item in result:
+        read(item)
+    return elapsed, retained / 1024 / 1024, time.perf_counter() - start
+
+
+def main():
+    data = msgpack.packb([0x5, [server(i) for i in range(COUNT)]])
+    registry = Registry()
+    registry.register(MODULE, "app#Server", Server)
+    runs = {
+        "dict": measure(
+            Decoder(Registry()), data, lambda s: (s["host"], s["port"], s["weight"], s["enabled"])
+        ),
+        "slotted dataclass": measure(
+            Decoder(registry), data, lambda s: (s.host, s.port, s.weight, s.enabled)
+        ),
+    }
+    print(f"{COUNT} Server objects")
+    for name, (decode, retained, read) in runs.items():
+        print(f"{name:<18} decode {decode * 1000:>6.0f}ms  retained {retained:>6.1f}MiB  read {read * 1000:>5.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
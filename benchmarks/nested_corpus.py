@@ -0,0 +1,97 @@
+"""
+Synthetic nested Pkl payloads, msgpack-encoded the way the Pkl server encodes results, for
+decoder benchmarks. Deep payloads are built directly as bytes, because msgpack.packb refuses to
+nest values more than a few hundred levels deep.
+"""
+import msgpack
+
+MODULE = "file:///config/generated.pkl"
+
+
+def typed(name, properties):
+    return [0x1, name, MODULE, [[0x10, key, value] for key, value in properties.items()]]
+
+
+def dynamic(properties=(), entries=(), elements=()):
+    members = [[0x10, key, value] for key, value in properties]
+    members += [[0x11, key, value] for key, value in entries]
+    members += [[0x12, i, value] for i, value in enumerate(elements)]
+    return [0x1, "Dynamic", "pkl:base", members]
+
+
+def wide_objects(count=50_000):
+    # a Listing of typed objects with scalar, Listing and Mapping properties
+    return msgpack.packb(
+        [
+            0x5,
+            [
+                typed(
+                    "Service",
+                    {
+                        "name": f"service{i}",
+                        "replicas": i % 9,
+                        "cpu": i / 7,
+                        "enabled": i % 2 == 0,
+                        "ports": [0x5, [8080, 8443]],
+                        "labels": [0x3, {"team": f"team{i % 12}", "tier": "web"}],
+                        "limits": typed("Limits", {"memory": [0x8, 512, "mib"], "timeout": [0x7, 30, "s"]}),
+                    },
+                )
+                for i in range(count)
+            ],
+        ]
+    )
+
+
+def dynamic_tree(fanout=4, depth=7):
+    # a balanced tree of Dynamics, each with properties, an entry and child elements
+    def node(level, i):
+        children = [node(level + 1, j) for j in range(fanout)] if level < depth else []
+        return dynamic(
+            properties=[("id", f"{level}.{i}"), ("weight", i * 1.5)],
+            entries=[("k", i)],
+            elements=children,
+        )
+
+    return msgpack.packb(node(0, 0))
+
+
+def mapping_tree(fanout=6, depth=6):
+    # nested Mappings, like a generated configuration grouped by several keys
+    def node(level):
+        if level == depth:
+            return [0x5, [1, 2, 3]]
+        return [0x3, {f"key{j}": node(level + 1) for j in range(fanout)}]
+
+    return msgpack.packb(node(0))
+
+
+def nested(depth, open_value, close=b""):
+    # wraps a leaf value in depth levels of open_value, building the bytes directly
+    return open_value * depth + msgpack.packb("leaf") + close * depth
+
+
+def deep_listing(depth=50_000):
+    # Listing(Listing(...("leaf")))
+    return nested(depth, b"\x92\x05\x91")
+
+
+def deep_dynamic(depth=20_000):
+    # Dynamic { child = Dynamic { child = ... } }
+    header = b"\x94\x01" + msgpack.packb("Dynamic") + msgpack.packb("pkl:base")
+    return nested(depth, header + b"\x91\x93\x10" + msgpack.packb("child"))
+
+
+def deep_mapping(depth=20_000):
+    # Mapping { ["child"] = Mapping { ["child"] = ... } }
+    return nested(depth, b"\x92\x03\x81" + msgpack.packb("child"))
+
+
+CORPUS = {
+    "wide objects": wide_objects,
+    "dynamic tree": dynamic_tree,
+    "mapping tree": mapping_tree,
+    "deep listing": deep_listing,
+    "deep dynamic": deep_dynamic,
+    "deep mapping": deep_mapping,
+}
@@ -0,0 +1,21 @@
+"""
+Command line tools of pkl-python.
+
+    python -m pkl_python codegen path/to/appConfig.pkl -o app_config.py
+"""
+import sys
+
+from . import codegen
+
+commands = {"codegen": codegen.main}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        sys.stderr.write(f"usage: python -m pkl_python {{{','.join(commands)}}} ...\n")
+        sys.exit(2)
+    commands[sys.argv[1]](sys.argv[2:])
+
+
+if __name__ == "__main__":
+    main()
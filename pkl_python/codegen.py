@@ -0,0 +1,370 @@
+"""
+Generates Python modules that decode the classes of a Pkl module without type dispatch.
+
+For every class of the Pkl module, and for the module itself, the generated module declares a
+slotted dataclass and a decode function specialized to the class's property layout: the
+properties are read in the order Pkl encodes them, primitives straight off the msgpack stream,
+so decoding an object is a flat sequence of assignments and one constructor call. Importing
+the generated module registers each class and its decode function with the default registry.
+
+If the Pkl module changes after code is generated, the decode functions raise a ValueError
+on the first object whose properties no longer match, rather than misassign values.
+
+Generate a module with:
+
+    python -m pkl_python codegen path/to/appConfig.pkl -o app_config.py
+"""
+import argparse
+import asyncio
+import json
+import keyword
+import os
+import re
+import sys
+from typing import Any, Dict, List, Optional, Set
+
+# Pkl program that describes the classes of the module at %(uri)s as JSON, using pkl:reflect.
+schema_program = """
+import "pkl:reflect"
+import %(uri)s as target
+
+local schemaModule = reflect.Module(target)
+
+local function describe(t: reflect.Type): Dynamic =
+  if (t is reflect.NullableType)
+    new Dynamic {
+      kind = "nullable"
+      member = describe(t.member)
+    }
+  else if (t is reflect.UnionType)
+    new Dynamic {
+      kind = "union"
+      members = t.members.map((it) -> describe(it))
+    }
+  else if (t is reflect.StringLiteralType)
+    new Dynamic { kind = "stringLiteral" }
+  else if (t is reflect.DeclaredType && t.referent is reflect.TypeAlias)
+    describe(t.referent.referent)
+  else if (t is reflect.DeclaredType)
+    new Dynamic {
+      kind = "declared"
+      name = t.referent.name
+      moduleUri = t.referent.enclosingDeclaration.uri
+      arguments = t.typeArguments.map((it) -> describe(it))
+    }
+  else
+    new Dynamic { kind = "unknown" }
+
+local function describeClass(c: reflect.Class, qualifiedName: String): Dynamic = new Dynamic {
+  name = c.name
+  qualifiedName = qualifiedName
+  abstract = c.modifiers.contains("abstract")
+  properties = new Listing {
+    for (propertyName, property in c.allProperties) {
+      when (!property.modifiers.contains("hidden")) {
+        new Dynamic {
+          name = propertyName
+          type = describe(property.type)
+        }
+      }
+    }
+  }
+}
+
+output {
+  renderer = new JsonRenderer {}
+  value = new Dynamic {
+    moduleName = schemaModule.name
+    moduleUri = schemaModule.uri
+    moduleClass = describeClass(schemaModule.moduleClass, schemaModule.name)
+    classes = new Listing {
+      for (_, c in schemaModule.classes) {
+        describeClass(c, "\\(schemaModule.name)#\\(c.name)")
+      }
+    }
+  }
+}
+"""
+
+# Python types of the pkl:base classes whose values decode to a single msgpack primitive.
+primitive_types = {
+    "String": "str",
+    "Int": "int",
+    "Float": "float",
+    "Number": "float",
+    "Boolean": "bool",
+    "Null": "None",
+}
+
+# pkl:base classes that decode to the Python class of the same name.
+value_classes = {"Duration", "DataSize", "IntSeq", "Regex"}
+
+
+async def load_schema(evaluator, module_uri: str) -> Dict[str, Any]:
+    """
+    Describes the classes of the Pkl module at module_uri: their names, and the names and
+    types of their properties in the order Pkl encodes them.
+    """
+    from .evaluator.module_source import TextSource
+
+    program = schema_program % {"uri": json.dumps(module_uri)}
+    return json.loads(await evaluator.evaluate_output_text(TextSource(program)))
+
+
+def generate(schema: Dict[str, Any]) -> str:
+    """
+    Generates the source of a Python module from a schema returned by load_schema.
+    """
+    return Generator(schema).generate()
+
+
+def literal(value: str) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def class_name(pkl_name: str) -> str:
+    # "com.example.appConfig" -> "AppConfig"
+    parts = re.split(r"[^0-9A-Za-z]+", pkl_name.rsplit(".", 1)[-1])
+    name = "".join(part[:1].upper() + part[1:] for part in parts)
+    if not name.isidentifier():
+        name = "_" + name
+    return name
+
+
+def field_name(pkl_name: str) -> str:
+    name = re.sub(r"[^0-9A-Za-z_]", "_", pkl_name)
+    if not name.isidentifier():
+        name = "_" + name
+    if keyword.iskeyword(name):
+        name += "_"
+    return name
+
+
+def function_name(name: str) -> str:
+    # "AppConfig" -> "decode_app_config"
+    return "decode_" + re.sub(r"(?<=[0-9a-z])(?=[A-Z])", "_", name).lower().lstrip("_")
+
+
+class Generator:
+    def __init__(self, schema: Dict[str, Any]):
+        self.module_uri = schema["moduleUri"]
+        self.module_class = schema["moduleClass"]
+        self.classes = [self.module_class] + schema["classes"]
+        self.class_names: Dict[str, str] = {}
+        for c in self.classes:
+            name = class_name(c["name"] if c is not self.module_class else schema["moduleName"])
+            while name in self.class_names.values():
+                name += "_"
+            self.class_names[c["name"] if c is not self.module_class else None] = name
+        self.typing_names: Set[str] = set()
+        self.pkl_names: Set[str] = set()
+        self.needs_field = False
+
+    def generate(self) -> str:
+        body = []
+        for c in self.classes:
+            body.append(self.dataclass(c))
+            if not c["abstract"]:
+                body.append(self.decode_function(c))
+        body.append(self.register_function())
+
+        lines = [
+            f"# Code generated by `python -m pkl_python codegen` from {self.module_uri}. DO NOT EDIT.",
+            "from __future__ import annotations",
+            "",
+            "from dataclasses import dataclass" + (", field" if self.needs_field else ""),
+        ]
+        if self.typing_names:
+            lines.append(f"from typing import {', '.join(sorted(self.typing_names))}")
+        lines += [
+            "",
+            "from pkl_python.evaluator.decoder import Decoder",
+            "from pkl_python.evaluator.registry import Registry, default_registry",
+        ]
+        if self.pkl_names:
+            lines.append(f"from pkl_python.types.pkl import {', '.join(sorted(self.pkl_names))}")
+        lines += [
+            "",
+            f"MODULE_URI = {literal(self.module_uri)}",
+            "",
+            "",
+            "def schema_changed(name: str) -> ValueError:",
+            "    return ValueError(",
+            "        f\"{name} objects no longer match the classes generated from {MODULE_URI}; \"",
+            "        \"regenerate them with `python -m pkl_python codegen`\"",
+            "    )",
+        ]
+        return "\n".join(lines + body + ["", "", "register_all()", ""])
+
+    def python_name(self, c: Dict[str, Any]) -> str:
+        return self.class_names[c["name"] if c is not self.module_class else None]
+
+    def type_hint(self, t: Dict[str, Any]) -> str:
+        kind = t["kind"]
+        if kind == "stringLiteral":
+            return "str"
+        if kind == "nullable":
+            self.typing_names.add("Optional")
+            return f"Optional[{self.type_hint(t['member'])}]"
+        if kind == "union":
+            members = list(dict.fromkeys(self.type_hint(member) for member in t["members"]))
+            if len(members) == 1:
+                return members[0]
+            self.typing_names.add("Union")
+            return f"Union[{', '.join(members)}]"
+        if kind != "declared":
+            self.typing_names.add("Any")
+            return "Any"
+        name = t["name"]
+        arguments = [self.type_hint(argument) for argument in t["arguments"]]
+        if t["moduleUri"] == "pkl:base":
+            if name in primitive_types:
+                return primitive_types[name]
+            if name in value_classes:
+                self.pkl_names.add(name)
+                return name
+            if name in ("List", "Listing", "Collection", "Set"):
+                generic = "Set" if name == "Set" else "List"
+                self.typing_names.add(generic)
+                return f"{generic}[{arguments[0] if arguments else self.type_hint({'kind': 'unknown'})}]"
+            if name in ("Map", "Mapping"):
+                self.typing_names.add("Dict")
+                if len(arguments) != 2:
+                    arguments = [self.type_hint({"kind": "unknown"})] * 2
+                return f"Dict[{arguments[0]}, {arguments[1]}]"
+            if name == "Dynamic":
+                self.typing_names.update(("Dict", "Any"))
+                return "Dict[str, Any]"
+        elif t["moduleUri"] == self.module_uri and name in self.class_names:
+            return self.class_names[name]
+        self.typing_names.add("Any")
+        return "Any"
+
+    def is_primitive(self, t: Dict[str, Any]) -> bool:
+        # whether values of t are always encoded as a single msgpack primitive
+        kind = t["kind"]
+        if kind == "stringLiteral":
+            return True
+        if kind == "nullable":
+            return self.is_primitive(t["member"])
+        if kind == "union":
+            return all(self.is_primitive(member) for member in t["members"])
+        return kind == "declared" and t["moduleUri"] == "pkl:base" and t["name"] in primitive_types
+
+    def dataclass(self, c: Dict[str, Any]) -> str:
+        lines = ["", "", "@dataclass(slots=True)", f"class {self.python_name(c)}:"]
+        for prop in c["properties"]:
+            name = field_name(prop["name"])
+            line = f"    {name}: {self.type_hint(prop['type'])}"
+            if name != prop["name"]:
+                self.needs_field = True
+                line += f" = field(metadata={{\"pkl_name\": {literal(prop['name'])}}})"
+            lines.append(line)
+        if not c["properties"]:
+            lines.append("    pass")
+        return "\n".join(lines)
+
+    def decode_function(self, c: Dict[str, Any]) -> str:
+        name = self.python_name(c)
+        qualified_name = c["qualifiedName"]
+        properties = c["properties"]
+        lines = [
+            "",
+            "",
+            f"def {function_name(name)}(decoder: Decoder) -> {name}:",
+            "    unpack = decoder.unpacker.unpack",
+            "    read_array_header = decoder.unpacker.read_array_header",
+            f"    if read_array_header() != {len(properties)}:",
+            f"        raise schema_changed({literal(qualified_name)})",
+        ]
+        values = []
+        for i, prop in enumerate(properties):
+            value = "v_" + field_name(prop["name"])
+            values.append(value)
+            lines += [
+                "    read_array_header()",
+                f"    if unpack() != 0x10 or unpack() != {literal(prop['name'])}:",
+                f"        raise schema_changed({literal(qualified_name)})",
+            ]
+            t = prop["type"]
+            if self.is_primitive(t):
+                lines.append(f"    {value} = unpack()")
+            elif t["kind"] == "declared" and t["moduleUri"] == "pkl:base" and t["name"] in (
+                "Duration",
+                "DataSize",
+            ):
+                unit = t["name"] + "Unit"
+                self.pkl_names.update((t["name"], unit))
+                lines += [
+                    "    read_array_header()",
+                    "    unpack()",
+                    f"    {value} = {t['name']}(unpack(), {unit}(unpack()))",
+                ]
+            else:
+                lines.append(f"    {value} = decoder.decode_any()")
+                if i < len(properties) - 1:
+                    # decode_any replaces the unpacker if it meets a list nested too deeply
+                    lines += [
+                        "    unpack = decoder.unpacker.unpack",
+                        "    read_array_header = decoder.unpacker.read_array_header",
+                    ]
+        lines.append(f"    return {name}({', '.join(values)})")
+        return "\n".join(lines)
+
+    def register_function(self) -> str:
+        lines = [
+            "",
+            "",
+            "def register_all(registry: Registry = default_registry):",
+        ]
+        for c in self.classes:
+            if c["abstract"]:
+                continue
+            name = self.python_name(c)
+            lines.append(
+                f"    registry.register(MODULE_URI, {literal(c['qualifiedName'])}, {name}, {function_name(name)})"
+            )
+        if len(lines) == 3:
+            lines.append("    pass")
+        return "\n".join(lines)
+
+
+def module_uri(module: str) -> str:
+    # module is a path on the file system, or the URI of a module
+    if re.match(r"^[a-z][a-z0-9+.-]+:", module) and not os.path.exists(module):
+        return module
+    from .evaluator.module_source import FileSource
+
+    return FileSource(module).uri
+
+
+async def run(pkl_command: List[str], module: str) -> str:
+    from .evaluator.evaluator_exec import new_evaluator_with_command
+    from .evaluator.preconfigured_options import PreconfiguredOptions
+
+    evaluator = await new_evaluator_with_command(pkl_command, PreconfiguredOptions)
+    try:
+        return generate(await load_schema(evaluator, module_uri(module)))
+    finally:
+        evaluator.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pkl_python codegen", description=__doc__.split("\n\n")[0]
+    )
+    parser.add_argument("module", help="path or URI of the Pkl module to generate code for")
+    parser.add_argument("-o", "--output", help="file to write the module to; defaults to stdout")
+    parser.add_argument(
+        "--pkl",
+        help="the pkl command to run; defaults to $PKL_EXEC, then pkl",
+    )
+    args = parser.parse_args(argv)
+
+    pkl_command = args.pkl.split(" ") if args.pkl else []
+    source = asyncio.run(run(pkl_command, args.module))
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(source)
+    else:
+        sys.stdout.write(source)
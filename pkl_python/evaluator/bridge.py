@@ -0,0 +1,248 @@
+"""
+A bridge that lets many processes share one long-lived `pkl server`.
+
+The bridge listens on a Unix domain socket or a TCP port, and forwards the messages of every
+client connection to a single `pkl server` child process. Each client talks to the bridge
+exactly as it would talk to `pkl server` over stdin and stdout; connect to it with
+UnixSocketTransport or TcpTransport.
+
+Request IDs chosen by clients may collide, so the bridge rewrites them on the way to Pkl and
+restores them on the way back. Messages that Pkl sends on behalf of an evaluator (logs, reads
+and list requests) go to the client that created the evaluator, and only that client may send
+messages for it.
+
+The bridge stops reading from a client while Pkl is not keeping up with its input, and stops
+reading from Pkl while a client is not keeping up with its output.
+
+Run a bridge with:
+
+    python -m pkl_python.evaluator.bridge --unix /run/pkl.sock
+    python -m pkl_python.evaluator.bridge --tcp 127.0.0.1:7777
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import msgpack
+
+from ..types import codes
+from .evaluator_manager import EvaluatorManagerImpl, next_read_size, pack_message
+from .transport import SubprocessTransport, Transport
+
+log = logging.getLogger(__name__)
+
+# Responses that Pkl sends to a request it received; the request ID was chosen by the client.
+client_request_responses = {codes.NewEvaluatorResponse, codes.EvaluateResponse}
+
+
+class BridgeClient:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.packer = msgpack.Packer()
+        self.evaluator_ids: Set[int] = set()
+
+    def send(self, code: int, msg: dict):
+        self.writer.write(pack_message(self.packer, code, msg))
+
+    async def drain(self):
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            # the client is gone; handle_client cleans up after it
+            pass
+
+
+class Bridge:
+    def __init__(self, upstream: Transport):
+        self.upstream = upstream
+        self.packer = msgpack.Packer()
+        self.request_ids = itertools.count(1)
+        # upstream request ID -> (client, client request ID)
+        self.requests: Dict[int, Tuple[BridgeClient, int]] = {}
+        self.evaluators: Dict[int, BridgeClient] = {}
+        self.clients: List[BridgeClient] = []
+        # clients sent messages since their output was last drained
+        self.written: Set[BridgeClient] = set()
+        self.min_read_bytes = 64 * 1024
+        self.max_read_bytes = 4 * 1024 * 1024
+        self.started = None
+
+    async def start(self):
+        if not self.started:
+            self.started = asyncio.ensure_future(self.start_upstream())
+        await self.started
+
+    async def start_upstream(self):
+        await self.upstream.connect(self.max_read_bytes)
+        self.listener = asyncio.create_task(self.listen_upstream())
+
+    async def serve_unix(self, path: str) -> asyncio.AbstractServer:
+        await self.start()
+        return await asyncio.start_unix_server(
+            self.handle_client, path, limit=self.max_read_bytes
+        )
+
+    async def serve_tcp(self, host: str, port: int) -> asyncio.AbstractServer:
+        await self.start()
+        return await asyncio.start_server(
+            self.handle_client, host, port, limit=self.max_read_bytes
+        )
+
+    def close(self):
+        for client in self.clients:
+            client.writer.close()
+        self.upstream.close()
+
+    async def read_messages(
+        self,
+        stream: asyncio.StreamReader,
+        handle: Callable[[int, dict], None],
+        drain: Callable[[], Awaitable[None]],
+    ):
+        # drain is awaited after the messages of each read are handled, so that nothing more
+        # is read until the other side has taken in what they produced
+        unpacker = msgpack.Unpacker()
+        read_bytes = self.min_read_bytes
+        while True:
+            data = await stream.read(read_bytes)
+            if not data:
+                return
+            unpacker.feed(data)
+            for code, msg in unpacker:
+                handle(code, msg)
+            await drain()
+            read_bytes = next_read_size(
+                read_bytes, len(data), self.min_read_bytes, self.max_read_bytes
+            )
+
+    async def listen_upstream(self):
+        try:
+            await self.read_messages(self.upstream.reader, self.handle_upstream, self.drain_clients)
+        finally:
+            log.warning("pkl server exited; closing all bridge clients")
+            for client in self.clients:
+                client.writer.close()
+
+    def handle_upstream(self, code: int, msg: dict):
+        if code in client_request_responses:
+            pending = self.requests.pop(msg["requestId"], None)
+            if not pending:
+                log.warning(f"received a message for an unknown request id: {msg['requestId']}")
+                return
+            client, msg["requestId"] = pending
+            if code == codes.NewEvaluatorResponse and msg.get("evaluatorId") is not None:
+                self.evaluators[msg["evaluatorId"]] = client
+                client.evaluator_ids.add(msg["evaluatorId"])
+        else:
+            client = self.evaluators.get(msg.get("evaluatorId"))
+            if not client:
+                log.warning(f"received a message for an unknown evaluator: {msg}")
+                return
+        client.send(code, msg)
+        self.written.add(client)
+
+    async def drain_clients(self):
+        written, self.written = self.written, set()
+        for client in written:
+            await client.drain()
+
+    async def handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        client = BridgeClient(reader, writer)
+        self.clients.append(client)
+
+        def handle(code: int, msg: dict):
+            if code != codes.NewEvaluator and msg.get("evaluatorId") not in client.evaluator_ids:
+                log.warning(f"dropping a message for an evaluator the client does not own: {msg}")
+                if code == codes.Evaluate:
+                    client.send(
+                        codes.EvaluateResponse,
+                        {
+                            "requestId": msg["requestId"],
+                            "evaluatorId": msg.get("evaluatorId"),
+                            "error": f"unknown evaluator id: {msg.get('evaluatorId')}",
+                        },
+                    )
+                return
+            if code in (codes.NewEvaluator, codes.Evaluate):
+                request_id = next(self.request_ids)
+                self.requests[request_id] = (client, msg["requestId"])
+                msg["requestId"] = request_id
+            elif code == codes.CloseEvaluator:
+                self.evaluators.pop(msg["evaluatorId"], None)
+                client.evaluator_ids.discard(msg["evaluatorId"])
+            self.upstream.writer.write(pack_message(self.packer, code, msg))
+
+        async def drain():
+            await self.upstream.writer.drain()
+            # rejected evaluations are answered by the bridge itself
+            await client.drain()
+
+        try:
+            await self.read_messages(reader, handle, drain)
+        finally:
+            self.disconnect(client)
+
+    def disconnect(self, client: BridgeClient):
+        self.clients.remove(client)
+        self.written.discard(client)
+        for evaluator_id in client.evaluator_ids:
+            self.evaluators.pop(evaluator_id, None)
+            self.upstream.writer.write(
+                pack_message(
+                    self.packer, codes.CloseEvaluator, {"evaluatorId": evaluator_id}
+                )
+            )
+        for request_id, (owner, _) in list(self.requests.items()):
+            if owner is client:
+                del self.requests[request_id]
+        client.writer.close()
+
+
+def parse_address(args) -> Tuple[Optional[str], Optional[Tuple[str, int]]]:
+    if args.tcp:
+        host, _, port = args.tcp.rpartition(":")
+        return None, (host or "127.0.0.1", int(port))
+    return args.unix, None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument("--unix", help="path of the Unix domain socket to listen on")
+    address.add_argument("--tcp", help="host:port to listen on")
+    parser.add_argument(
+        "--pkl",
+        help="the pkl command to run; defaults to $PKL_EXEC, then pkl",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    pkl_command = args.pkl.split(" ") if args.pkl else []
+    program, pkl_args = EvaluatorManagerImpl(pkl_command).get_start_command()
+    bridge = Bridge(SubprocessTransport(program, pkl_args))
+    path, tcp = parse_address(args)
+    if path:
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await bridge.serve_unix(path)
+    else:
+        server = await bridge.serve_tcp(*tcp)
+    log.info(f"bridge listening on {path or tcp}")
+    try:
+        async with server:
+            await asyncio.wait(
+                [asyncio.ensure_future(server.serve_forever()), bridge.listener],
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+    finally:
+        bridge.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,204 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import msgpack
+
+from .decoder import (
+    Decoder,
+    codeList,
+    codeListing,
+    codeObject,
+    codeObjectMemberProperty,
+    kindArray,
+    kindPrimitive,
+    value_kinds,
+)
+
+# msgpack type bytes of fixed-width numbers, mapped to the big-endian type of the payload that
+# follows them. Pkl encodes every Float as a float 64, and each Int in the smallest of these
+# types that holds it.
+fixed_width_types = {
+    0xCA: ">f4",
+    0xCB: ">f8",
+    0xCC: ">u1",
+    0xCD: ">u2",
+    0xCE: ">u4",
+    0xCF: ">u8",
+    0xD0: ">i1",
+    0xD1: ">i2",
+    0xD2: ">i4",
+    0xD3: ">i8",
+}
+
+# element types of listings that are copied straight into an array, and the array's dtype
+scalar_dtypes = {
+    frozenset([int]): "int64",
+    frozenset([float]): "float64",
+    frozenset([bool]): "bool_",
+}
+
+
+def decode_numpy(data: bytes, decoder: Optional[Decoder] = None):
+    """
+    decode_numpy decodes an encoded List or Listing straight into NumPy arrays.
+
+    A listing of Ints, Floats or Booleans becomes a single array of that type. When all of its
+    elements are encoded with the same width, which is always the case for Floats, the array is
+    read with one vectorized pass over the encoded bytes, without a Python object per element.
+    Ints of mixed widths, such as 0 to 1000, cannot be located without reading each one in
+    turn; they are unpacked by msgpack and copied into an int64 array, which is only somewhat
+    faster than decoding them and calling numpy.array.
+    A listing of objects of one class becomes a dict with one array per property.
+    Columns that are not numeric or boolean, such as strings, nullable values or nested values,
+    become arrays of dtype object.
+
+    Use it on the raw bytes of a result:
+
+        table = decode_numpy(await evaluator.evaluate_expression_raw(source, "capacity"))
+    """
+    numpy = import_optional("numpy", "decode_numpy")
+    kind, value = read_columns(memoryview(data), decoder, numpy)
+    if kind == "records":
+        return {name: to_numpy_array(numpy, column) for name, column in value.items()}
+    return value if isinstance(value, numpy.ndarray) else to_numpy_array(numpy, value)
+
+
+def decode_arrow(data: bytes, decoder: Optional[Decoder] = None):
+    """
+    decode_arrow is like decode_numpy, but returns a pyarrow Array for a listing of scalars, and
+    a pyarrow RecordBatch with one column per property for a listing of objects.
+    """
+    pyarrow = import_optional("pyarrow", "decode_arrow")
+    numpy = import_optional("numpy", "decode_arrow")
+    kind, value = read_columns(memoryview(data), decoder, numpy)
+    if kind == "records":
+        return pyarrow.record_batch({name: pyarrow.array(column) for name, column in value.items()})
+    return pyarrow.array(value)
+
+
+def import_optional(module: str, feature: str):
+    try:
+        return __import__(module)
+    except ImportError as e:
+        raise ImportError(f"{feature} requires {module}, install it with `pip install {module}`") from e
+
+
+def to_numpy_array(numpy, values: List[Any]):
+    array = numpy.array(values)
+    # anything but booleans and numbers, strings included, is kept as Python objects
+    if array.dtype.kind not in "biuf":
+        return numpy.array(values, dtype=object)
+    return array
+
+
+def read_columns(data: memoryview, decoder: Optional[Decoder], numpy) -> Tuple[str, Any]:
+    # Returns ("scalars", array or list) for a listing of primitives, or ("records", columns)
+    # for a listing of objects, where columns maps each property name to its values.
+    decoder = Decoder(decoder.registry if decoder is not None else None)
+    unpacker = msgpack.Unpacker(raw=False, max_buffer_size=0, strict_map_key=False)
+    unpacker.feed(data)
+    decoder.data = data
+    decoder.unpacker = unpacker
+    code = None
+    if value_kinds[data[0]] == kindArray:
+        unpacker.read_array_header()
+        code = unpacker.unpack()
+    if code not in (codeList, codeListing):
+        raise ValueError("expected a List or Listing")
+    start = unpacker.tell()
+    length = unpacker.read_array_header()
+    first = unpacker.tell()
+    if length == 0:
+        return "scalars", []
+    if value_kinds[data[first]] == kindPrimitive:
+        array = read_fixed_width(data, first, length, numpy)
+        if array is not None:
+            return "scalars", array
+        # the listing is the rest of the result, so it can be unpacked in one call
+        values = msgpack.unpackb(data[start:], raw=False)
+        types = set(map(type, values))
+        if list in types:
+            raise ValueError("listing elements must all be primitives, or all be objects")
+        dtype = scalar_dtypes.get(frozenset(types))
+        if dtype is not None:
+            try:
+                return "scalars", numpy.fromiter(values, getattr(numpy, dtype), count=length)
+            except OverflowError:
+                # UInt64 values past the range of int64
+                pass
+        return "scalars", values
+    return "records", read_records(decoder, length)
+
+
+def read_fixed_width(data: memoryview, first: int, length: int, numpy):
+    # A listing whose elements all have the same encoding is an array of fixed-size records, a
+    # type byte then a big-endian payload (or just the byte, for small ints), that NumPy can read
+    # in place. Returns None for any other listing.
+    size, remainder = divmod(len(data) - first, length)
+    if remainder:
+        return None
+    if size == 1:
+        # positive and negative fixints, which read as int8 are their own values
+        encoded = numpy.frombuffer(data, dtype=numpy.uint8, count=length, offset=first)
+        if not ((encoded < 0x80) | (encoded >= 0xE0)).all():
+            return None
+        return encoded.view(numpy.int8).astype(numpy.int64)
+    type_byte = data[first]
+    payload = fixed_width_types.get(type_byte)
+    if payload is None or numpy.dtype(payload).itemsize + 1 != size:
+        return None
+    records = numpy.frombuffer(
+        data, dtype=numpy.dtype([("type", "u1"), ("value", payload)]), count=length, offset=first
+    )
+    if not (records["type"] == type_byte).all():
+        return None
+    return records["value"].astype(numpy.float64 if payload[1] == "f" else numpy.int64)
+
+
+def read_records(decoder: Decoder, length: int) -> Dict[str, List[Any]]:
+    unpacker = decoder.unpacker
+    data = decoder.data
+    tell = unpacker.tell
+    unpack = unpacker.unpack
+    read_array_header = unpacker.read_array_header
+    decode_any = decoder.decode_any
+    columns: Dict[str, List[Any]] = {}
+    cls = None
+    for i in range(length):
+        if value_kinds[data[tell()]] != kindArray:
+            raise ValueError("listing elements must all be objects of the same class")
+        read_array_header()
+        if unpack() != codeObject:
+            raise ValueError("listing elements must all be objects of the same class")
+        name = unpack()
+        module_uri = unpack()
+        if cls is None:
+            cls = (module_uri, name)
+        elif cls != (module_uri, name):
+            raise ValueError(
+                f"listing elements must all be objects of the same class; found {name} after {cls[1]}"
+            )
+        count = read_array_header()
+        if i > 0 and count != len(columns):
+            raise ValueError(f"element {i} does not have the same properties as element 0")
+        for _ in range(count):
+            read_array_header()
+            if unpack() != codeObjectMemberProperty:
+                raise ValueError("only object properties can be exported as columns")
+            key = unpack()
+            if i == 0:
+                column = columns[key] = []
+            else:
+                column = columns.get(key)
+                if column is None:
+                    raise ValueError(f"element {i} has property {key} that element 0 does not")
+            if value_kinds[data[tell()]] == kindPrimitive:
+                column.append(unpack())
+            else:
+                column.append(decode_any())
+                # decode_any replaces the unpacker if it meets a list nested too deeply
+                unpacker = decoder.unpacker
+                data = decoder.data
+                tell = unpacker.tell
+                unpack = unpacker.unpack
+                read_array_header = unpacker.read_array_header
+    return columns
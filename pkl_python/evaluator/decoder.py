@@ -1,5 +1,9 @@
+import dataclasses
 import msgpack
-from typing import Any, Dict, List, Union
+from typing import Any, Callable, Iterator, List, Optional, Type, Union
+
+from pkl_python.types.pkl import DataSize, DataSizeUnit, Duration, DurationUnit, IntSeq, Regex
+from .registry import Registry, default_registry
 
 # Define the constants
 codeObject = 0x1
@@ -40,100 +44,480 @@ Code = Union[
     codeObjectMemberElement,
 ]
 
+# The kind of msgpack value that starts with a given type byte. Pkl encodes every non-primitive
+# value as an array whose first element is its code; maps only appear inside those arrays.
+kindPrimitive = 0
+kindArray = 1
+kindMap = 2
+value_kinds = bytes(
+    kindArray
+    if 0x90 <= b <= 0x9F or b in (0xDC, 0xDD)
+    else kindMap
+    if 0x80 <= b <= 0x8F or b in (0xDE, 0xDF)
+    else kindPrimitive
+    for b in range(256)
+)
+# The size of the array or map header that starts with a given type byte.
+header_sizes = bytes(3 if b in (0xDC, 0xDE) else 5 if b in (0xDD, 0xDF) else 1 for b in range(256))
+
+
+# The kinds of container a Decoder frame is filling in.
+frameList = 0
+frameSet = 1
+framePair = 2
+frameMap = 3
+frameObject = 4
+frameRecord = 5
+frameDynamic = 6
+
+# marks a Map entry or Dynamic entry whose key has not been decoded yet
+missing = object()
+
+# Units by their Pkl names; looking them up here is much cheaper than calling the Enum.
+duration_units = {unit.value: unit for unit in DurationUnit}
+data_size_units = {unit.value: unit for unit in DataSizeUnit}
+# The Pkl values that are a fixed-size array of primitives, by their code, and how to build
+# them. A property holding one of these is decoded in place rather than given a frame.
+fixarray3 = 0x93
+leaf_objects = {
+    codeDuration: (Duration, duration_units, DurationUnit),
+    codeDataSize: (DataSize, data_size_units, DataSizeUnit),
+}
+
 
 class Decoder:
-    def __init__(self):
-        self.decoder = msgpack.Unpacker(raw=False)
-
-    def decode(self, bytes: bytes) -> Any:
-        self.decoder.feed(bytes)
-        return self.decode_any(next(self.decoder))
-
-    def decode_code(self, code: Code, rest: List[Any]) -> Dict[str, Any]:
-        if code == codeObject:
-            name, module_uri, entries = rest
-            if name == "Dynamic" and module_uri == "pkl:base":
-                return self.decode_dynamic(entries)
-            return self.decode_object(name, module_uri, entries)
-        elif code in [codeMap, codeMapping]:
-            (map,) = rest
-            return self.decode_map(map)
-        elif code in [codeList, codeListing]:
-            (list,) = rest
-            return self.decode_list(list)
-        elif code == codeSet:
-            (list,) = rest
-            return set(self.decode_list(list))
-        elif code == codeDuration:
-            value, unit = rest
-            return {"value": value, "unit": unit}
-        elif code == codeDataSize:
-            value, unit = rest
-            return {"value": value, "unit": unit}
-        elif code == codePair:
-            first, second = rest
-            return [self.decode_any(first), self.decode_any(second)]
-        elif code == codeIntSeq:
-            start, end, step = rest
-            return {"start": start, "end": end, "step": step}
-        elif code == codeRegex:
-            (pattern,) = rest
-            return {"pattern": pattern}
-        elif code in [codeClass, codeTypeAlias]:
-            return {}
-        else:
-            raise ValueError(f"encountered unknown object code: {code}")
-
-    def decode_object(
-        self, name: str, rest: List[Code]
-    ) -> Dict[str, Any]:
-        out = {}
-        for entry in rest:
-            code, *rest = entry
-            if code == codeObjectMemberProperty:
-                name, value = rest
-                out[name] = self.decode_any(value)
-            elif code in [codeObjectMemberEntry, codeObjectMemberElement]:
-                raise ValueError("Unexpected object member entry in non-Dynamic object")
-        return out
-
-    def decode_dynamic(self, rest: List[Code]) -> Dict[str, Any]:
-        properties = {}
-        entries = {}
-        elements = []
-        for entry in rest:
-            code, *rest = entry
-            if code == codeObjectMemberProperty:
-                name, value = rest
-                if not isinstance(name, str):
-                    raise ValueError("object member property keys must be strings")
-                properties[name] = self.decode_any(value)
-            elif code == codeObjectMemberEntry:
-                key, value = rest
-                entries[self.decode_any(key)] = self.decode_any(value)
-            elif code == codeObjectMemberElement:
-                i, value = rest
-                if not isinstance(i, int):
-                    raise ValueError("object member element indices must be numbers")
-                elements.append(self.decode_any(value))
-        return {"properties": properties, "entries": entries, "elements": elements}
-
-    def decode_map(self, map: Dict[Any, Any]) -> Dict[Any, Any]:
-        return {self.decode_any(k): self.decode_any(v) for k, v in map.items()}
-
-    def decode_list(self, list: List[Any]) -> List[Any]:
-        return [self.decode_any(item) for item in list]
-
-    def decode_any(self, value: Any) -> Any:
-        if value is None:
-            return value
-        if isinstance(value, list):
-            # object case
-            code, *rest = value
-            return self.decode_code(code, rest)
-        if isinstance(value, dict):
-            raise ValueError(
-                f"unexpected object {value} provided to decode_any; expected primitive type or list"
-            )
-        # primitives
-        return value
+    """
+    Decoder turns the msgpack encoding of a Pkl value into Python values in a single pass.
+
+    Values are built while walking the stream with msgpack.Unpacker's header-level API, so no
+    intermediate tree of lists is created. The first byte of each value, read straight from
+    the input, tells primitives (unpacked whole) from Pkl objects (dispatched on their code).
+
+    Nesting is tracked on an explicit stack of frames rather than through recursion, so values
+    of any depth decode without a RecursionError and without a Python call per nested value.
+
+    Typed objects whose class is in the registry decode to instances of the registered Python
+    class; other typed objects decode to dicts of their properties.
+    """
+
+    def __init__(self, registry: Optional[Registry] = None):
+        self.registry = registry if registry is not None else default_registry
+
+    def decode(self, data: bytes) -> Any:
+        self.data = data
+        self.unpacker = new_unpacker(data)
+        try:
+            return self.decode_any()
+        finally:
+            self.data = self.unpacker = None
+
+    def iter_elements(self, data: bytes) -> Iterator[Any]:
+        """
+        Yields the decoded elements of an encoded List, Listing or Set one at a time, so that
+        only the element being handed out is held in decoded form.
+
+        Iteration uses a Decoder of its own, so it may be interleaved with other decodes.
+        """
+        decoder = Decoder(self.registry)
+        decoder.data = data
+        decoder.unpacker = unpacker = new_unpacker(data)
+        if value_kinds[data[0]] != kindArray:
+            raise ValueError(f"expected a List, Listing or Set; got {unpacker.unpack()}")
+        unpacker.read_array_header()
+        code = unpacker.unpack()
+        if code not in (codeList, codeListing, codeSet):
+            raise ValueError(f"expected a List, Listing or Set; got object code {code}")
+        for _ in range(unpacker.read_array_header()):
+            yield decoder.decode_any()
+
+    def decode_any(self) -> Any:
+        """
+        Decodes the value at the unpacker's position, leaving the unpacker just past it.
+        """
+        registry = self.registry
+        classes = registry.classes
+        object_decoders = registry.decoders
+        data = self.data
+        unpacker = self.unpacker
+        tell = unpacker.tell
+        unpack = unpacker.unpack
+        skip = unpacker.skip
+        read_array_header = unpacker.read_array_header
+        read_map_header = unpacker.read_map_header
+
+        # Each frame is [kind, container, members left to start, pending, extra]. pending is
+        # what the next decoded value is for: a property name, record field position or key.
+        # extra is the ObjectDecoder of a record, the member container a Dynamic is filling in,
+        # or for a list walked by an unpacker of its own, the data and unpacker to go back to.
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        # whether lists that start with a primitive may be unpacked whole
+        bulk = True
+        while True:
+            # Start the value at the current position. Scalars are decoded into value right
+            # away; containers push a frame, which the loop below fills in.
+            top = None
+            kind = value_kinds[data[tell()]]
+            if kind == kindPrimitive:
+                value = unpack()
+            elif kind == kindMap:
+                raise ValueError(
+                    f"unexpected object {unpack()} provided to decode_any; expected primitive type or list"
+                )
+            else:
+                length = read_array_header()
+                code = unpack()
+                if code == codeObject:
+                    name = unpack()
+                    module_uri = unpack()
+                    if name == "Dynamic" and module_uri == "pkl:base":
+                        top = [frameDynamic, ({}, {}, []), read_array_header(), None, None]
+                    else:
+                        object_decoder = None
+                        if classes:
+                            key = (module_uri, name)
+                            object_decoder = object_decoders.get(key)
+                            if object_decoder is None:
+                                cls = classes.get(key)
+                                if cls is not None:
+                                    object_decoder = object_decoders[key] = compile_object_decoder(
+                                        cls, registry.decode_functions.get(key)
+                                    )
+                        if object_decoder is None:
+                            top = [frameObject, {}, read_array_header(), None, None]
+                        elif object_decoder.decode is not None:
+                            # a generated decode function reads the members itself
+                            self.data = data
+                            self.unpacker = unpacker
+                            value = object_decoder.decode(self)
+                            data = self.data
+                            unpacker = self.unpacker
+                            tell = unpacker.tell
+                            unpack = unpacker.unpack
+                            skip = unpacker.skip
+                            read_array_header = unpacker.read_array_header
+                            read_map_header = unpacker.read_map_header
+                        else:
+                            values = object_decoder.defaults.copy()
+                            top = [frameRecord, values, read_array_header(), None, object_decoder]
+                elif code == codeList or code == codeListing or code == codeSet:
+                    frame_kind = frameSet if code == codeSet else frameList
+                    start = tell()
+                    first = start + header_sizes[data[start]]
+                    if bulk and (first >= len(data) or value_kinds[data[first]] == kindPrimitive):
+                        # Listings are usually homogeneous, so one that starts with a primitive
+                        # is unpacked whole. If it turns out to hold Pkl values after all, its
+                        # bytes are walked again by an unpacker of their own.
+                        try:
+                            value = unpack()
+                        except msgpack.StackError:
+                            # Nested too deeply for msgpack to unpack in one go, which leaves
+                            # the unpacker unusable. Carry on with a new one from this list on,
+                            # and decode lists element by element from here.
+                            bulk = False
+                            value = None
+                            data = memoryview(data)[start:]
+                            unpacker = new_unpacker(data)
+                            tell = unpacker.tell
+                            unpack = unpacker.unpack
+                            skip = unpacker.skip
+                            read_array_header = unpacker.read_array_header
+                            read_map_header = unpacker.read_map_header
+                            top = [frame_kind, [], read_array_header(), None, None]
+                        if value is not None:
+                            if list in map(type, value):
+                                saved = (data, unpacker)
+                                data = data[start : tell()]
+                                unpacker = new_unpacker(data)
+                                tell = unpacker.tell
+                                unpack = unpacker.unpack
+                                skip = unpacker.skip
+                                read_array_header = unpacker.read_array_header
+                                read_map_header = unpacker.read_map_header
+                                top = [frame_kind, [], read_array_header(), None, saved]
+                            elif frame_kind == frameSet:
+                                value = set(value)
+                    else:
+                        top = [frame_kind, [], read_array_header(), None, None]
+                elif code == codeMap or code == codeMapping:
+                    top = [frameMap, {}, read_map_header(), missing, None]
+                elif code == codeDuration:
+                    value = unpack()
+                    unit = unpack()
+                    value = Duration(value, duration_units.get(unit) or DurationUnit(unit))
+                elif code == codeDataSize:
+                    value = unpack()
+                    unit = unpack()
+                    value = DataSize(value, data_size_units.get(unit) or DataSizeUnit(unit))
+                elif code == codePair:
+                    top = [framePair, [], 2, None, None]
+                elif code == codeIntSeq:
+                    start = unpack()
+                    end = unpack()
+                    value = IntSeq(start, end, unpack())
+                elif code == codeRegex:
+                    value = Regex(unpack())
+                elif code == codeClass or code == codeTypeAlias:
+                    for _ in range(length - 1):
+                        skip()
+                    value = {}
+                else:
+                    raise ValueError(f"encountered unknown object code: {code}")
+
+            # Fill in the frame on top of the stack: hand it the value just decoded, if any,
+            # then take in as many of its following members as are primitives. A frame that
+            # is done is popped, and its result handed to the frame below; one that reaches a
+            # nested container goes back to the top of the outer loop to start it.
+            if top is None:
+                deliver = True
+            else:
+                push(top)
+                deliver = False
+            while True:
+                if deliver:
+                    if not stack:
+                        # the unpacker is replaced when a list is nested too deeply
+                        self.data = data
+                        self.unpacker = unpacker
+                        return value
+                    top = stack[-1]
+                frame_kind = top[0]
+
+                if frame_kind == frameObject:
+                    out = top[1]
+                    if deliver:
+                        out[top[3]] = value
+                    left = top[2]
+                    while left:
+                        left -= 1
+                        read_array_header()
+                        if unpack() != codeObjectMemberProperty:
+                            raise ValueError("Unexpected object member entry in non-Dynamic object")
+                        name = unpack()
+                        position = tell()
+                        if value_kinds[data[position]] != kindPrimitive:
+                            leaf = leaf_objects.get(data[position + 1]) if data[position] == fixarray3 else None
+                            if leaf is None:
+                                top[2] = left
+                                top[3] = name
+                                break
+                            read_array_header()
+                            unpack()
+                            value = unpack()
+                            unit = unpack()
+                            leaf_class, units, unit_class = leaf
+                            out[name] = leaf_class(value, units.get(unit) or unit_class(unit))
+                            continue
+                        out[name] = unpack()
+                    else:
+                        pop()
+                        value = out
+                        deliver = True
+                        continue
+                    break
+
+                elif frame_kind <= framePair:
+                    out = top[1]
+                    if deliver:
+                        out.append(value)
+                    left = top[2]
+                    append = out.append
+                    while left:
+                        left -= 1
+                        if value_kinds[data[tell()]] != kindPrimitive:
+                            top[2] = left
+                            break
+                        append(unpack())
+                    else:
+                        pop()
+                        value = set(out) if frame_kind == frameSet else out
+                        deliver = True
+                        saved = top[4]
+                        if saved is not None:
+                            # back to the unpacker that was walking the data around this list
+                            data, unpacker = saved
+                            tell = unpacker.tell
+                            unpack = unpacker.unpack
+                            skip = unpacker.skip
+                            read_array_header = unpacker.read_array_header
+                            read_map_header = unpacker.read_map_header
+                        continue
+                    break
+
+                elif frame_kind == frameMap:
+                    out = top[1]
+                    key = top[3]
+                    if deliver:
+                        if key is missing:
+                            key = value
+                        else:
+                            out[key] = value
+                            key = missing
+                    left = top[2]
+                    nested = False
+                    while True:
+                        if key is missing:
+                            if not left:
+                                break
+                            left -= 1
+                            if value_kinds[data[tell()]] != kindPrimitive:
+                                nested = True
+                                break
+                            key = unpack()
+                        if value_kinds[data[tell()]] != kindPrimitive:
+                            nested = True
+                            break
+                        out[key] = unpack()
+                        key = missing
+                    if nested:
+                        top[2] = left
+                        top[3] = key
+                        break
+                    pop()
+                    value = out
+                    deliver = True
+                    continue
+
+                elif frame_kind == frameRecord:
+                    out = top[1]
+                    if deliver:
+                        out[top[3]] = value
+                    left = top[2]
+                    positions = top[4].positions
+                    while left:
+                        left -= 1
+                        read_array_header()
+                        if unpack() != codeObjectMemberProperty:
+                            raise ValueError("Unexpected object member entry in non-Dynamic object")
+                        position = positions.get(unpack())
+                        if position is None:
+                            skip()
+                            continue
+                        if value_kinds[data[tell()]] != kindPrimitive:
+                            top[2] = left
+                            top[3] = position
+                            break
+                        out[position] = unpack()
+                    else:
+                        pop()
+                        value = top[4].build(out)
+                        deliver = True
+                        continue
+                    break
+
+                else:
+                    properties, entries, elements = top[1]
+                    key = top[3]
+                    target = top[4]
+                    if deliver:
+                        if target is elements:
+                            elements.append(value)
+                            target = None
+                        elif key is missing:
+                            # an entry key; its value comes next
+                            key = value
+                        else:
+                            target[key] = value
+                            target = None
+                    left = top[2]
+                    nested = False
+                    while True:
+                        if target is not None:
+                            # an entry whose key has been decoded, waiting for its value
+                            if value_kinds[data[tell()]] != kindPrimitive:
+                                nested = True
+                                break
+                            entries[key] = unpack()
+                            target = None
+                        if not left:
+                            break
+                        left -= 1
+                        read_array_header()
+                        code = unpack()
+                        if code == codeObjectMemberProperty:
+                            key = unpack()
+                            if not isinstance(key, str):
+                                raise ValueError("object member property keys must be strings")
+                            if value_kinds[data[tell()]] != kindPrimitive:
+                                target = properties
+                                nested = True
+                                break
+                            properties[key] = unpack()
+                        elif code == codeObjectMemberEntry:
+                            target = entries
+                            if value_kinds[data[tell()]] != kindPrimitive:
+                                key = missing
+                                nested = True
+                                break
+                            key = unpack()
+                        elif code == codeObjectMemberElement:
+                            if not isinstance(unpack(), int):
+                                raise ValueError("object member element indices must be numbers")
+                            if value_kinds[data[tell()]] != kindPrimitive:
+                                target = elements
+                                nested = True
+                                break
+                            elements.append(unpack())
+                    if nested:
+                        top[2] = left
+                        top[3] = key
+                        top[4] = target
+                        break
+                    pop()
+                    value = {"properties": properties, "entries": entries, "elements": elements}
+                    deliver = True
+                    continue
+
+
+def new_unpacker(data) -> msgpack.Unpacker:
+    unpacker = msgpack.Unpacker(raw=False, max_buffer_size=0, strict_map_key=False)
+    unpacker.feed(data)
+    return unpacker
+
+
+class ObjectDecoder:
+    """
+    ObjectDecoder holds what a Decoder needs to build instances of a registered dataclass: the
+    constructor position of each Pkl property, and the defaults of fields a Pkl object may omit.
+    decode is the class's registered decode function, if it has one.
+    """
+
+    __slots__ = ("cls", "positions", "defaults", "factories", "required", "decode")
+
+    def __init__(self, cls: Type, decode: Optional[Callable] = None):
+        fields = [field for field in dataclasses.fields(cls) if field.init]
+        self.cls = cls
+        self.decode = decode
+        self.positions = {
+            field.metadata.get("pkl_name", field.name): i for i, field in enumerate(fields)
+        }
+        self.defaults = [field.default for field in fields]
+        self.factories = [
+            (i, field.default_factory)
+            for i, field in enumerate(fields)
+            if field.default_factory is not dataclasses.MISSING
+        ]
+        self.required = {
+            i: field.name
+            for i, field in enumerate(fields)
+            if field.default is dataclasses.MISSING
+            and field.default_factory is dataclasses.MISSING
+        }
+
+    def build(self, values: List[Any]) -> Any:
+        for i, factory in self.factories:
+            if values[i] is dataclasses.MISSING:
+                values[i] = factory()
+        for i, name in self.required.items():
+            if values[i] is dataclasses.MISSING:
+                raise ValueError(f"{self.cls.__qualname__} is missing required property {name}")
+        return self.cls(*values)
+
+
+def compile_object_decoder(cls: Type, decode: Optional[Callable] = None) -> ObjectDecoder:
+    """
+    Resolves the properties of the dataclass cls to constructor positions once, so that
+    decoding an object of it is a dict lookup per property and a single constructor call.
+    """
+    return ObjectDecoder(cls, decode)
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urljoin, urlparse
+
+from .evaluator_options import EvaluatorOptions
+from .result_cache import CacheKey
+
+# Dependency is (kind, uri, content hash), where kind is "file" for files that Pkl reads
+# itself, or "module" or "resource" for what a client reader returned.
+Dependency = Tuple[str, str, Optional[str]]
+
+# hashes the current contents of a module or resource read by a client reader, or returns
+# None if it can no longer be read
+ReaderHash = Callable[[str, str], Optional[str]]
+
+# Every import, amends, extends and read is found by its keyword. An import, amends or extends
+# whose target is not a plain string literal, such as a custom-delimited #"..."#, makes the
+# dependencies unknowable, as does a read of anything but a plain string literal.
+keyword_pattern = re.compile(r"\b(?:import|amends|extends|read)\b")
+import_pattern = re.compile(r'(?:import\*?|amends|extends)(?:\s+|\s*\(\s*)"((?:[^"\\]|\\.)*)"')
+read_pattern = re.compile(r'read([?*]?)\s*\(\s*(?:"((?:[^"\\]|\\.)*)"\s*\))?')
+
+
+class DiskCache:
+    """
+    DiskCache keeps raw evaluation results in a SQLite database, so that they are reused
+    across processes and runs while nothing they depend on has changed.
+
+    Each result is stored with the dependencies of its evaluation and a hash of each: the
+    `file:` modules it imports, amends or extends, and the files it reads, found by scanning
+    module sources; and every module and resource a client reader returned to the evaluator.
+    A result is reused only while all of those hash the same, and only by the same version
+    of Pkl, since the standard library and packages that modules import are not hashed.
+
+    A module is not cached when its dependencies cannot be known from its source: when it
+    uses glob imports or reads, imports or reads anything but a plain string literal, or
+    imports modules over http(s), from the module path or from project dependencies.
+
+    get and put query SQLite and hash files, so callers on an event loop run them in an
+    executor.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, uri TEXT NOT NULL, result BLOB NOT NULL, "
+            "dependencies TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self, key: CacheKey, pkl_version: str, reader_hash: ReaderHash
+    ) -> Optional[bytes]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT result, dependencies FROM results WHERE key = ?",
+                (digest(key, pkl_version),),
+            ).fetchone()
+        if row is not None:
+            result, dependencies = row
+            if all(
+                current_hash(kind, uri, reader_hash) == hash
+                for kind, uri, hash in json.loads(dependencies)
+            ):
+                self.hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def put(
+        self,
+        key: CacheKey,
+        pkl_version: str,
+        result: memoryview,
+        dependencies: List[Dependency],
+    ):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (
+                    digest(key, pkl_version),
+                    key[1],
+                    bytes(result),
+                    json.dumps(dependencies),
+                    time.time(),
+                ),
+            )
+
+    def invalidate(self, uri: Optional[str] = None):
+        """
+        Drops the results of the module at uri, or every result if uri is None.
+        """
+        with self.lock:
+            if uri is None:
+                self.db.execute("DELETE FROM results")
+            else:
+                self.db.execute("DELETE FROM results WHERE uri = ?", (uri,))
+
+    def clear(self):
+        self.invalidate()
+
+    def close(self):
+        self.db.close()
+
+
+def open_disk_cache(opts: EvaluatorOptions) -> DiskCache:
+    """
+    Opens the DiskCache kept in the cache directory of opts.
+    """
+    if not opts.cache_dir:
+        raise ValueError("a disk cache needs EvaluatorOptions.cache_dir to be set")
+    return DiskCache(os.path.join(opts.cache_dir, "pkl-python", "results.sqlite3"))
+
+
+def digest(key: CacheKey, pkl_version: str) -> str:
+    fingerprint, uri, contents_hash, expr = key
+    encoded = json.dumps(
+        [pkl_version, fingerprint, uri, contents_hash and contents_hash.hex(), expr]
+    )
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def content_hash(contents: bytes) -> str:
+    return hashlib.sha256(contents).hexdigest()
+
+
+def file_path(uri: str) -> str:
+    return unquote(urlparse(uri).path)
+
+
+def read_file(uri: str) -> Optional[bytes]:
+    try:
+        with open(file_path(uri), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def current_hash(kind: str, uri: str, reader_hash: ReaderHash) -> Optional[str]:
+    if kind == "file":
+        contents = read_file(uri)
+        return None if contents is None else content_hash(contents)
+    return reader_hash(kind, uri)
+
+
+def file_dependencies(uri: str, text: Optional[str]) -> Optional[List[Dependency]]:
+    """
+    Returns the `file:` modules and files that the module at uri, with source text if given,
+    depends on, with their hashes. Returns None if its dependencies cannot all be known.
+    """
+    dependencies, complete = scan_file_dependencies(uri, text)
+    return dependencies if complete else None
+
+
+def scan_file_dependencies(uri: str, text: Optional[str]) -> Tuple[List[Dependency], bool]:
+    """
+    Like file_dependencies, but returns the dependencies that can be known, and whether
+    those are all of them.
+    """
+    dependencies: Dict[str, Optional[str]] = {}
+    complete = True
+    pending = [(uri, text)]
+    while pending:
+        uri, text = pending.pop()
+        if text is None:
+            if not uri.startswith("file:"):
+                complete = False
+                continue
+            contents = read_file(uri)
+            dependencies[uri] = None if contents is None else content_hash(contents)
+            if contents is None:
+                continue
+            text = contents.decode("utf-8", "replace")
+        for keyword in keyword_pattern.finditer(text):
+            if keyword.group(0) != "read":
+                match = import_pattern.match(text, keyword.start())
+                target = None if match is None else resolve(uri, match.group(1))
+                if target is None or match.group(0).startswith("import*"):
+                    complete = False
+                elif target.startswith("file:") and target not in dependencies:
+                    dependencies[target] = None
+                    pending.append((target, None))
+                continue
+            match = read_pattern.match(text, keyword.start())
+            if match is None:
+                # not a read expression, such as a property named read
+                continue
+            target = None if match.group(2) is None else resolve(uri, match.group(2))
+            if target is None or match.group(1) == "*":
+                complete = False
+            elif target.startswith("file:") and target not in dependencies:
+                contents = read_file(target)
+                dependencies[target] = None if contents is None else content_hash(contents)
+    return [("file", uri, hash) for uri, hash in sorted(dependencies.items())], complete
+
+
+def resolve(base: str, target: str) -> Optional[str]:
+    # The uri that an import or read of target from the module at base refers to, or None if
+    # what it refers to cannot be told from here. Custom schemes are left to the readers.
+    if target.startswith("@"):
+        return None
+    scheme = re.match(r"^([a-zA-Z][a-zA-Z0-9+.-]*):", target)
+    if scheme is None:
+        return urljoin(base, target) if base.startswith("file:") else None
+    if scheme.group(1).lower() in ("http", "https", "modulepath", "projectpackage"):
+        return None
+    return target
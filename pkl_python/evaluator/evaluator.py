@@ -1,230 +1,448 @@
-from asyncio import Future
-import random
-from typing import Any, Dict
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 from .module_source import ModuleSource
 from urllib.parse import urlparse
+from .reader import Reader
+from .evaluator_options import EvaluatorOptions, options_fingerprint
+from .lazy import decode_lazy
+from .output import output_payload, write_files, write_payload_async
+from .result_cache import CacheEntry, ResultCache, cache_key, decoded_value
+from .disk_cache import DiskCache, content_hash, file_dependencies
+from .scheduler import Priority
+from .watch import watch_expression
 from ..types.incoming import (
-    EvaluateResponse,
     ListModules,
     ListResources,
     Log,
     ReadModule,
     ReadResource,
 )
-from ..types.outgoing import Evaluate
-from ..types import codes
+from ..types.outgoing import (
+    Evaluate,
+    ListModulesResponse,
+    ListResourcesResponse,
+    PathElement,
+    ReadModuleResponse,
+    ReadResourceResponse,
+)
 from ..types.evaluator import Evaluator
 from ..types.evaluator_manager import EvaluatorManagerInterface
 
+log = logging.getLogger(__name__)
+
+
+# the text of every file in `output.files`, keyed by path
+output_files_expr = "output.files.toMap().mapValues((_, it) -> it.text)"
+
 
 class EvaluatorImpl(Evaluator):
-    def __init__(self, evaluator_id: int, manager: EvaluatorManagerInterface):
+    def __init__(
+        self,
+        evaluator_id: int,
+        manager: EvaluatorManagerInterface,
+        options: Optional[EvaluatorOptions] = None,
+    ):
         self.evaluator_id = evaluator_id
         self.manager = manager
-        self.pending_requests = {}
+        # options are kept so that the evaluator can be re-created in a new Pkl process
+        self.options = options
         self._closed = False
         self.resource_readers = []
         self.module_readers = []
-        self.rand_state = evaluator_id
+        # set for evaluators that own their manager, see evaluator_exec.new_evaluator
+        self.close_manager = False
+        # set to a ResultCache to reuse the results of repeated evaluations
+        self.result_cache: Optional[ResultCache] = None
+        # set to a DiskCache to reuse results across processes while their dependencies are
+        # unchanged
+        self.disk_cache: Optional[DiskCache] = None
+        # hashes of the modules and resources returned by client readers, kept while
+        # disk_cache is set; Pkl caches those for the life of the evaluator, so every
+        # evaluation may depend on any of them
+        self.reads: Dict[Tuple[str, str], str] = {}
+        self._options_fingerprint = None
+        # evaluations in flight, see single_flight, and how many requests have joined one
+        self.in_flight: Dict[Tuple, asyncio.Future] = {}
+        self.coalesced = 0
+        # set for evaluators shared by EvaluatorManagerImpl.get_or_create_evaluator, with the
+        # number of open handles on it and the timer that closes it once it is idle
+        self.shared_key: Optional[str] = None
+        self.references = 0
+        self.idle_timer: Optional[asyncio.TimerHandle] = None
+        # what the manager's recycling policies look at, see EvaluatorManagerImpl.evaluated
+        self.evaluations = 0
+        self.created = time.monotonic()
+        self.renew_task: Optional[asyncio.Task] = None
 
     def close(self):
-        self.closed = True
-        self.manager.close()
+        self._closed = True
+        self.manager.close_evaluator(self)
+        if self.close_manager:
+            self.manager.close()
     
     @property
     def closed(self):
         return self._closed
 
-    async def evaluate_expression(self, source: "ModuleSource", expr: str) -> Any:
-        bytes = await self.evaluate_expression_raw(source, expr)
-        return self.manager.decoder.decode(bytes)
+    async def evaluate_expression(
+        self,
+        source: "ModuleSource",
+        expr: str,
+        priority: Priority = Priority.INTERACTIVE,
+        lazy: bool = False,
+    ) -> Any:
+        if self.result_cache is not None:
+            entry = await self.evaluate_cached(source, expr, priority)
+            if lazy:
+                return decode_lazy(entry.raw, self.manager.decoder)
+            return decoded_value(entry, self.manager.decoder.decode)
+        if lazy:
+            # members are decoded on access rather than up front, see lazy.decode_lazy
+            bytes = await self.evaluate_expression_raw(source, expr, priority)
+            return decode_lazy(bytes, self.manager.decoder)
+        # concurrent callers of the same expression are handed the same decoded value
+        key = ("value",) + cache_key(self.options_fingerprint, source, expr)
+        return await self.single_flight(
+            key, lambda: self.decode_result(source, expr, priority)
+        )
+
+    async def decode_result(
+        self, source: "ModuleSource", expr: str, priority: Priority
+    ) -> Any:
+        return self.manager.decoder.decode(
+            await self.fetch_result(source, expr, priority)
+        )
+
+    async def stream_expression(
+        self,
+        source: "ModuleSource",
+        expr: str,
+        priority: Priority = Priority.INTERACTIVE,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[Any]:
+        bytes = await self.evaluate_expression_raw(source, expr, priority)
+        elements = self.manager.decoder.iter_elements(bytes)
+        for i, element in enumerate(elements, 1):
+            yield element
+            # hand the loop back every batch_size elements, so that a consumer that never
+            # awaits does not starve the manager's listener and other evaluations
+            if i % batch_size == 0:
+                await asyncio.sleep(0)
+
+    def watch(
+        self,
+        source: "ModuleSource",
+        expr: str,
+        priority: Priority = Priority.INTERACTIVE,
+        debounce: float = 0.1,
+        poll_interval: float = 1.0,
+    ) -> AsyncIterator[Any]:
+        return watch_expression(self, source, expr, priority, debounce, poll_interval)
+
+    async def evaluate_expression_raw(
+        self,
+        source: "ModuleSource",
+        expr: str,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> memoryview:
+        if self.result_cache is not None:
+            return (await self.evaluate_cached(source, expr, priority)).raw
+        return await self.fetch_shared(source, expr, priority)
+
+    @property
+    def options_fingerprint(self) -> str:
+        if self._options_fingerprint is None:
+            self._options_fingerprint = options_fingerprint(self.options)
+        return self._options_fingerprint
+
+    async def evaluate_cached(
+        self, source: "ModuleSource", expr: str, priority: Priority
+    ) -> CacheEntry:
+        key = cache_key(self.options_fingerprint, source, expr)
+        entry = self.result_cache.get(key)
+        if entry is None:
+            entry = self.result_cache.put(
+                key, await self.fetch_shared(source, expr, priority)
+            )
+        return entry
+
+    async def fetch_shared(
+        self, source: "ModuleSource", expr: str, priority: Priority
+    ) -> memoryview:
+        key = ("raw",) + cache_key(self.options_fingerprint, source, expr)
+        return await self.single_flight(
+            key, lambda: self.fetch_result(source, expr, priority)
+        )
 
-    async def evaluate_expression_raw(self, source: "ModuleSource", expr: str) -> bytes:
+    async def single_flight(self, key: Tuple, run: Callable[[], Awaitable[Any]]) -> Any:
+        # Identical requests made while one is in flight wait for its result, or its error,
+        # instead of evaluating again; they share the priority of the first. If the first is
+        # cancelled, the next one that was waiting takes over.
+        while True:
+            shared = self.in_flight.get(key)
+            if shared is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(shared)
+            except asyncio.CancelledError:
+                if not shared.cancelled():
+                    raise
+        shared = self.in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await run()
+        except asyncio.CancelledError:
+            shared.cancel()
+            raise
+        except BaseException as e:
+            shared.set_exception(e)
+            # retrieved, so that an error nobody else waited for is not reported
+            shared.exception()
+            raise
+        else:
+            shared.set_result(result)
+            return result
+        finally:
+            del self.in_flight[key]
+
+    async def fetch_result(
+        self, source: "ModuleSource", expr: str, priority: Priority
+    ) -> memoryview:
+        if self.disk_cache is None:
+            return await self.send_evaluate(source, expr, priority)
+        try:
+            pkl_version = await self.manager.get_version()
+        except Exception:
+            # results are only cached for a known version of Pkl
+            return await self.send_evaluate(source, expr, priority)
+        key = cache_key(self.options_fingerprint, source, expr)
+        # Files are read and hashed and SQLite is queried on the default executor, so that other
+        # evaluations carry on meanwhile. Reader hashes are taken there too.
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(
+            None, self.disk_cache.get, key, pkl_version, self.reader_hash
+        )
+        if cached is not None:
+            return memoryview(cached)
+        # files are hashed before evaluating, so that a change made meanwhile is noticed
+        dependencies = await loop.run_in_executor(
+            None, file_dependencies, source.uri, source.contents
+        )
+        result = await self.send_evaluate(source, expr, priority)
+        if dependencies is not None:
+            dependencies += [(kind, uri, hash) for (kind, uri), hash in self.reads.items()]
+            await loop.run_in_executor(
+                None, self.disk_cache.put, key, pkl_version, result, dependencies
+            )
+        return result
+
+    def reader_hash(self, kind: str, uri: str) -> Optional[str]:
+        readers = self.module_readers if kind == "module" else self.resource_readers
+        reader = self.find_reader(readers, uri)
+        if not reader:
+            return None
+        try:
+            return content_hash(as_bytes(reader.read(urlparse(uri))))
+        except Exception:
+            return None
+
+    async def send_evaluate(
+        self, source: "ModuleSource", expr: str, priority: Priority
+    ) -> memoryview:
         if self.closed:
             raise Exception("evaluator is closed")
 
         evaluate = Evaluate(
-            requestId=random.randint(0, 2 ** 31 - 1),
+            requestId=self.manager.next_request_id(),
             evaluatorId=self.evaluator_id,
             moduleUri=source.uri,
             expr=expr,
             moduleText=source.contents,
         )
 
-        self.pending_requests[evaluate.requestId] = Future()
-
-        await self.manager.send(evaluate._code, evaluate)
-
-        resp = await self.pending_requests[evaluate.requestId]
+        resp = await self.manager.request(evaluate._code, evaluate, priority)
+        self.evaluations += 1
+        self.manager.evaluated(self)
         if resp.error:
             raise Exception(resp.error)
 
         return resp.result
 
-    async def evaluate_module(self, source: "ModuleSource") -> Any:
-        return await self.evaluate_expression(source, "")
-
-    async def evaluate_output_files(self, source: "ModuleSource") -> Dict[str, str]:
-        return await self.evaluate_expression(
-            source, "output.files.toMap().mapValues((_, it) -> it.text)"
+    async def evaluate_module(
+        self,
+        source: "ModuleSource",
+        priority: Priority = Priority.INTERACTIVE,
+        lazy: bool = False,
+    ) -> Any:
+        return await self.evaluate_expression(source, "", priority, lazy)
+
+    async def evaluate_output_files(
+        self, source: "ModuleSource", priority: Priority = Priority.INTERACTIVE
+    ) -> Dict[str, str]:
+        return await self.evaluate_expression(source, output_files_expr, priority)
+
+    async def write_output_files(
+        self,
+        source: "ModuleSource",
+        dest_dir: str,
+        priority: Priority = Priority.INTERACTIVE,
+        max_workers: Optional[int] = None,
+    ) -> List[str]:
+        bytes = await self.evaluate_expression_raw(source, output_files_expr, priority)
+        # files are written on a thread pool, away from the loop, see output.write_files
+        return await asyncio.get_running_loop().run_in_executor(
+            None, write_files, bytes, dest_dir, max_workers
         )
 
-    async def evaluate_output_text(self, source: "ModuleSource") -> str:
-        return await self.evaluate_expression(source, "output.text")
-
-    async def evaluate_output_value(self, source: "ModuleSource") -> Any:
-        return await self.evaluate_expression(source, "output.value")
-
-    def handle_evaluate_response(self, msg: "EvaluateResponse"):
-        pending = self.pending_requests.get(msg.request_id)
-        if not pending:
-            raise Exception(
-                f"received a message for an unknown request id: {msg.request_id}"
-            )
-        return
+    async def evaluate_output_text(
+        self, source: "ModuleSource", priority: Priority = Priority.INTERACTIVE
+    ) -> str:
+        return await self.evaluate_expression(source, "output.text", priority)
+
+    async def evaluate_output_value(
+        self,
+        source: "ModuleSource",
+        priority: Priority = Priority.INTERACTIVE,
+        lazy: bool = False,
+    ) -> Any:
+        return await self.evaluate_expression(source, "output.value", priority, lazy)
+
+    async def write_output_text(
+        self, source: "ModuleSource", sink: Any, priority: Priority = Priority.INTERACTIVE
+    ) -> int:
+        return await self.write_expression(source, "output.text", sink, priority)
+
+    async def write_output_bytes(
+        self, source: "ModuleSource", sink: Any, priority: Priority = Priority.INTERACTIVE
+    ) -> int:
+        return await self.write_expression(source, "output.bytes", sink, priority)
+
+    async def write_expression(
+        self,
+        source: "ModuleSource",
+        expr: str,
+        sink: Any,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> int:
+        bytes = await self.evaluate_expression_raw(source, expr, priority)
+        # the payload is a slice of the response, written out without being decoded
+        return await write_payload_async(output_payload(bytes), sink)
 
     def handle_log(self, resp: "Log"):
         if resp.level == 0:
-            print(resp.message, resp.frame_uri)
+            print(resp.message, resp.frameUri)
         elif resp.level == 1:
-            print(resp.message, resp.frame_uri)
+            print(resp.message, resp.frameUri)
         else:
-            raise Exception(f"unknown log level: {resp.level}")
+            log.warning(f"dropping a log message with unknown level {resp.level}: {resp.message}")
 
-    async def handle_read_resource(self, msg: "ReadResource"):
-        response = {
-            "evaluatorId": self.evaluator_id,
-            "requestId": msg.request_id,
-            "code": codes.EvaluateReadResponse,
-        }
-        try:
-            url = urlparse(msg.uri)
-        except Exception as e:
-            await self.manager.send(
-                {
-                    **response,
-                    "error": f"internal error: failed to parse resource url: {e}",
-                }
-            )
-            return
+    def find_reader(self, readers: List[Reader], uri: str) -> Optional[Reader]:
+        scheme = urlparse(uri).scheme
+        return next((r for r in readers if r.scheme == scheme), None)
 
-        reader = next(
-            (r for r in self.resource_readers if f"{r.scheme}:" == url.scheme), None
+    async def handle_read_resource(self, msg: "ReadResource"):
+        response = ReadResourceResponse(
+            requestId=msg.requestId, evaluatorId=self.evaluator_id
         )
-
+        reader = self.find_reader(self.resource_readers, msg.uri)
         if not reader:
-            await self.manager.send(
-                {
-                    **response,
-                    "error": f"No resource reader found for scheme {url.scheme}",
-                }
-            )
-            return
-
-        try:
-            contents = reader.read(url)
-            await self.manager.send({**response, "contents": contents})
-        except Exception as e:
-            await self.manager.send({**response, "error": str(e)})
+            response.error = f"No resource reader found for uri {msg.uri}"
+        else:
+            try:
+                response.contents = reader.read(urlparse(msg.uri))
+                if self.disk_cache is not None:
+                    self.reads[("resource", msg.uri)] = content_hash(as_bytes(response.contents))
+            except Exception as e:
+                response.error = str(e)
+        await self.manager.send(response._code, response)
 
     async def handle_read_module(self, msg: "ReadModule"):
-        response = {
-            "evaluatorId": self.evaluator_id,
-            "requestId": msg.request_id,
-            "code": codes.EvaluateReadModuleResponse,
-        }
-        try:
-            url = urlparse(msg.uri)
-        except Exception as e:
-            await self.manager.send(
-                {
-                    **response,
-                    "error": f"internal error: failed to parse resource url: {e}",
-                }
-            )
-            return
-
-        reader = next(
-            (r for r in self.module_readers if f"{r.scheme}:" == url.scheme), None
+        response = ReadModuleResponse(
+            requestId=msg.requestId, evaluatorId=self.evaluator_id
         )
-
+        reader = self.find_reader(self.module_readers, msg.uri)
         if not reader:
-            await self.manager.send(
-                {**response, "error": f"No module reader found for scheme {url.scheme}"}
-            )
-            return
-
-        try:
-            contents = reader.read(url)
-            await self.manager.send({**response, "contents": contents})
-        except Exception as e:
-            await self.manager.send({**response, "error": str(e)})
+            response.error = f"No module reader found for uri {msg.uri}"
+        else:
+            try:
+                response.contents = reader.read(urlparse(msg.uri))
+                if self.disk_cache is not None:
+                    self.reads[("module", msg.uri)] = content_hash(as_bytes(response.contents))
+            except Exception as e:
+                response.error = str(e)
+        await self.manager.send(response._code, response)
 
     async def handle_list_resources(self, msg: "ListResources"):
-        response = {
-            "evaluatorId": self.evaluator_id,
-            "requestId": msg.request_id,
-            "code": codes.ListResourcesResponse,
-        }
-        try:
-            url = urlparse(msg.uri)
-        except Exception as e:
-            await self.manager.send(
-                {
-                    **response,
-                    "error": f"internal error: failed to parse resource url: {e}",
-                }
-            )
-            return
-
-        reader = next(
-            (r for r in self.resource_readers if f"{r.scheme}:" == url.scheme), None
+        response = ListResourcesResponse(
+            requestId=msg.requestId, evaluatorId=self.evaluator_id
         )
+        reader = self.find_reader(self.resource_readers, msg.uri)
+        if not reader:
+            response.error = f"No resource reader found for uri {msg.uri}"
+        else:
+            try:
+                response.pathElements = path_elements(
+                    reader.list_elements(urlparse(msg.uri))
+                )
+            except Exception as e:
+                response.error = str(e)
+        await self.manager.send(response._code, response)
 
+    async def handle_list_modules(self, msg: "ListModules"):
+        response = ListModulesResponse(
+            requestId=msg.requestId, evaluatorId=self.evaluator_id
+        )
+        reader = self.find_reader(self.module_readers, msg.uri)
         if not reader:
-            await self.manager.send(
-                {
-                    **response,
-                    "error": f"No resource reader found for scheme {url.scheme}",
-                }
-            )
-            return
+            response.error = f"No module reader found for uri {msg.uri}"
+        else:
+            try:
+                response.pathElements = path_elements(
+                    reader.list_elements(urlparse(msg.uri))
+                )
+            except Exception as e:
+                response.error = str(e)
+        await self.manager.send(response._code, response)
+
+
+class SharedEvaluator:
+    """
+    SharedEvaluator is one caller's handle on an evaluator shared by
+    EvaluatorManagerImpl.get_or_create_evaluator.
+
+    It behaves as the shared evaluator until closed. Closing it gives up this caller's
+    reference only, and closing it again does nothing. Attributes such as result_cache,
+    disk_cache and the readers belong to the shared evaluator, so setting them through one
+    handle affects every caller sharing it.
+    """
+
+    def __init__(self, evaluator: EvaluatorImpl):
+        object.__setattr__(self, "evaluator", evaluator)
+        object.__setattr__(self, "_closed", False)
 
-        try:
-            path_elements = reader.list_elements(url)
-            await self.manager.send({**response, "pathElements": path_elements})
-        except Exception as e:
-            await self.manager.send({**response, "error": str(e)})
+    def close(self):
+        if not self._closed:
+            object.__setattr__(self, "_closed", True)
+            self.evaluator.manager.release_evaluator(self.evaluator)
 
-    async def handle_list_modules(self, msg: "ListModules"):
-        response = {
-            "evaluatorId": self.evaluator_id,
-            "requestId": msg.request_id,
-            "code": codes.ListModulesResponse,
-        }
-        try:
-            url = urlparse(msg.uri)
-        except Exception as e:
-            await self.manager.send(
-                {
-                    **response,
-                    "error": f"internal error: failed to parse resource url: {e}",
-                }
-            )
-            return
+    @property
+    def closed(self):
+        return self._closed or self.evaluator.closed
 
-        reader = next(
-            (r for r in self.module_readers if f"{r.scheme}:" == url.scheme), None
-        )
+    def __getattr__(self, name: str) -> Any:
+        if self._closed:
+            raise Exception("evaluator is closed")
+        return getattr(self.evaluator, name)
 
-        if not reader:
-            await self.manager.send(
-                {**response, "error": f"No module reader found for scheme {url.scheme}"}
-            )
-            return
+    def __setattr__(self, name: str, value: Any):
+        setattr(self.evaluator, name, value)
 
-        try:
-            path_elements = reader.list_elements(url)
-            await self.manager.send({**response, "pathElements": path_elements})
-        except Exception as e:
-            await self.manager.send({**response, "error": str(e)})
+
+def as_bytes(contents) -> bytes:
+    return contents.encode() if isinstance(contents, str) else bytes(contents)
+
+
+def path_elements(elements) -> List[PathElement]:
+    return [PathElement(name=e.name, isDirectory=e.is_directory) for e in elements]
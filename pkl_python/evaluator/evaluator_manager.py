@@ -1,21 +1,50 @@
 import asyncio
+import itertools
+from dataclasses import dataclass
 from .project import load_project_from_evaluator
 from ..types.evaluator_manager import EvaluatorManagerInterface
-from .evaluator import EvaluatorImpl, Evaluator
-from ..types.outgoing import CreateEvaluator, OutgoingMessage, ProjectOrDependency
+from .evaluator import EvaluatorImpl, Evaluator, SharedEvaluator
+from .decoder import Decoder
+from ..types.outgoing import (
+    CloseEvaluator,
+    CreateEvaluator,
+    Evaluate,
+    OutgoingMessage,
+    ProjectOrDependency,
+)
 import msgpack
 from ..types import codes
-from .evaluator_options import encoded_dependencies, EvaluatorOptions, with_project
+from .evaluator_options import (
+    encoded_dependencies,
+    EvaluatorOptions,
+    options_fingerprint,
+    with_project,
+)
 from .preconfigured_options import PreconfiguredOptions
-from ..types.incoming import CreateEvaluatorResponse, decode
+from .module_source import TextSource
+from . import version_cache
+from .transport import SubprocessTransport, Transport
+from .scheduler import Priority, Scheduler
+from ..types.incoming import CreateEvaluatorResponse, IncomingMessage, decode, decoders
 import re
 import os
-import subprocess
-from typing import List, Tuple
+import time
+from typing import Dict, List, Optional, Tuple
 import logging
 
 log = logging.getLogger(__name__)
 
+# Messages that answer a request sent by the manager.
+response_codes = {codes.NewEvaluatorResponse, codes.EvaluateResponse}
+# Requests that Pkl sends on behalf of an evaluator, mapped to the evaluator method that
+# answers them.
+evaluator_request_handlers = {
+    codes.EvaluateRead: "handle_read_resource",
+    codes.EvaluateReadModule: "handle_read_module",
+    codes.ListResourcesRequest: "handle_list_resources",
+    codes.ListModulesRequest: "handle_list_modules",
+}
+
 def new_evaluator_manager() -> EvaluatorManagerInterface:
     """
     Creates a new EvaluatorManager.
@@ -39,51 +68,283 @@ def new_evaluator_manager_with_command(
     return EvaluatorManagerImpl(pkl_command)
 
 
+def new_evaluator_manager_with_transport(
+    transport: Transport,
+) -> EvaluatorManagerInterface:
+    """
+    Creates a new EvaluatorManager that talks to Pkl over the given transport.
+
+    For example, the below snippet connects to a bridge shared by several processes.
+
+    new_evaluator_manager_with_transport(UnixSocketTransport("/run/pkl.sock"))
+    """
+    return EvaluatorManagerImpl(transport=transport)
+
+
 semver_pattern = re.compile(
     r"(0|[1-9]\d*)\.(0|[1-9]\d*)\.(0|[1-9]\d*)(?:-((?:0|[1-9]\d*|\d*[a-zA-Z-][0-9a-zA-Z-]*)(?:\.(?:0|[1-9]\d*|\d*[a-zA-Z-][0-9a-zA-Z-]*))*))?(?:\+([0-9a-zA-Z-]+(?:\.[0-9a-zA-Z-]+)*))?"
 )
 pkl_version_regex = re.compile(f"Pkl ({semver_pattern.pattern}).*")
 
+# Evaluated by warm_up so that the JVM has compiled the common evaluation paths before the
+# first real request arrives.
+warm_up_module = """
+items = new Listing {
+  for (i in IntSeq(0, 200)) {
+    new Dynamic { name = "item\\(i)"; value = i * 2; ratio = i / 3 }
+  }
+}
+byName = items.toList().toMap((it) -> it.name, (it) -> it.value)
+output { renderer = new JsonRenderer {} }
+"""
+
+
+@dataclass
+class PendingRequest:
+    code: int
+    msg: OutgoingMessage
+    future: asyncio.Future
+    # sent tells if msg has been queued for the current Pkl process.
+    sent: bool = False
+    # replays is the number of times msg was resent to a restarted Pkl process.
+    replays: int = 0
+
 
 class EvaluatorManagerImpl(EvaluatorManagerInterface):
-    def __init__(self, pkl_command: list = []):
+    def __init__(
+        self,
+        pkl_command: list = [],
+        flush_interval: float = 0,
+        flush_bytes: int = 256 * 1024,
+        max_pending_bytes: int = 4 * 1024 * 1024,
+        warm_up: bool = False,
+        warm_up_iterations: int = 20,
+        transport: Optional[Transport] = None,
+        max_restarts: int = 5,
+        restart_delay: float = 0.1,
+        max_restart_delay: float = 5,
+        max_replays: int = 1,
+        max_in_flight: Optional[int] = 1024,
+        evaluator_idle_timeout: float = 60,
+        max_evaluator_evaluations: Optional[int] = None,
+        max_evaluator_age: Optional[float] = None,
+        max_rss_bytes: Optional[int] = None,
+        rss_check_interval: float = 10,
+    ):
+        """
+        Outgoing messages are buffered and written to the child process by a single flusher
+        task. The flusher waits up to flush_interval seconds (or, when it is 0, for the current
+        event loop iteration) for more messages, unless flush_bytes are already buffered.
+        Senders wait while more than max_pending_bytes are buffered and not yet written.
+
+        If warm_up is set, starting the child process also starts a task that evaluates a
+        throwaway module in it warm_up_iterations times, so that later evaluations do not pay
+        for JIT compilation. The process is started by the first evaluator, or earlier by
+        awaiting start(); the task is then available as warm_up_task, and a failure of it is
+        logged.
+
+        If transport is not given, `pkl server` is spawned as a child process using
+        pkl_command.
+
+        If the Pkl process exits unexpectedly, it is restarted up to max_restarts times, waiting
+        restart_delay seconds before the first attempt and twice as long before each further
+        attempt, up to max_restart_delay. Once a new process is up, every evaluator is
+        re-created from its options and in-flight requests are sent again; Evaluate requests
+        are assumed to be idempotent. A request that was already replayed max_replays times
+        fails instead, so a request that crashes Pkl cannot crash it forever. With
+        max_restarts set to 0, in-flight requests fail as soon as the process exits.
+
+        At most max_in_flight evaluations are sent to Pkl at a time; further evaluations wait
+        in the scheduler, interactive ones ahead of batch ones. Queue times are recorded in
+        scheduler.stats. None removes the limit.
+
+        Evaluators handed out by get_or_create_evaluator are closed once nobody has used them
+        for evaluator_idle_timeout seconds.
+
+        Pkl keeps the modules and resources an evaluator has loaded for as long as the evaluator
+        lives. An evaluator that has run max_evaluator_evaluations evaluations, or was created
+        more than max_evaluator_age seconds ago, is replaced in Pkl by a new one with the same
+        options; the old one is closed once its in-flight evaluations have completed. Both are
+        checked as the evaluator is used.
+
+        Once the resident memory of the `pkl server` child process, checked at most every
+        rss_check_interval seconds, exceeds max_rss_bytes, the process is drained and replaced:
+        new requests wait while in-flight ones complete, then a new process is started and the
+        evaluators are re-created in it. This needs /proc, and a child process spawned by this
+        manager.
+        """
         self.pkl_command = pkl_command
-        self.pending_evaluators = {}
+        # Request IDs are unique across all evaluators of this manager, so a single table
+        # routes every response back to the request that is waiting for it.
+        self.request_ids = itertools.count(1)
+        self.pending_requests: Dict[int, PendingRequest] = {}
         self.evaluators = {}
+        self.decoder = Decoder()
         self.packer = msgpack.Packer()
         self.unpacker = msgpack.Unpacker()
         self.closed = False
+        self.transport = transport
+        # cmd is the `pkl server` child process, when the transport spawns one.
         self.cmd = None
+        self.start_task = None
         self.listener_ready = asyncio.Event()
-        self.buffer_bytes = 128
+        # Reads from the child's stdout start at min_read_bytes and grow up to
+        # max_read_bytes while the pipe keeps filling the whole read.
+        self.min_read_bytes = 64 * 1024
+        self.max_read_bytes = 4 * 1024 * 1024
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.max_pending_bytes = max_pending_bytes
+        self.send_buffer = bytearray()
+        self.send_pending = asyncio.Event()
+        self.send_full = asyncio.Event()
+        self.send_space = asyncio.Event()
+        self.send_space.set()
+        self.flusher = None
+        self.version = None
+        self.features = None
+        self.max_restarts = max_restarts
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.max_replays = max_replays
+        self.restarting = False
+        # set while the process is drained before being replaced, see recycle_process
+        self.draining = False
+        self.restarts = 0
+        self.scheduler = Scheduler(max_in_flight)
+        # evaluators shared by get_or_create_evaluator, keyed by options fingerprint
+        self.shared_evaluators: Dict[str, asyncio.Future] = {}
+        self.evaluator_idle_timeout = evaluator_idle_timeout
+        self.max_evaluator_evaluations = max_evaluator_evaluations
+        self.max_evaluator_age = max_evaluator_age
+        self.max_rss_bytes = max_rss_bytes
+        self.rss_check_interval = rss_check_interval
+        self.next_rss_check = 0.0
+        self.recycle_task = None
+        self.recycles = 0
+        # generation counts the Pkl processes connected to, so that evaluator ids of a previous
+        # process are not mistaken for ids of the current one
+        self.generation = 0
+        self.warm_up_enabled = warm_up
+        self.warm_up_iterations = warm_up_iterations
+        self.warm_up_task = None
 
     async def start(self):
         if self.closed:
             raise Exception("EvaluatorManager has been closed")
-        if not self.cmd:
-            program, args = self.get_start_command()
-            print(program, args)
-            self.cmd = await asyncio.create_subprocess_exec(
-                program,
-                *args,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
+        # concurrent callers share a single start-up of the child process
+        if not self.start_task:
+            self.start_task = asyncio.ensure_future(self.start_process())
+            if self.warm_up_enabled:
+                self.warm_up_task = asyncio.ensure_future(self.warm_up())
+                self.warm_up_task.add_done_callback(log_warm_up_failure)
+        await self.start_task
+
+    async def start_process(self):
+        if not self.transport:
+            self.transport = SubprocessTransport(*self.get_start_command())
+        await self.connect()
+
+    async def connect(self):
+        await self.transport.connect(self.max_read_bytes)
+        self.cmd = self.transport.process
+        self.generation += 1
+        self.unpacker = msgpack.Unpacker()
+        self.flusher = asyncio.create_task(self.flush_messages(self.transport.writer))
+        self.listener = asyncio.create_task(self.listen())
+        await self.listener_ready.wait()
+
+    async def restart(self):
+        """
+        Starts a new Pkl process after the previous one exited, retrying with backoff.
+        """
+        delay = self.restart_delay
+        for attempt in range(1, self.max_restarts + 1):
+            log.warning(f"Pkl process exited; restarting it (attempt {attempt})")
+            await asyncio.sleep(delay)
+            if self.closed:
+                break
+            try:
+                await self.reconnect()
+                self.restarts += 1
+                return
+            except Exception as e:
+                log.warning(f"failed to restart Pkl: {e}")
+                delay = min(delay * 2, self.max_restart_delay)
+        self.fail_pending_requests(Exception("Pkl process exited"))
+
+    async def reconnect(self):
+        """
+        Connects to a new Pkl process, re-creates the evaluators in it and replays in-flight
+        requests.
+        """
+        self.transport.close()
+        if self.flusher:
+            self.flusher.cancel()
+        # whatever is still buffered was meant for the previous process
+        self.send_buffer = bytearray()
+        self.send_space.set()
+        await self.connect()
+        if self.closed:
+            # closed while the new process was starting
+            self.transport.close()
+            raise Exception("EvaluatorManager has been closed")
+
+        # an evaluator being renewed is listed under its old id and its new one
+        old_ids = list(self.evaluators.items())
+        evaluators = list(dict.fromkeys(self.evaluators.values()))
+        recreations = []
+        for ev in evaluators:
+            req = create_evaluator_request(ev.options, self.next_request_id())
+            future = asyncio.get_running_loop().create_future()
+            self.pending_requests[req.requestId] = PendingRequest(
+                req._code, req, future, sent=True
             )
-            asyncio.create_task(self.log_stderr())
-            self.listener = asyncio.create_task(self.listen())
-            await self.listener_ready.wait()
+            self.queue_message(req._code, req)
+            recreations.append(future)
+        recreated = asyncio.gather(*recreations)
+        done, _ = await asyncio.wait(
+            [recreated, self.listener], return_when=asyncio.FIRST_COMPLETED
+        )
+        if recreated not in done:
+            recreated.cancel()
+            raise Exception("Pkl exited while re-creating evaluators")
 
-    async def log_stderr(self):
-        while not self.cmd.stderr.at_eof():
-            stderr_line = await self.cmd.stderr.readline()
-            log.info(stderr_line)
+        evaluator_ids = {}
+        self.evaluators = {}
+        for ev, response in zip(evaluators, recreated.result()):
+            if response.error:
+                log.error(f"failed to re-create evaluator {ev.evaluator_id}: {response.error}")
+                ev._closed = True
+                continue
+            ev.evaluator_id = response.evaluatorId
+            self.evaluators[ev.evaluator_id] = ev
+        for old_id, ev in old_ids:
+            if not ev.closed:
+                evaluator_ids[old_id] = ev.evaluator_id
+
+        for pending in list(self.pending_requests.values()):
+            if pending.future.done():
+                continue
+            if pending.sent:
+                if pending.replays >= self.max_replays:
+                    pending.future.set_exception(Exception("Pkl process exited"))
+                    continue
+                pending.replays += 1
+            if isinstance(pending.msg, Evaluate):
+                if pending.msg.evaluatorId not in evaluator_ids:
+                    pending.future.set_exception(Exception("evaluator is closed"))
+                    continue
+                pending.msg.evaluatorId = evaluator_ids[pending.msg.evaluatorId]
+            pending.sent = True
+            self.queue_message(pending.code, pending.msg)
 
     def handle_close(self):
-        for future in self.pending_evaluators.values():
-            future.cancel()
+        for pending in self.pending_requests.values():
+            pending.future.cancel()
+        self.unshare_evaluators()
         errors = []
-        for ev in self.evaluators.values():
+        for ev in list(self.evaluators.values()):
             try:
                 ev.close()
             except Exception as e:
@@ -108,114 +369,522 @@ class EvaluatorManagerImpl(EvaluatorManagerInterface):
         return ev
 
     def handle_decode(self, item):
+        code = item[0]
+        if code not in decoders:
+            # newer Pkl versions may send messages this client does not know about
+            log.warning(f"dropping a message with unknown code {code:#x} from Pkl")
+            return
         decoded = decode(item)
-        log.info(decoded)
-        if type(decoded) is CreateEvaluatorResponse:
-            id = decoded.requestId
-            pending = self.pending_evaluators.get(id)
-            if not pending:
-                log.warning(f"received a message for an unknown request id: {decoded.requestId}")
-            else:
-                pending.set_result(decoded)
+        if code in response_codes:
+            self.handle_response(decoded)
+            return
+        ev = self.get_evaluator(decoded.evaluatorId)
+        if not ev:
+            return
+        if code == codes.EvaluateLog:
+            ev.handle_log(decoded)
         else:
-            ev = self.get_evaluator(decoded.evaluator_id)
-            log.info(f"Received message for evaluator {decoded.evaluator_id} with code {decoded.code}")
-            if not ev:
-                log.error(f"No evaluator ID in message: {decoded}")
-                pass
-            if decoded.code == codes.EvaluateResponse:
-                ev.handle_evaluate_response(decoded)
-            elif decoded.code == codes.EvaluateLog:
-                ev.handle_log(decoded)
-            elif decoded.code == codes.EvaluateRead:
-                ev.handle_read_resource(decoded)
-            elif decoded.code == codes.EvaluateReadModule:
-                ev.handle_read_module(decoded)
-            elif decoded.code == codes.ListResourcesRequest:
-                ev.handle_list_resources(decoded)
-            elif decoded.code == codes.ListModulesRequest:
-                ev.handle_list_modules(decoded)
+            asyncio.create_task(getattr(ev, evaluator_request_handlers[code])(decoded))
+
+    def handle_response(self, msg: IncomingMessage):
+        pending = self.pending_requests.pop(msg.requestId, None)
+        if not pending:
+            log.warning(f"received a message for an unknown request id: {msg.requestId}")
+        elif not pending.future.done():
+            pending.future.set_result(msg)
+
+    def next_request_id(self) -> int:
+        return next(self.request_ids)
+
+    async def request(
+        self, code, msg: OutgoingMessage, priority: Optional[Priority] = None
+    ) -> IncomingMessage:
+        """
+        Sends a message that expects a response and waits for that response.
+
+        If a priority is given, the request first waits for admission by the scheduler.
+        """
+        if priority is None:
+            return await self.send_request(code, msg)
+        await self.scheduler.acquire(priority)
+        try:
+            return await self.send_request(code, msg)
+        finally:
+            self.scheduler.release()
+
+    async def send_request(self, code, msg: OutgoingMessage) -> IncomingMessage:
+        pending = PendingRequest(
+            code, msg, asyncio.get_running_loop().create_future()
+        )
+        self.pending_requests[msg.requestId] = pending
+        try:
+            await self.wait_for_send_space()
+            # while restarting or draining, the request is sent once the new process is up
+            if not pending.sent and not self.restarting and not self.draining:
+                pending.sent = True
+                self.queue_message(code, msg)
+            return await pending.future
+        finally:
+            self.pending_requests.pop(msg.requestId, None)
+
+    def fail_pending_requests(self, error: Exception):
+        pending_requests, self.pending_requests = self.pending_requests, {}
+        for pending in pending_requests.values():
+            if not pending.future.done():
+                pending.future.set_exception(error)
 
     async def listen(self):
         log.info("listener started")
         self.listener_ready.set()
-        while not self.cmd.stdout.at_eof():
-            log.info("waiting for message")
-            try:
-                data = await self.cmd.stdout.read(self.buffer_bytes)
-                log.info(f"stdout: {data}")
-                self.unpacker.feed(data)
-                item = self.unpacker.unpack()
-                log.info(item)
-                self.handle_decode(item)
-            except asyncio.IncompleteReadError:
+        try:
+            await self.read_messages(self.transport.reader)
+        except Exception as e:
+            log.error(f"failed to read from Pkl: {e}")
+        self.listener_ready.clear()
+        if self.restarting:
+            # reconnect notices that this listener finished
+            return
+        if self.closed or not self.max_restarts:
+            self.fail_pending_requests(Exception("Pkl process exited"))
+            return
+        self.restarting = True
+        try:
+            await self.restart()
+        finally:
+            self.restarting = False
+
+    async def read_messages(self, stream: asyncio.StreamReader):
+        """
+        Reads msgpack messages from stream until EOF.
+
+        Every wakeup reads whatever the stream has buffered (up to the current read size) and
+        then dispatches all complete messages held by the unpacker, so messages that arrive
+        together are handled together.
+        """
+        read_bytes = self.min_read_bytes
+        while True:
+            data = await stream.read(read_bytes)
+            if not data:
                 break
-            except msgpack.OutOfData:
-                continue                
+            self.unpacker.feed(data)
+            for item in self.unpacker:
+                # A message that cannot be handled is dropped rather than ending the listener,
+                # which would restart Pkl and replay the requests that led to it.
+                try:
+                    self.handle_decode(item)
+                except Exception:
+                    log.exception(f"failed to handle a message from Pkl: {item!r:.200}")
+            read_bytes = next_read_size(
+                read_bytes, len(data), self.min_read_bytes, self.max_read_bytes
+            )
+
+    @property
+    def in_flight(self) -> int:
+        """
+        The number of requests sent to the Pkl child process that are awaiting a response.
+        """
+        return len(self.pending_requests)
 
     def get_start_command(self) -> Tuple[str, List[str]]:
         cmd, args = self.get_command_and_arg_strings()
         return cmd, [*args, "server"]
 
     def close(self):
-        self.cmd.kill()
+        self.closed = True
+        self.unshare_evaluators()
+        if self.warm_up_task:
+            self.warm_up_task.cancel()
+        if self.flusher:
+            self.flusher.cancel()
+        if self.transport:
+            self.transport.close()
+
+    async def get_version(self) -> str:
+        """
+        Returns the version of the Pkl binary.
 
-    def get_version(self) -> str:
+        The result is cached on disk, keyed by the binary's path and modification time, so
+        `pkl --version` only runs once per installed binary.
+        """
         if self.version:
             return self.version
         cmd, args = self.get_command_and_arg_strings()
-        result = subprocess.run([cmd, *args, "--version"], stdout=subprocess.PIPE)
-        version = re.search(self.pkl_version_regex, result.stdout.decode())
-        if not version or len(version.groups()) < 2:
-            raise Exception(
-                f"failed to get version information from Pkl. Ran '{' '.join(args)}', and got stdout \"{result.stdout.decode}\""
+        key = version_cache.cache_key(cmd, args)
+        entry = version_cache.read_cached_version(key) if key else None
+        if not entry:
+            proc = await asyncio.create_subprocess_exec(
+                cmd, *args, "--version", stdout=asyncio.subprocess.PIPE
             )
-        self.version = version.group(1)
+            stdout, _ = await proc.communicate()
+            version = re.search(pkl_version_regex, stdout.decode())
+            if not version:
+                raise Exception(
+                    f"failed to get version information from Pkl. Ran '{' '.join([cmd, *args, '--version'])}', and got stdout \"{stdout.decode()}\""
+                )
+            if key:
+                entry = version_cache.write_cached_version(key, version.group(1))
+            else:
+                entry = {
+                    "version": version.group(1),
+                    "features": version_cache.supported_features(version.group(1)),
+                }
+        self.version = entry["version"]
+        self.features = set(entry["features"])
         return self.version
 
+    async def has_feature(self, feature: str) -> bool:
+        """
+        Tells if the Pkl binary supports the given feature (see version_cache.FEATURES).
+        """
+        await self.get_version()
+        return feature in self.features
+
+    async def warm_up(self):
+        """
+        Starts the child process and runs throwaway evaluations in it.
+        """
+        await asyncio.gather(self.start(), self.get_version())
+        ev = await self.new_evaluator(
+            EvaluatorOptions(allowed_modules=["pkl:", "repl:"])
+        )
+        try:
+            for _ in range(self.warm_up_iterations):
+                await ev.evaluate_output_text(TextSource(warm_up_module))
+        finally:
+            ev.close()
+
+    def close_evaluator(self, ev: EvaluatorImpl):
+        """
+        Releases the evaluator in the child process.
+        """
+        if self.evaluators.pop(ev.evaluator_id, None) and not self.closed:
+            self.send_nowait(CloseEvaluator(evaluatorId=ev.evaluator_id))
+
     async def new_evaluator(self, opts):
-        if not self.cmd:
-            await self.start()
-
-        id, req = create_evaluator_request(opts)
-        future = asyncio.Future()
-        if id in self.pending_evaluators:
-            raise Exception(f"Request ID {id} already exists")
-        self.pending_evaluators[id] = future
-
-        await self.send(codes.NewEvaluator, req)
-        log.info("Sent create evaluator request")
-
-        response: CreateEvaluatorResponse = await future
-        log.info("Received create evaluator response")
-        print(response)
-        ev = EvaluatorImpl(response.evaluatorId, self)
+        await self.start()
+
+        req = create_evaluator_request(opts, self.next_request_id())
+        response: CreateEvaluatorResponse = await self.request(codes.NewEvaluator, req)
+        if response.error:
+            raise Exception(response.error)
+        ev = EvaluatorImpl(response.evaluatorId, self, opts)
         self.evaluators[response.evaluatorId] = ev
         return ev
 
+    def evaluated(self, ev: EvaluatorImpl):
+        """
+        Called after each evaluation, to apply the recycling policies.
+        """
+        if ev.renew_task is None and (
+            (
+                self.max_evaluator_evaluations is not None
+                and ev.evaluations >= self.max_evaluator_evaluations
+            )
+            or (
+                self.max_evaluator_age is not None
+                and time.monotonic() - ev.created > self.max_evaluator_age
+            )
+        ):
+            ev.renew_task = asyncio.ensure_future(self.renew_evaluator(ev))
+        if (
+            self.max_rss_bytes is not None
+            and self.recycle_task is None
+            and self.cmd is not None
+            and time.monotonic() >= self.next_rss_check
+        ):
+            self.next_rss_check = time.monotonic() + self.rss_check_interval
+            rss = process_rss(self.cmd.pid)
+            if rss is not None and rss > self.max_rss_bytes:
+                # from now on, requests are held back for the new process
+                self.draining = True
+                self.recycle_task = asyncio.ensure_future(self.recycle_process(rss))
+
+    async def renew_evaluator(self, ev: EvaluatorImpl):
+        """
+        Replaces the evaluator in Pkl by a new one with the same options, and closes the old
+        one once the evaluations sent to it have completed.
+        """
+        try:
+            req = create_evaluator_request(ev.options, self.next_request_id())
+            response: CreateEvaluatorResponse = await self.request(codes.NewEvaluator, req)
+            if response.error:
+                raise Exception(response.error)
+            generation = self.generation
+            if ev.closed:
+                if not self.closed:
+                    self.send_nowait(CloseEvaluator(evaluatorId=response.evaluatorId))
+                return
+            old_id = ev.evaluator_id
+            ev.evaluator_id = response.evaluatorId
+            ev.evaluations = 0
+            ev.created = time.monotonic()
+            # the old id stays routed to ev, for reads made by its in-flight evaluations
+            self.evaluators[ev.evaluator_id] = ev
+            in_flight = [
+                pending.future
+                for pending in self.pending_requests.values()
+                if isinstance(pending.msg, Evaluate) and pending.msg.evaluatorId == old_id
+            ]
+            if in_flight:
+                await asyncio.wait(in_flight)
+            if self.generation == generation and self.evaluators.get(old_id) is ev:
+                del self.evaluators[old_id]
+                if not self.closed:
+                    self.send_nowait(CloseEvaluator(evaluatorId=old_id))
+        except Exception as e:
+            log.warning(f"failed to renew evaluator {ev.evaluator_id}: {e}")
+            # try again once the policy is hit anew
+            ev.evaluations = 0
+            ev.created = time.monotonic()
+        finally:
+            ev.renew_task = None
+
+    async def recycle_process(self, rss: int):
+        """
+        Waits for in-flight requests to complete while holding back new ones, then replaces
+        the Pkl process with a new one.
+
+        While draining, messages still flow to the old process, so that the in-flight
+        evaluations get the reads they ask for answered.
+        """
+        log.warning(f"Pkl process uses {rss} bytes; replacing it")
+        try:
+            sent = [pending.future for pending in self.pending_requests.values() if pending.sent]
+            if sent:
+                listener = self.listener
+                drained = asyncio.gather(*sent, return_exceptions=True)
+                await asyncio.wait([drained, listener], return_when=asyncio.FIRST_COMPLETED)
+                if listener.done():
+                    # Pkl exited meanwhile, and the listener has restarted it
+                    return
+            if self.closed:
+                return
+            self.restarting = True
+            try:
+                await self.reconnect()
+                self.recycles += 1
+            except Exception as e:
+                log.warning(f"failed to replace Pkl: {e}")
+                await self.restart()
+        finally:
+            self.restarting = False
+            self.draining = False
+            self.recycle_task = None
+            self.send_held_requests()
+
+    def send_held_requests(self):
+        # sends the requests held back while draining that no restart has sent yet
+        if self.closed:
+            return
+        for pending in self.pending_requests.values():
+            if not pending.sent and not pending.future.done():
+                pending.sent = True
+                self.queue_message(pending.code, pending.msg)
+
+    async def get_or_create_evaluator(self, opts: EvaluatorOptions) -> SharedEvaluator:
+        """
+        Returns a handle on an evaluator for opts that is shared with every other caller passing
+        equivalent options, creating the evaluator if there is none.
+
+        Each caller must close its handle once done with it. The evaluator is closed in Pkl once
+        every handle is, and it has then been idle for evaluator_idle_timeout seconds. Settings
+        made on the evaluator, such as result_cache or the readers, are shared by every handle.
+        """
+        key = options_fingerprint(opts)
+        while True:
+            shared = self.shared_evaluators.get(key)
+            if shared is None:
+                break
+            try:
+                ev = await asyncio.shield(shared)
+            except asyncio.CancelledError:
+                # the caller creating it was cancelled; try again
+                if not shared.cancelled():
+                    raise
+                continue
+            if not ev.closed:
+                break
+            # Pkl failed to re-create it after a restart
+            self.unshare_evaluator(ev)
+        if shared is None:
+            # concurrent callers wait for the same NewEvaluator request
+            shared = self.shared_evaluators[key] = asyncio.get_running_loop().create_future()
+            try:
+                ev = await self.new_evaluator(opts)
+            except asyncio.CancelledError:
+                del self.shared_evaluators[key]
+                shared.cancel()
+                raise
+            except BaseException as e:
+                del self.shared_evaluators[key]
+                shared.set_exception(e)
+                shared.exception()
+                raise
+            ev.shared_key = key
+            shared.set_result(ev)
+        ev.references += 1
+        if ev.idle_timer is not None:
+            ev.idle_timer.cancel()
+            ev.idle_timer = None
+        return SharedEvaluator(ev)
+
+    def release_evaluator(self, ev: EvaluatorImpl):
+        """
+        Called when a caller of get_or_create_evaluator closes its handle.
+        """
+        ev.references -= 1
+        if ev.references == 0:
+            ev.idle_timer = asyncio.get_running_loop().call_later(
+                self.evaluator_idle_timeout, self.close_idle_evaluator, ev
+            )
+
+    def close_idle_evaluator(self, ev: EvaluatorImpl):
+        ev.idle_timer = None
+        if ev.references == 0:
+            self.unshare_evaluator(ev)
+            ev.close()
+
+    def unshare_evaluator(self, ev: EvaluatorImpl):
+        self.shared_evaluators.pop(ev.shared_key, None)
+        ev.shared_key = None
+        if ev.idle_timer is not None:
+            ev.idle_timer.cancel()
+            ev.idle_timer = None
+
+    def unshare_evaluators(self):
+        for shared in list(self.shared_evaluators.values()):
+            if shared.done() and not shared.cancelled() and not shared.exception():
+                self.unshare_evaluator(shared.result())
+        self.shared_evaluators = {}
+
     async def new_project_evaluator(
         self, project_dir: str, opts: "EvaluatorOptions"
     ) -> Evaluator:
-        project_evaluator = self.new_evaluator(PreconfiguredOptions)
-        project = load_project_from_evaluator(
-            project_evaluator, f"{project_dir}/PklProject"
-        )
+        project_evaluator = await self.new_evaluator(PreconfiguredOptions)
+        try:
+            project = await load_project_from_evaluator(
+                project_evaluator, f"{project_dir}/PklProject"
+            )
+        finally:
+            project_evaluator.close()
 
-        return self.new_evaluator({**with_project(project), **opts.__dict__})
+        # the values themselves are merged rather than a dump of them, which would turn nested
+        # models such as readers and dependencies into dicts
+        return await self.new_evaluator(
+            with_project(project).model_copy(
+                update={name: value for name, value in opts if value is not None}
+            )
+        )
     
     async def send(self, code, msg: OutgoingMessage):
-        out: bytearray = self.packer.pack([code, msg.model_dump(exclude_none=True)]) 
-        self.cmd.stdin.write(out)
-        await self.cmd.stdin.drain()
+        """
+        Queues a message for the flusher task, waiting first if too much output is pending.
+
+        Messages sent while the Pkl process is being restarted are dropped, because they
+        answer requests of the previous process.
+        """
+        await self.wait_for_send_space()
+        if not self.restarting:
+            self.queue_message(code, msg)
+
+    async def wait_for_send_space(self):
+        while len(self.send_buffer) >= self.max_pending_bytes:
+            self.check_flusher()
+            self.send_space.clear()
+            await self.send_space.wait()
+        if not self.restarting:
+            self.check_flusher()
+
+    def send_nowait(self, msg: OutgoingMessage):
+        """
+        Queues a message without waiting for pending output; used where the caller cannot
+        await, such as Evaluator.close.
+        """
+        if self.flusher and not self.flusher.done():
+            self.queue_message(msg._code, msg)
+
+    def queue_message(self, code, msg: OutgoingMessage):
+        self.send_buffer += pack_message(self.packer, code, msg.to_dict())
+        self.send_pending.set()
+        if len(self.send_buffer) >= self.flush_bytes:
+            self.send_full.set()
+
+    def check_flusher(self):
+        if self.flusher and self.flusher.done():
+            if self.flusher.cancelled():
+                raise Exception("EvaluatorManager has been closed")
+            raise Exception("failed to write to Pkl") from self.flusher.exception()
+
+    async def flush_messages(self, writer: asyncio.StreamWriter):
+        """
+        Writes everything queued by send with a single write and drain per batch.
+        """
+        try:
+            while True:
+                await self.send_pending.wait()
+                if len(self.send_buffer) < self.flush_bytes:
+                    if self.flush_interval:
+                        try:
+                            await asyncio.wait_for(
+                                self.send_full.wait(), self.flush_interval
+                            )
+                        except asyncio.TimeoutError:
+                            pass
+                    else:
+                        # let every sender that is ready in this loop iteration queue up
+                        await asyncio.sleep(0)
+                out, self.send_buffer = self.send_buffer, bytearray()
+                self.send_pending.clear()
+                self.send_full.clear()
+                writer.write(out)
+                await writer.drain()
+                self.send_space.set()
+        finally:
+            # wake blocked senders so they observe the failure
+            self.send_space.set()
+
+
+def process_rss(pid: int) -> Optional[int]:
+    # the resident memory of a process in bytes, or None where /proc cannot tell
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def next_read_size(current: int, received: int, minimum: int, maximum: int) -> int:
+    """
+    Returns the size of the next read from the Pkl child process.
+
+    A read that filled the whole buffer means more data is likely waiting in the pipe, so the
+    size doubles; a read that used less than a quarter of it halves the size again.
+    """
+    if received >= current:
+        return min(current * 2, maximum)
+    if received < current // 4:
+        return max(current // 2, minimum)
+    return current
+
+
+def log_warm_up_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        log.warning(f"warming up Pkl failed: {task.exception()}")
+
+
+def pack_message(packer: msgpack.Packer, code: int, msg: dict) -> bytes:
+    """
+    Frames a message as the `[code, body]` array expected by `pkl server`.
+    """
+    return packer.pack([code, msg])
+
 
-def create_evaluator_request(opts: EvaluatorOptions) -> CreateEvaluator:
-    request_id = 135
+def create_evaluator_request(opts: EvaluatorOptions, request_id: int) -> CreateEvaluator:
     create_evaluator = CreateEvaluator(
         requestId=request_id,
         allowedModules=opts.allowed_modules,
         clientResourceReaders=opts.resource_readers,
         clientModuleReaders=opts.module_readers,
-        code=codes.NewEvaluator,
     )
 
     if opts.project_dir:
@@ -225,7 +894,7 @@ def create_evaluator_request(opts: EvaluatorOptions) -> CreateEvaluator:
             if opts.declared_project_dependencies
             else None,
         )
-    return request_id, create_evaluator
+    return create_evaluator
 
 
 
@@ -0,0 +1,100 @@
+import os
+from typing import Awaitable, Callable, List, Optional
+
+from ..types.evaluator import Evaluator
+from ..types.evaluator_manager import EvaluatorManagerInterface
+from .evaluator_manager import EvaluatorManagerImpl
+from .evaluator_options import EvaluatorOptions, options_fingerprint
+
+
+def new_evaluator_manager_pool(
+    size: Optional[int] = None, pkl_command: List[str] = []
+) -> "EvaluatorManagerPool":
+    """
+    Creates a new EvaluatorManagerPool that runs `size` Pkl child processes.
+
+    If size is not given, one child process is run per CPU.
+    """
+    return EvaluatorManagerPool(size, pkl_command)
+
+
+class EvaluatorManagerPool(EvaluatorManagerInterface):
+    """
+    EvaluatorManagerPool spreads evaluators over several `pkl server` child processes.
+
+    Every evaluator lives in exactly one child process. New evaluators are placed on the child
+    with the fewest in-flight requests, breaking ties by the number of evaluators it already
+    hosts or is creating. Child processes are started lazily, the first time an evaluator is placed on them.
+    """
+
+    def __init__(self, size: Optional[int] = None, pkl_command: List[str] = []):
+        size = size or os.cpu_count() or 1
+        if size < 1:
+            raise ValueError(f"pool size must be at least 1, got {size}")
+        self.managers = [EvaluatorManagerImpl(pkl_command) for _ in range(size)]
+        # the number of evaluators being created on each child, which its evaluators and
+        # in-flight requests do not show until the child has started and answered
+        self.placing = [0] * size
+        self.closed = False
+
+    def least_loaded(self) -> int:
+        return min(
+            range(len(self.managers)),
+            key=lambda i: (
+                self.managers[i].in_flight,
+                len(self.managers[i].evaluators) + self.placing[i],
+            ),
+        )
+
+    async def place(
+        self, create: Callable[[EvaluatorManagerImpl], Awaitable[Evaluator]]
+    ) -> Evaluator:
+        if self.closed:
+            raise Exception("EvaluatorManagerPool has been closed")
+        # the child is reserved before the first await, so concurrent placements spread out
+        index = self.least_loaded()
+        self.placing[index] += 1
+        try:
+            return await create(self.managers[index])
+        finally:
+            self.placing[index] -= 1
+
+    def in_flight_counts(self) -> List[int]:
+        """
+        Returns the number of in-flight requests of each child process, in pool order.
+        """
+        return [manager.in_flight for manager in self.managers]
+
+    def evaluator_counts(self) -> List[int]:
+        """
+        Returns the number of evaluators hosted by each child process, in pool order.
+        """
+        return [len(manager.evaluators) for manager in self.managers]
+
+    def close(self):
+        self.closed = True
+        for manager in self.managers:
+            manager.close()
+
+    async def get_version(self) -> str:
+        return await self.managers[0].get_version()
+
+    async def new_evaluator(self, opts: EvaluatorOptions) -> Evaluator:
+        return await self.place(lambda manager: manager.new_evaluator(opts))
+
+    async def get_or_create_evaluator(self, opts: EvaluatorOptions) -> Evaluator:
+        if self.closed:
+            raise Exception("EvaluatorManagerPool has been closed")
+        # an evaluator for equivalent options is shared from whichever child hosts it
+        key = options_fingerprint(opts)
+        for manager in self.managers:
+            if key in manager.shared_evaluators:
+                return await manager.get_or_create_evaluator(opts)
+        return await self.place(lambda manager: manager.get_or_create_evaluator(opts))
+
+    async def new_project_evaluator(
+        self, project_dir: str, opts: EvaluatorOptions
+    ) -> Evaluator:
+        return await self.place(
+            lambda manager: manager.new_project_evaluator(project_dir, opts)
+        )
@@ -1,6 +1,8 @@
 from dataclasses import dataclass
 from typing import Optional, Dict, List, Union
 from enum import Enum
+import hashlib
+import json
 import re
 from ..types.outgoing import ResourceReader, ModuleReader
 from ..types.project import (
@@ -93,6 +95,17 @@ class EvaluatorOptions(BaseModel):
     declared_project_dependencies: Optional[ProjectDependencies] = None
 
 
+def options_fingerprint(opts: Optional[EvaluatorOptions]) -> str:
+    """
+    Returns a digest of opts that is the same for any two sets of options that evaluate
+    modules the same way.
+    """
+    if opts is None:
+        return ""
+    dumped = opts.model_dump(mode="json", exclude_none=True)
+    return hashlib.sha256(json.dumps(dumped, sort_keys=True).encode()).hexdigest()
+
+
 def encoded_dependencies(
     input: ProjectDependencies,
 ) -> Dict[str, Union[ProjectLocalDependency, ProjectRemoteDependency]]:
@@ -106,6 +119,8 @@ def encoded_dependencies(
             "type": "local" if isinstance(dep, ProjectLocalDependency) else "remote",
             "checksums": None
             if isinstance(dep, ProjectLocalDependency)
+            else None
+            if dep.checksums is None
             else {"checksums": dep.checksums.sha256},
             "dependencies": encoded_dependencies(dep.dependencies)
             if isinstance(dep, ProjectLocalDependency)
@@ -141,8 +156,10 @@ def with_project_evaluator_settings(
         return {}
 
 
-def with_project_dependencies(project: Project) -> EvaluatorOptions:
-    return EvaluatorOptions(
-        project_dir=re.sub(r"^file://|/PklProject$", "", project.project_file_uri),
-        declared_project_dependencies=project.dependencies,
-    )
+def with_project_dependencies(
+    project: Project,
+) -> Dict[str, Union[str, ProjectDependencies]]:
+    return {
+        "project_dir": re.sub(r"^file://|/PklProject$", "", project.project_file_uri),
+        "declared_project_dependencies": project.dependencies,
+    }
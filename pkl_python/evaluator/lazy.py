@@ -0,0 +1,279 @@
+from collections.abc import Mapping, Sequence
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import msgpack
+
+from .decoder import (
+    Decoder,
+    codeList,
+    codeListing,
+    codeMap,
+    codeMapping,
+    codeObject,
+    codeObjectMemberElement,
+    codeObjectMemberEntry,
+    codeObjectMemberProperty,
+    kindArray,
+    kindPrimitive,
+    value_kinds,
+)
+
+# Span is the (start, end) offset range of one encoded value within the result bytes.
+Span = Tuple[int, int]
+
+# how much of the result an index walk reads at a time
+read_size = 64 * 1024
+
+
+def decode_lazy(data: memoryview, decoder: Optional[Decoder] = None) -> Any:
+    """
+    decode_lazy returns a read-only view over the msgpack encoding of a Pkl value.
+
+    Objects, Mappings and Listings are returned as views that record where their members sit
+    in data the first time they are accessed, and decode a member only when it is read. Nested
+    objects, Mappings and Listings are views themselves. Primitives and small values such as
+    Durations, Pairs and Sets are decoded straight away, as are objects of classes in the
+    decoder's registry. Views have the same shape as the values evaluate_expression returns.
+    """
+    data = memoryview(data)
+    return view(data, (0, len(data)), decoder if decoder is not None else Decoder())
+
+
+def view(data: memoryview, span: Span, decoder: Decoder) -> Any:
+    start, end = span
+    if value_kinds[data[start]] != kindArray:
+        return decoder.decode(data[start:end])
+    unpacker = walk(data, start, end)
+    unpacker.read_array_header()
+    code = unpacker.unpack()
+    if code == codeObject:
+        name = unpacker.unpack()
+        module_uri = unpacker.unpack()
+        members = start + unpacker.tell()
+        if name == "Dynamic" and module_uri == "pkl:base":
+            return LazyDynamic(data, span, decoder, members)
+        if decoder.registry.lookup(module_uri, name) is None:
+            return LazyMapping(data, decoder, lambda: index_object(data, members, end))
+    elif code == codeMap or code == codeMapping:
+        members = start + unpacker.tell()
+        return LazyMapping(data, decoder, lambda: index_map(data, members, end, decoder))
+    elif code == codeList or code == codeListing:
+        members = start + unpacker.tell()
+        return LazySequence(data, decoder, lambda: index_list(data, members, end))
+    return decoder.decode(data[start:end])
+
+
+class SliceReader:
+    # file-like reader over data[offset:end], so that an Unpacker can walk part of a large
+    # result without the whole of it being copied into the Unpacker's buffer
+    def __init__(self, data: memoryview, offset: int, end: int):
+        self.data = data
+        self.offset = offset
+        self.end = end
+
+    def read(self, size: int) -> bytes:
+        chunk = self.data[self.offset : min(self.offset + size, self.end)]
+        self.offset += len(chunk)
+        return bytes(chunk)
+
+
+def walk(data: memoryview, offset: int, end: int) -> msgpack.Unpacker:
+    reader = SliceReader(data, offset, end)
+    return msgpack.Unpacker(reader, read_size=read_size, raw=False, strict_map_key=False)
+
+
+def read_key(unpacker: msgpack.Unpacker, data: memoryview, offset: int, decoder: Decoder) -> Any:
+    # keys are decoded while indexing, since looking them up needs their values
+    start = offset + unpacker.tell()
+    if value_kinds[data[start]] == kindPrimitive:
+        return unpacker.unpack()
+    unpacker.skip()
+    return decoder.decode(data[start : offset + unpacker.tell()])
+
+
+def skip_value(unpacker: msgpack.Unpacker, offset: int) -> Span:
+    start = offset + unpacker.tell()
+    unpacker.skip()
+    return start, offset + unpacker.tell()
+
+
+def index_object(data: memoryview, offset: int, end: int) -> Dict[str, Span]:
+    unpacker = walk(data, offset, end)
+    spans = {}
+    for _ in range(unpacker.read_array_header()):
+        unpacker.read_array_header()
+        if unpacker.unpack() != codeObjectMemberProperty:
+            raise ValueError("Unexpected object member entry in non-Dynamic object")
+        name = unpacker.unpack()
+        spans[name] = skip_value(unpacker, offset)
+    return spans
+
+
+def index_map(data: memoryview, offset: int, end: int, decoder: Decoder) -> Dict[Any, Span]:
+    unpacker = walk(data, offset, end)
+    spans = {}
+    for _ in range(unpacker.read_map_header()):
+        key = read_key(unpacker, data, offset, decoder)
+        spans[key] = skip_value(unpacker, offset)
+    return spans
+
+
+def index_list(data: memoryview, offset: int, end: int) -> List[Span]:
+    unpacker = walk(data, offset, end)
+    return [skip_value(unpacker, offset) for _ in range(unpacker.read_array_header())]
+
+
+def index_dynamic(
+    data: memoryview, offset: int, end: int, decoder: Decoder
+) -> Tuple[Dict[str, Span], Dict[Any, Span], List[Span]]:
+    unpacker = walk(data, offset, end)
+    properties = {}
+    entries = {}
+    elements = []
+    for _ in range(unpacker.read_array_header()):
+        unpacker.read_array_header()
+        code = unpacker.unpack()
+        if code == codeObjectMemberProperty:
+            name = unpacker.unpack()
+            properties[name] = skip_value(unpacker, offset)
+        elif code == codeObjectMemberEntry:
+            key = read_key(unpacker, data, offset, decoder)
+            entries[key] = skip_value(unpacker, offset)
+        elif code == codeObjectMemberElement:
+            unpacker.skip()
+            elements.append(skip_value(unpacker, offset))
+    return properties, entries, elements
+
+
+class LazyValue:
+    def __init__(self, data: memoryview, decoder: Decoder, index: Callable[[], Any]):
+        self.data = data
+        self.decoder = decoder
+        self.index = index
+        self._spans = None
+        self._values = {}
+
+    @property
+    def spans(self):
+        if self._spans is None:
+            self._spans = self.index()
+            self.index = None
+        return self._spans
+
+    def value(self, key) -> Any:
+        try:
+            return self._values[key]
+        except KeyError:
+            value = self._values[key] = view(self.data, self.spans[key], self.decoder)
+            return value
+
+    def decode_span(self, span: Span) -> Any:
+        start, end = span
+        return self.decoder.decode(self.data[start:end])
+
+
+class LazyMapping(LazyValue, Mapping):
+    """
+    LazyMapping is a read-only view of a typed object's properties, or of a Map or Mapping.
+    """
+
+    def __getitem__(self, key) -> Any:
+        return self.value(key)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.spans)
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def __contains__(self, key) -> bool:
+        return key in self.spans
+
+    def __repr__(self) -> str:
+        return f"LazyMapping({list(self.spans)})"
+
+    def materialize(self) -> Dict[Any, Any]:
+        """
+        Decodes every member, as evaluate_expression would have.
+        """
+        return {key: self.decode_span(span) for key, span in self.spans.items()}
+
+
+class LazySequence(LazyValue, Sequence):
+    """
+    LazySequence is a read-only view of a List or Listing.
+    """
+
+    def __getitem__(self, index) -> Any:
+        if isinstance(index, slice):
+            return [self.value(i) for i in range(*index.indices(len(self.spans)))]
+        if index < 0:
+            index += len(self.spans)
+        if not 0 <= index < len(self.spans):
+            raise IndexError("LazySequence index out of range")
+        return self.value(index)
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"LazySequence(<{len(self.spans)} elements>)"
+
+    def materialize(self) -> List[Any]:
+        """
+        Decodes every element, as evaluate_expression would have.
+        """
+        return [self.decode_span(span) for span in self.spans]
+
+
+class LazyDynamic(Mapping):
+    """
+    LazyDynamic is a read-only view of a Dynamic object. Like the dict that evaluate_expression
+    returns for one, it has "properties", "entries" and "elements" keys.
+    """
+
+    def __init__(self, data: memoryview, span: Span, decoder: Decoder, members: int):
+        self.data = data
+        self.span = span
+        self.decoder = decoder
+        self.members = members
+        self._spans = None
+        self.properties = LazyMapping(data, decoder, lambda: self.spans[0])
+        self.entries = LazyMapping(data, decoder, lambda: self.spans[1])
+        self.elements = LazySequence(data, decoder, lambda: self.spans[2])
+
+    @property
+    def spans(self):
+        # properties, entries and elements are interleaved, so they are indexed together
+        if self._spans is None:
+            self._spans = index_dynamic(self.data, self.members, self.span[1], self.decoder)
+        return self._spans
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "properties":
+            return self.properties
+        if key == "entries":
+            return self.entries
+        if key == "elements":
+            return self.elements
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(("properties", "entries", "elements"))
+
+    def __len__(self) -> int:
+        return 3
+
+    def materialize(self) -> Dict[str, Any]:
+        """
+        Decodes the whole object, as evaluate_expression would have.
+        """
+        start, end = self.span
+        return self.decoder.decode(self.data[start:end])
@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+from .decoder import codeMap, codeMapping, new_unpacker
+
+# Pkl's code for Bytes values, encoded as [codeBytes, bin]
+codeBytes = 0xF
+
+
+def output_payload(data: memoryview) -> memoryview:
+    """
+    output_payload returns the UTF-8 bytes of an encoded String, or the contents of encoded
+    Bytes, as a slice of data rather than a copy.
+    """
+    data = memoryview(data)
+    b = data[0]
+    if 0xA0 <= b <= 0xBF:
+        return data[1 : 1 + (b & 0x1F)]
+    if b == 0x92 and data[1] == codeBytes:
+        # [codeBytes, bin]
+        return output_payload(data[2:])
+    if b in (0xD9, 0xC4):
+        size, start = data[1], 2
+    elif b in (0xDA, 0xC5):
+        size, start = int.from_bytes(data[1:3], "big"), 3
+    elif b in (0xDB, 0xC6):
+        size, start = int.from_bytes(data[1:5], "big"), 5
+    else:
+        raise ValueError("expected an encoded String or Bytes value")
+    return data[start : start + size]
+
+
+def write_payload(payload: memoryview, sink: Any) -> int:
+    """
+    Writes payload to sink, and returns the number of bytes written. sink may be a file
+    descriptor, a socket, a bytearray, or any object with a write method such as a file
+    opened in binary mode. Nothing is copied on the way: the payload is handed to os.write,
+    socket.sendall or write as a memoryview.
+    """
+    if isinstance(sink, int):
+        written = 0
+        while written < len(payload):
+            written += os.write(sink, payload[written:])
+        return written
+    if isinstance(sink, bytearray):
+        sink += payload
+        return len(payload)
+    if hasattr(sink, "sendall"):
+        sink.sendall(payload)
+        return len(payload)
+    written = 0
+    while written < len(payload):
+        # raw files may write less than they are given
+        n = sink.write(payload[written:])
+        if n is None:
+            raise BlockingIOError("the sink is non-blocking and not ready for writing")
+        written += n
+    return written
+
+
+async def write_payload_async(payload: memoryview, sink: Any) -> int:
+    """
+    Like write_payload, but also accepts an asyncio.StreamWriter, whose buffer is drained
+    before returning.
+    """
+    if isinstance(sink, asyncio.StreamWriter):
+        sink.write(payload)
+        await sink.drain()
+        return len(payload)
+    return write_payload(payload, sink)
+
+
+def write_files(
+    data: memoryview, dest_dir: str, max_workers: Optional[int] = None
+) -> List[str]:
+    """
+    Writes the files of an encoded Map or Mapping of relative paths to String contents, as
+    returned for `output.files`, under dest_dir. Returns the paths of the files written.
+
+    Contents are sliced out of data as each entry is read, and handed to a pool of threads
+    that write them, so no file is held as a str. Each file is written to a temporary file
+    next to it that is then renamed over it, so readers never see a partly written file.
+    Files whose contents are already on disk are left untouched.
+    """
+    data = memoryview(data)
+    unpacker = new_unpacker(data)
+    if data[0] & 0xF0 != 0x90:
+        raise ValueError("expected a Map or Mapping of output files")
+    unpacker.read_array_header()
+    if unpacker.unpack() not in (codeMap, codeMapping):
+        raise ValueError("expected a Map or Mapping of output files")
+    dest_dir = os.path.abspath(dest_dir)
+    with ThreadPoolExecutor(max_workers, thread_name_prefix="pkl-write-files") as pool:
+        futures = []
+        for _ in range(unpacker.read_map_header()):
+            path = unpacker.unpack()
+            start = unpacker.tell()
+            unpacker.skip()
+            payload = output_payload(data[start : unpacker.tell()])
+            futures.append(pool.submit(write_file, dest_dir, path, payload))
+        return [path for path in (future.result() for future in futures) if path is not None]
+
+
+def write_file(dest_dir: str, path: str, payload: memoryview) -> Optional[str]:
+    # Returns path if the file was written, or None if it already had these contents.
+    target = os.path.normpath(os.path.join(dest_dir, path))
+    if os.path.commonpath([dest_dir, target]) != dest_dir or target == dest_dir:
+        raise ValueError(f"output file {path} is outside of {dest_dir}")
+    if has_contents(target, payload):
+        return None
+    directory, name = os.path.split(target)
+    os.makedirs(directory, exist_ok=True)
+    temp = os.path.join(directory, f".{name}.{secrets.token_hex(4)}.tmp")
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        try:
+            write_payload(payload, fd)
+        finally:
+            os.close(fd)
+        os.replace(temp, target)
+    except BaseException:
+        os.unlink(temp)
+        raise
+    return path
+
+
+def has_contents(path: str, payload: memoryview) -> bool:
+    try:
+        if os.stat(path).st_size != len(payload):
+            return False
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+    return digest.digest() == hashlib.sha256(payload).digest()
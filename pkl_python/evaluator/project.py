@@ -1,14 +1,80 @@
-from . import evaluator_exec as exec
+import dataclasses
+import re
+from typing import Any, Dict, Type
+
 from .module_source import FileSource
 from .preconfigured_options import PreconfiguredOptions
 from ..types.evaluator import Evaluator
-from pkl_python.types.project import Project
+from pkl_python.types.project import (
+    Checksums,
+    Project,
+    ProjectDependencies,
+    ProjectEvaluatorSettings,
+    ProjectLocalDependency,
+    ProjectPackage,
+    ProjectRemoteDependency,
+)
 
 
 async def load_project(path: str) -> Project:
+    # imported here because evaluator_exec depends on this module
+    from . import evaluator_exec as exec
+
     ev = await exec.new_evaluator(PreconfiguredOptions)
     return await load_project_from_evaluator(ev, path)
 
 
 async def load_project_from_evaluator(ev: "Evaluator", path: str) -> Project:
-    return await ev.evaluate_output_value(FileSource(path))
+    return parse_project(await ev.evaluate_output_value(FileSource(path)))
+
+
+def parse_project(value: Dict[str, Any]) -> Project:
+    """
+    Builds a Project from the decoded output value of a PklProject file.
+    """
+    package = value.get("package")
+    evaluator_settings = value.get("evaluatorSettings")
+    return Project(
+        project_file_uri=value["projectFileUri"],
+        tests=value.get("tests") or [],
+        dependencies=parse_dependencies(value.get("dependencies") or {}),
+        package=None if package is None else from_properties(ProjectPackage, package),
+        evaluator_settings=None
+        if evaluator_settings is None
+        else from_properties(ProjectEvaluatorSettings, evaluator_settings),
+    )
+
+
+def parse_dependencies(value: Dict[str, Dict[str, Any]]) -> ProjectDependencies:
+    # A local dependency is the Project of another PklProject file; a remote one is a
+    # RemoteDependency, which has a package URI of its own.
+    local = {}
+    remote = {}
+    for name, dependency in value.items():
+        if "projectFileUri" in dependency:
+            local[name] = ProjectLocalDependency(
+                package_uri=(dependency.get("package") or {}).get("uri"),
+                project_file_uri=dependency["projectFileUri"],
+                dependencies=parse_dependencies(dependency.get("dependencies") or {}),
+            )
+        else:
+            checksums = dependency.get("checksums")
+            remote[name] = ProjectRemoteDependency(
+                package_uri=dependency["uri"],
+                checksums=None if checksums is None else Checksums(checksums["sha256"]),
+            )
+    return ProjectDependencies(local_dependencies=local, remote_dependencies=remote)
+
+
+def from_properties(cls: Type, properties: Dict[str, Any]) -> Any:
+    # fields are named after the Pkl properties in snake case; missing properties are None
+    return cls(
+        **{
+            field.name: properties.get(camel_case(field.name))
+            for field in dataclasses.fields(cls)
+        }
+    )
+
+
+def camel_case(name: str) -> str:
+    return re.sub(r"_([a-z])", lambda match: match.group(1).upper(), name)
@@ -0,0 +1,86 @@
+import dataclasses
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+
+class Registry:
+    """
+    Registry maps Pkl classes, keyed by module URI and class name, to the Python classes that
+    typed objects of that class are decoded into.
+
+    Class names are qualified, as Pkl sends them: the name of the module, `#`, and the name of
+    the class, such as `app#Server` for class Server of a module app.pkl without a module clause.
+
+    Registered classes must be dataclasses, ideally declared with ``slots=True``. Each field is
+    filled from the Pkl property of the same name, or from the name in the field's ``pkl_name``
+    metadata. Properties without a matching field are ignored, so a Python class may mirror just
+    the part of a Pkl class it needs. Objects of unregistered classes decode to dicts.
+
+    A class may be registered with a decode function, such as those that `python -m pkl_python
+    codegen` generates, which then decodes its objects in place of the generic field mapping.
+    """
+
+    def __init__(self):
+        self.classes: Dict[Tuple[str, str], Type] = {}
+        # compiled ObjectDecoders, filled in by the decoder on first use of a class
+        self.decoders: Dict[Tuple[str, str], Any] = {}
+        self.decode_functions: Dict[Tuple[str, str], Callable] = {}
+
+    def register(
+        self,
+        module_uri: str,
+        name: str,
+        cls: Optional[Type] = None,
+        decode: Optional[Callable] = None,
+    ):
+        """
+        Registers cls as the Python class for the Pkl class name, qualified, in module_uri. Without cls,
+        returns a class decorator that does so.
+
+        decode, if given, is called with the Decoder positioned at the object's members and
+        must return the decoded instance, leaving the Decoder just past them.
+        """
+        if cls is None:
+
+            def decorator(cls: Type) -> Type:
+                self.register(module_uri, name, cls, decode)
+                return cls
+
+            return decorator
+        if not dataclasses.is_dataclass(cls):
+            raise ValueError(f"{cls.__qualname__} must be a dataclass to be registered")
+        key = (module_uri, name)
+        self.classes[key] = cls
+        self.decoders.pop(key, None)
+        if decode is None:
+            self.decode_functions.pop(key, None)
+        else:
+            self.decode_functions[key] = decode
+        return cls
+
+    def unregister(self, module_uri: str, name: str):
+        key = (module_uri, name)
+        self.classes.pop(key, None)
+        self.decoders.pop(key, None)
+        self.decode_functions.pop(key, None)
+
+    def lookup(self, module_uri: str, name: str) -> Optional[Type]:
+        return self.classes.get((module_uri, name))
+
+
+# default_registry is used by decoders that are not given a registry of their own.
+default_registry = Registry()
+
+
+def register(
+    module_uri: str, name: str, cls: Optional[Type] = None, decode: Optional[Callable] = None
+):
+    """
+    Registers cls with the default registry. Usable as a class decorator:
+
+        @register("file:///config/app.pkl", "app#Server")
+        @dataclass(slots=True)
+        class Server:
+            host: str
+            port: int
+    """
+    return default_registry.register(module_uri, name, cls, decode)
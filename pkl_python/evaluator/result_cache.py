@@ -0,0 +1,118 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from .module_source import ModuleSource
+
+# CacheKey is (options fingerprint, module uri, module text hash, expression).
+CacheKey = Tuple[str, str, Optional[bytes], str]
+
+# marks an entry whose result has not been decoded yet
+undecoded = object()
+
+
+class CacheEntry:
+    __slots__ = ("raw", "value", "expires", "mtime")
+
+    def __init__(self, raw: memoryview, expires: Optional[float], mtime: Optional[int]):
+        self.raw = raw
+        self.value = undecoded
+        self.expires = expires
+        self.mtime = mtime
+
+
+class ResultCache:
+    """
+    ResultCache holds the results of evaluations, so that evaluating the same expression of the
+    same module again with the same options neither goes to Pkl nor decodes the result again.
+
+    Entries are evicted least recently used first once there are more than max_entries of them
+    or their results add up to more than max_bytes, and expire ttl seconds after they were
+    added, if ttl is set. Results of `file:` modules evaluated from disk are dropped when the
+    file's modification time changes; changes to the modules they import are not noticed, so
+    call invalidate after changing those.
+
+    Decoded values are shared by every hit, and must not be modified.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: Optional[float] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: CacheKey) -> Optional[CacheEntry]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            if (entry.expires is not None and entry.expires <= time.monotonic()) or (
+                entry.mtime is not None and entry.mtime != file_mtime(key[1])
+            ):
+                self.remove(key)
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, key: CacheKey, raw: memoryview) -> CacheEntry:
+        if key in self.entries:
+            self.remove(key)
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        mtime = file_mtime(key[1]) if key[2] is None else None
+        entry = self.entries[key] = CacheEntry(raw, expires, mtime)
+        self.size += len(raw)
+        while self.entries and (
+            len(self.entries) > self.max_entries or self.size > self.max_bytes
+        ):
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+        return entry
+
+    def remove(self, key: CacheKey):
+        entry = self.entries.pop(key)
+        self.size -= len(entry.raw)
+
+    def invalidate(self, uri: Optional[str] = None):
+        """
+        Drops the results of the module at uri, or every result if uri is None.
+        """
+        for key in [key for key in self.entries if uri is None or key[1] == uri]:
+            self.remove(key)
+
+    def clear(self):
+        self.invalidate()
+
+
+def cache_key(fingerprint: str, source: ModuleSource, expr: str) -> CacheKey:
+    contents = source.contents
+    digest = None if contents is None else hashlib.sha256(contents.encode()).digest()
+    return fingerprint, source.uri, digest, expr
+
+
+def file_mtime(uri: str) -> Optional[int]:
+    # the modification time of the file at a file: uri; None for other uris and missing files
+    if not uri.startswith("file:"):
+        return None
+    try:
+        return os.stat(unquote(urlparse(uri).path)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def decoded_value(entry: CacheEntry, decode) -> Any:
+    if entry.value is undecoded:
+        entry.value = decode(entry.raw)
+    return entry.value
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Deque, Dict, Optional
+
+
+class Priority(IntEnum):
+    """
+    Priority of an evaluation. Queued interactive evaluations are always admitted before
+    queued batch evaluations.
+    """
+
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+@dataclass
+class QueueStats:
+    # admitted is the number of evaluations admitted so far.
+    admitted: int = 0
+    # queued is the number of evaluations currently waiting for admission.
+    queued: int = 0
+    # total_wait and max_wait are the summed and the longest queue times, in seconds.
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        return self.total_wait / self.admitted if self.admitted else 0.0
+
+    def record(self, wait: float):
+        self.admitted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+class Scheduler:
+    """
+    Scheduler bounds the number of evaluations in flight in a Pkl process.
+
+    Evaluations past the window wait in one FIFO queue per priority. Whenever a slot frees up,
+    it goes to the oldest waiter of the most urgent non-empty queue. A max_in_flight of None
+    admits everything immediately.
+    """
+
+    def __init__(self, max_in_flight: Optional[int] = None):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.queues: Dict[Priority, Deque[asyncio.Future]] = {
+            priority: deque() for priority in Priority
+        }
+        self.stats: Dict[Priority, QueueStats] = {
+            priority: QueueStats() for priority in Priority
+        }
+
+    def has_capacity(self) -> bool:
+        return self.max_in_flight is None or self.in_flight < self.max_in_flight
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE):
+        """
+        Waits until an evaluation of the given priority may be sent.
+        """
+        start = time.monotonic()
+        stats = self.stats[priority]
+        if self.has_capacity() and not any(self.queues.values()):
+            self.in_flight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.queues[priority].append(future)
+            stats.queued += 1
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    self.queues[priority].remove(future)
+                else:
+                    # the slot was handed over before the waiter was cancelled
+                    self.release()
+                raise
+            finally:
+                stats.queued -= 1
+        stats.record(time.monotonic() - start)
+
+    def release(self):
+        """
+        Frees the slot of an evaluation that has completed.
+        """
+        self.in_flight -= 1
+        while self.has_capacity():
+            future = self.next_waiter()
+            if not future:
+                return
+            self.in_flight += 1
+            future.set_result(None)
+
+    def next_waiter(self) -> Optional[asyncio.Future]:
+        for priority in Priority:
+            queue = self.queues[priority]
+            while queue:
+                future = queue.popleft()
+                if not future.done():
+                    return future
+        return None
@@ -0,0 +1,257 @@
+import asyncio
+import os
+import threading
+from typing import Any, Coroutine, Dict, Iterator, List, Optional
+
+from ..types.evaluator import Evaluator
+from .evaluator import EvaluatorImpl, output_files_expr
+from .evaluator_manager import EvaluatorManagerImpl
+from .evaluator_options import EvaluatorOptions
+from .module_source import ModuleSource
+from .output import output_payload, write_files, write_payload
+from .result_cache import ResultCache
+from .disk_cache import DiskCache
+from .scheduler import Priority
+
+
+class SyncEvaluatorManager:
+    """
+    SyncEvaluatorManager is a blocking facade over EvaluatorManagerImpl, for code that does not
+    run an event loop (for example Django views or Celery tasks).
+
+    The manager runs on a dedicated event loop thread that lives as long as the manager, so the
+    Pkl process and the evaluators are reused across calls. Calls may be made from any thread
+    except the loop thread itself.
+
+    Create the manager once per process, after forking; Celery's `worker_process_init` signal is
+    a good place for that.
+
+    Keyword arguments are passed on to EvaluatorManagerImpl.
+    """
+
+    def __init__(self, pkl_command: List[str] = [], **kwargs):
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="pkl-evaluator-manager", daemon=True
+        )
+        self.thread.start()
+        self.manager: EvaluatorManagerImpl = self.run(
+            self.create_manager(pkl_command, kwargs)
+        )
+        self.closed = False
+
+    async def create_manager(self, pkl_command: List[str], kwargs: Dict[str, Any]):
+        manager = EvaluatorManagerImpl(pkl_command, **kwargs)
+        if manager.warm_up_enabled:
+            # start Pkl now, so that it warms up before the first evaluator is asked for
+            await manager.start()
+        return manager
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        Runs coro on the manager's event loop and blocks until it completes.
+        """
+        if os.getpid() != self.pid:
+            coro.close()
+            raise Exception(
+                "SyncEvaluatorManager cannot be used after fork; create it in the child process"
+            )
+        if threading.current_thread() is self.thread:
+            coro.close()
+            raise Exception(
+                "SyncEvaluatorManager cannot be called from its own event loop thread"
+            )
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def get_version(self) -> str:
+        return self.run(self.manager.get_version())
+
+    def new_evaluator(self, opts: EvaluatorOptions) -> "SyncEvaluator":
+        return SyncEvaluator(self, self.run(self.manager.new_evaluator(opts)))
+
+    def get_or_create_evaluator(self, opts: EvaluatorOptions) -> "SyncEvaluator":
+        return SyncEvaluator(self, self.run(self.manager.get_or_create_evaluator(opts)))
+
+    def new_project_evaluator(
+        self, project_dir: str, opts: EvaluatorOptions
+    ) -> "SyncEvaluator":
+        return SyncEvaluator(
+            self, self.run(self.manager.new_project_evaluator(project_dir, opts))
+        )
+
+    def close(self):
+        """
+        Closes the Pkl process and stops the event loop thread.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.run(self.close_manager())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def close_manager(self):
+        self.manager.close()
+        if self.manager.cmd:
+            await self.manager.cmd.wait()
+
+    def __enter__(self) -> "SyncEvaluatorManager":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SyncEvaluator(Evaluator):
+    """
+    SyncEvaluator is the blocking counterpart of EvaluatorImpl, created by
+    SyncEvaluatorManager.new_evaluator.
+    """
+
+    def __init__(self, manager: SyncEvaluatorManager, evaluator: EvaluatorImpl):
+        self.manager = manager
+        self.evaluator = evaluator
+
+    def evaluate_module(
+        self,
+        source: ModuleSource,
+        priority: Priority = Priority.INTERACTIVE,
+        lazy: bool = False,
+    ) -> Any:
+        return self.manager.run(self.evaluator.evaluate_module(source, priority, lazy))
+
+    def evaluate_output_text(
+        self, source: ModuleSource, priority: Priority = Priority.INTERACTIVE
+    ) -> str:
+        return self.manager.run(self.evaluator.evaluate_output_text(source, priority))
+
+    def evaluate_output_value(
+        self,
+        source: ModuleSource,
+        priority: Priority = Priority.INTERACTIVE,
+        lazy: bool = False,
+    ) -> Any:
+        return self.manager.run(
+            self.evaluator.evaluate_output_value(source, priority, lazy)
+        )
+
+    def evaluate_output_files(
+        self, source: ModuleSource, priority: Priority = Priority.INTERACTIVE
+    ) -> Dict[str, str]:
+        return self.manager.run(self.evaluator.evaluate_output_files(source, priority))
+
+    @property
+    def result_cache(self) -> Optional[ResultCache]:
+        return self.evaluator.result_cache
+
+    @result_cache.setter
+    def result_cache(self, cache: Optional[ResultCache]):
+        self.evaluator.result_cache = cache
+
+    @property
+    def disk_cache(self) -> Optional[DiskCache]:
+        return self.evaluator.disk_cache
+
+    @disk_cache.setter
+    def disk_cache(self, cache: Optional[DiskCache]):
+        self.evaluator.disk_cache = cache
+
+    @property
+    def coalesced(self) -> int:
+        return self.evaluator.coalesced
+
+    def write_output_text(
+        self, source: ModuleSource, sink: Any, priority: Priority = Priority.INTERACTIVE
+    ) -> int:
+        return self.write_expression(source, "output.text", sink, priority)
+
+    def write_output_bytes(
+        self, source: ModuleSource, sink: Any, priority: Priority = Priority.INTERACTIVE
+    ) -> int:
+        return self.write_expression(source, "output.bytes", sink, priority)
+
+    def write_expression(
+        self,
+        source: ModuleSource,
+        expr: str,
+        sink: Any,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> int:
+        # the result is fetched on the loop thread, but written to sink from this one
+        raw = self.manager.run(
+            self.evaluator.evaluate_expression_raw(source, expr, priority)
+        )
+        return write_payload(output_payload(raw), sink)
+
+    def write_output_files(
+        self,
+        source: ModuleSource,
+        dest_dir: str,
+        priority: Priority = Priority.INTERACTIVE,
+        max_workers: Optional[int] = None,
+    ) -> List[str]:
+        raw = self.manager.run(
+            self.evaluator.evaluate_expression_raw(source, output_files_expr, priority)
+        )
+        return write_files(raw, dest_dir, max_workers)
+
+    def evaluate_expression(
+        self,
+        source: ModuleSource,
+        expr: str,
+        priority: Priority = Priority.INTERACTIVE,
+        lazy: bool = False,
+    ) -> Any:
+        return self.manager.run(
+            self.evaluator.evaluate_expression(source, expr, priority, lazy)
+        )
+
+    def stream_expression(
+        self,
+        source: ModuleSource,
+        expr: str,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> Iterator[Any]:
+        # the result is fetched on the loop thread, but decoded here as it is iterated
+        raw = self.manager.run(
+            self.evaluator.evaluate_expression_raw(source, expr, priority)
+        )
+        return self.evaluator.manager.decoder.iter_elements(raw)
+
+    def watch(
+        self,
+        source: ModuleSource,
+        expr: str,
+        priority: Priority = Priority.INTERACTIVE,
+        debounce: float = 0.1,
+        poll_interval: float = 1.0,
+    ) -> Iterator[Any]:
+        # the watch runs on the loop thread, one step per value
+        values = self.evaluator.watch(source, expr, priority, debounce, poll_interval)
+        try:
+            while True:
+                try:
+                    yield self.manager.run(values.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.manager.run(values.aclose())
+
+    def evaluate_expression_raw(
+        self,
+        source: ModuleSource,
+        expr: str,
+        priority: Priority = Priority.INTERACTIVE,
+    ) -> memoryview:
+        return self.manager.run(
+            self.evaluator.evaluate_expression_raw(source, expr, priority)
+        )
+
+    def close(self) -> None:
+        self.manager.loop.call_soon_threadsafe(self.evaluator.close)
+
+    @property
+    def closed(self) -> bool:
+        return self.evaluator.closed
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+log = logging.getLogger(__name__)
+
+
+class Transport(ABC):
+    """
+    Transport is the byte stream between an EvaluatorManager and a `pkl server`.
+
+    Messages are framed the same way on every transport: a stream of msgpack
+    `[code, body]` arrays in each direction.
+    """
+
+    # reader and writer are available once connect has returned.
+    reader: Optional[asyncio.StreamReader] = None
+    writer: Optional[asyncio.StreamWriter] = None
+
+    # process is the `pkl server` child process, if this transport owns one.
+    process: Optional[asyncio.subprocess.Process] = None
+
+    @abstractmethod
+    async def connect(self, limit: int) -> None:
+        """
+        Opens the stream. limit is the buffer limit of the reader.
+        """
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+
+class SubprocessTransport(Transport):
+    """
+    SubprocessTransport spawns `pkl server` and talks to it over stdin and stdout.
+    """
+
+    def __init__(self, program: str, args: List[str]):
+        self.program = program
+        self.args = args
+
+    async def connect(self, limit: int) -> None:
+        self.process = await asyncio.create_subprocess_exec(
+            self.program,
+            *self.args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=limit,
+        )
+        self.reader = self.process.stdout
+        self.writer = self.process.stdin
+        asyncio.create_task(self.log_stderr())
+
+    async def log_stderr(self):
+        while not self.process.stderr.at_eof():
+            stderr_line = await self.process.stderr.readline()
+            log.info(stderr_line)
+
+    def close(self) -> None:
+        if self.process and self.process.returncode is None:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+
+
+class SocketTransport(Transport):
+    def close(self) -> None:
+        if self.writer:
+            self.writer.close()
+
+
+class UnixSocketTransport(SocketTransport):
+    """
+    UnixSocketTransport connects to a `pkl server` bridge listening on a Unix domain socket.
+
+    See `pkl_python.evaluator.bridge`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def connect(self, limit: int) -> None:
+        self.reader, self.writer = await asyncio.open_unix_connection(
+            self.path, limit=limit
+        )
+
+
+class TcpTransport(SocketTransport):
+    """
+    TcpTransport connects to a `pkl server` bridge listening on a TCP port.
+
+    See `pkl_python.evaluator.bridge`.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+
+    async def connect(self, limit: int) -> None:
+        self.reader, self.writer = await asyncio.open_connection(
+            self.host, self.port, limit=limit
+        )
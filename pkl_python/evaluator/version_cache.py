@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+# Features of Pkl that this library may use, keyed by the first Pkl version to support them.
+FEATURES: Dict[str, Tuple[int, int, int]] = {
+    "server": (0, 25, 0),
+    "http": (0, 26, 0),
+    "external_readers": (0, 27, 0),
+}
+
+
+def supported_features(version: str) -> List[str]:
+    """
+    Returns the features supported by the given Pkl version.
+    """
+    core = version.split("-")[0].split("+")[0]
+    parsed = tuple(int(part) for part in core.split("."))
+    return sorted(name for name, since in FEATURES.items() if parsed >= since)
+
+
+def cache_path() -> str:
+    """
+    Returns the file that caches the version of each Pkl binary.
+
+    The file lives in $PKL_PYTHON_CACHE_DIR if set, and in the user's cache directory otherwise.
+    """
+    cache_dir = os.environ.get("PKL_PYTHON_CACHE_DIR") or os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "pkl-python",
+    )
+    return os.path.join(cache_dir, "versions.json")
+
+
+def cache_key(cmd: str, args: List[str]) -> Optional[str]:
+    """
+    Identifies a Pkl binary by its resolved path and modification time, so that the cached
+    entry goes stale when the binary is replaced.
+
+    Returns None if the binary cannot be found.
+    """
+    path = shutil.which(cmd)
+    if not path:
+        return None
+    path = os.path.realpath(path)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    return json.dumps([path, mtime, args])
+
+
+def load_entries() -> Dict[str, Dict]:
+    try:
+        with open(cache_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def read_cached_version(key: str) -> Optional[Dict]:
+    """
+    Returns the cached `{"version", "features"}` entry for key, if any.
+    """
+    return load_entries().get(key)
+
+
+def write_cached_version(key: str, version: str) -> Dict:
+    """
+    Stores the version of the binary identified by key and returns the new entry.
+
+    Failing to write the cache is not an error; the version is simply looked up again next time.
+    """
+    entry = {"version": version, "features": supported_features(version)}
+    entries = load_entries()
+    entries[key] = entry
+    path = cache_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    return entry
@@ -0,0 +1,202 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from .disk_cache import file_path, scan_file_dependencies
+from .module_source import ModuleSource
+from .scheduler import Priority
+
+log = logging.getLogger(__name__)
+
+# inotify flags, from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+watch_mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+event_header = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """
+    InotifyWatcher wakes up when any of a set of files is written, replaced or removed.
+
+    Directories rather than files are watched, so that files that editors replace by renaming
+    a new file over them stay watched.
+    """
+
+    def __init__(self, libc, paths: List[str]):
+        self.libc = libc
+        self.changed = asyncio.Event()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.names: Dict[int, Set[str]] = {}
+        try:
+            directories: Dict[str, Set[str]] = {}
+            for path in paths:
+                directory, name = os.path.split(path)
+                directories.setdefault(directory, set()).add(name)
+            for directory, names in directories.items():
+                wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), watch_mask)
+                if wd < 0:
+                    raise OSError(ctypes.get_errno(), f"cannot watch {directory}")
+                self.names[wd] = {os.fsencode(name) for name in names}
+        except BaseException:
+            os.close(self.fd)
+            raise
+        asyncio.get_running_loop().add_reader(self.fd, self.read_events)
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = event_header.unpack_from(data, offset)
+            offset += event_header.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if name in self.names.get(wd, ()):
+                self.changed.set()
+
+    async def wait(self):
+        await self.changed.wait()
+        self.changed.clear()
+
+    def close(self):
+        asyncio.get_running_loop().remove_reader(self.fd)
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    PollingWatcher wakes up when the modification time or size of any of a set of files
+    changes, checking every interval seconds. It is used where inotify is not available.
+    """
+
+    def __init__(self, paths: List[str], interval: float):
+        self.paths = paths
+        self.interval = interval
+        self.snapshot = self.stat()
+
+    def stat(self) -> List[Optional[Tuple[int, int]]]:
+        result = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                result.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                result.append(None)
+        return result
+
+    async def wait(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            snapshot = self.stat()
+            if snapshot != self.snapshot:
+                self.snapshot = snapshot
+                return
+
+    def close(self):
+        pass
+
+
+def load_libc():
+    name = ctypes.util.find_library("c")
+    if name is None:
+        return None
+    libc = ctypes.CDLL(name, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+
+libc = None
+
+
+def new_watcher(paths: List[str], poll_interval: float):
+    """
+    Returns an InotifyWatcher for paths where inotify is available, and a PollingWatcher
+    otherwise.
+    """
+    global libc
+    if libc is None:
+        libc = load_libc() or False
+    if libc:
+        try:
+            return InotifyWatcher(libc, paths)
+        except OSError as e:
+            log.warning(f"falling back to polling for file changes: {e}")
+    return PollingWatcher(paths, poll_interval)
+
+
+async def watch_expression(
+    evaluator,
+    source: ModuleSource,
+    expr: str,
+    priority: Priority,
+    debounce: float,
+    poll_interval: float,
+) -> AsyncIterator[Any]:
+    # Yields the value of expr now, and again each time the local files that the module
+    # depends on change. Each re-evaluation uses a new evaluator, because Pkl keeps the
+    # modules an evaluator has loaded for its whole life.
+    #
+    # The files are watched from before each evaluation, and hashed again after each value
+    # is consumed, so that changes made meanwhile are not missed.
+    dependencies = None
+    watched = None
+    watcher = None
+    try:
+        while True:
+            scanned, complete = scan_file_dependencies(source.uri, source.contents)
+            paths = [file_path(uri) for _, uri, _ in scanned]
+            if paths != watched:
+                if watcher is not None:
+                    watcher.close()
+                watcher = new_watcher(paths, poll_interval)
+                watched = paths
+            if scanned != dependencies:
+                if dependencies is None:
+                    if not complete:
+                        log.warning(f"only some dependencies of {source.uri} can be watched")
+                    value = await evaluator.evaluate_expression(source, expr, priority)
+                    dependencies = scanned
+                    yield value
+                    continue
+                dependencies = scanned
+                current = await evaluator.manager.new_evaluator(evaluator.options)
+                current.resource_readers = evaluator.resource_readers
+                current.module_readers = evaluator.module_readers
+                try:
+                    value = await current.evaluate_expression(source, expr, priority)
+                except Exception as e:
+                    # keep the last good value until the files are fixed
+                    log.warning(f"re-evaluating {source.uri} failed: {e}")
+                    continue
+                finally:
+                    current.close()
+                yield value
+                continue
+            await watcher.wait()
+            # wait for the files to settle, so a burst of writes leads to one evaluation
+            while True:
+                try:
+                    await asyncio.wait_for(watcher.wait(), debounce)
+                except asyncio.TimeoutError:
+                    break
+    finally:
+        if watcher is not None:
+            watcher.close()
@@ -1,6 +1,6 @@
 # Evaluator is an interface for evaluating Pkl modules.
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from ..evaluator.module_source import ModuleSource
 
@@ -31,18 +31,62 @@ class Evaluator(ABC):
     def evaluate_output_files(self, source: ModuleSource) -> Dict[str, str]:
         pass
 
+    # writeOutputFiles evaluates the `output.files` property of the given module, and writes
+    # each file under destDir in parallel, atomically, skipping files that are unchanged on
+    # disk. Returns the paths of the files written.
+    @abstractmethod
+    def write_output_files(self, source: ModuleSource, dest_dir: str) -> List[str]:
+        pass
+
+    # writeOutputText evaluates the `output.text` property of the given module, and writes it
+    # to sink as UTF-8 without decoding it into a string. sink may be a file descriptor, a
+    # socket, a bytearray or a binary file; asynchronous evaluators also accept an
+    # asyncio.StreamWriter. Returns the number of bytes written.
+    @abstractmethod
+    def write_output_text(self, source: ModuleSource, sink: Any) -> int:
+        pass
+
+    # writeOutputBytes is like writeOutputText, but writes the `output.bytes` property.
+    @abstractmethod
+    def write_output_bytes(self, source: ModuleSource, sink: Any) -> int:
+        pass
+
+    # writeExpression is like writeOutputText, but writes the result of the provided expression,
+    # which must be a String or Bytes.
+    @abstractmethod
+    def write_expression(self, source: ModuleSource, expr: str, sink: Any) -> int:
+        pass
+
     # evaluateExpression evaluates the provided expression on the given module source, and writes
     # the result into the value pointed by out.
+    #
+    # Implementations may take a lazy flag, in which case the result is a read-only view that
+    # decodes its members as they are accessed.
+    #
+    # Identical evaluations made while one is in flight share its result, so callers that run
+    # concurrently may be handed the same value, which must not be modified.
     @abstractmethod
     def evaluate_expression(self, source: ModuleSource, expr: str) -> Any:
         pass
 
+    # streamExpression evaluates the provided expression, which must produce a List, Listing or
+    # Set, and returns an iterator that decodes its elements one at a time.
+    @abstractmethod
+    def stream_expression(self, source: ModuleSource, expr: str) -> Any:
+        pass
+
+    # watch evaluates the provided expression, and returns an iterator that yields its value and
+    # then a new value each time a local file that the module depends on changes.
+    @abstractmethod
+    def watch(self, source: ModuleSource, expr: str) -> Any:
+        pass
+
     # evaluateExpressionRaw evaluates the provided module, and returns the underlying value's raw
     # bytes.
     #
     # This is a low level API.
     @abstractmethod
-    def evaluate_expression_raw(self, source: ModuleSource, expr: str) -> bytes:
+    def evaluate_expression_raw(self, source: ModuleSource, expr: str) -> memoryview:
         pass
 
     # close closes the evaluator and releases any underlying resources.
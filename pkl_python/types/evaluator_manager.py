@@ -28,6 +28,16 @@ class EvaluatorManagerInterface(ABC):
         """
         pass
 
+    @abstractmethod
+    def get_or_create_evaluator(self, opts: EvaluatorOptions) -> Evaluator:
+        """
+        Returns an evaluator shared with every other caller passing equivalent options, so that
+        they also share the modules Pkl has loaded.
+
+        Each caller must close the evaluator once done with it.
+        """
+        pass
+
     @abstractmethod
     def new_project_evaluator(
         self, project_dir: str, opts: EvaluatorOptions
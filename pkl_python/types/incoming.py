@@ -1,54 +1,58 @@
-from typing import Dict, Optional, Tuple, Union
-from pydantic import BaseModel, FileUrl
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple, Union
 from . import codes
 
 
-class IncomingMessage(BaseModel):
-    pass
-
-
-class CreateEvaluatorResponse(IncomingMessage):
-    evaluatorId: int
+@dataclass(slots=True)
+class CreateEvaluatorResponse:
     requestId: int
-    error: Optional[int] = None
+    evaluatorId: Optional[int] = None
+    error: Optional[str] = None
 
 
-class EvaluateResponse(IncomingMessage):
+@dataclass(slots=True)
+class EvaluateResponse:
     evaluatorId: int
     requestId: int
-    result: str
-    error: int
+    # result is a view over the bytes read off the wire; it is never copied.
+    result: Optional[memoryview] = None
+    error: Optional[str] = None
 
 
-class ReadResource(IncomingMessage):
+@dataclass(slots=True)
+class ReadResource:
     evaluatorId: int
     requestId: int
-    uri: FileUrl
+    uri: str
 
 
-class ReadModule(IncomingMessage):
+@dataclass(slots=True)
+class ReadModule:
     evaluatorId: int
     requestId: int
-    uri: FileUrl
+    uri: str
 
 
-class Log(IncomingMessage):
+@dataclass(slots=True)
+class Log:
     evaluatorId: int
     level: int
     message: str
-    frameUri: str
+    frameUri: Optional[str] = None
 
 
-class ListResources(IncomingMessage):
+@dataclass(slots=True)
+class ListResources:
     evaluatorId: int
     requestId: int
-    uri: FileUrl
+    uri: str
 
 
-class ListModules(IncomingMessage):
+@dataclass(slots=True)
+class ListModules:
     evaluatorId: int
     requestId: int
-    uri: FileUrl
+    uri: str
 
 
 IncomingMessage = Union[
@@ -62,23 +66,44 @@ IncomingMessage = Union[
 ]
 
 
+def decode_evaluate_response(map: Dict) -> EvaluateResponse:
+    result = map.get("result")
+    return EvaluateResponse(
+        map["evaluatorId"],
+        map["requestId"],
+        None if result is None else memoryview(result),
+        map.get("error"),
+    )
+
+
+# decoders builds each kind of incoming message from its body, keyed by message code. Fields
+# are taken by name, so fields added by newer versions of Pkl are ignored.
+decoders: Dict[int, Callable[[Dict], IncomingMessage]] = {
+    codes.EvaluateResponse: decode_evaluate_response,
+    codes.EvaluateLog: lambda map: Log(
+        map["evaluatorId"], map["level"], map["message"], map.get("frameUri")
+    ),
+    codes.NewEvaluatorResponse: lambda map: CreateEvaluatorResponse(
+        map["requestId"], map.get("evaluatorId"), map.get("error")
+    ),
+    codes.EvaluateRead: lambda map: ReadResource(
+        map["evaluatorId"], map["requestId"], map["uri"]
+    ),
+    codes.EvaluateReadModule: lambda map: ReadModule(
+        map["evaluatorId"], map["requestId"], map["uri"]
+    ),
+    codes.ListResourcesRequest: lambda map: ListResources(
+        map["evaluatorId"], map["requestId"], map["uri"]
+    ),
+    codes.ListModulesRequest: lambda map: ListModules(
+        map["evaluatorId"], map["requestId"], map["uri"]
+    ),
+}
+
+
 def decode(incoming: Tuple[int, Dict]) -> "IncomingMessage":
     code, map = incoming
-    value = None
-    if code == codes.EvaluateResponse:
-        value = EvaluateResponse(**map, code=codes.EvaluateResponse)
-    elif code == codes.EvaluateLog:
-        value = Log(**map, code=codes.EvaluateLog)
-    elif code == codes.NewEvaluatorResponse:
-        value = CreateEvaluatorResponse(**map, code=codes.NewEvaluatorResponse)
-    elif code == codes.EvaluateRead:
-        value = ReadResource(**map, code=codes.EvaluateRead)
-    elif code == codes.EvaluateReadModule:
-        value = ReadModule(**map, code=codes.EvaluateReadModule)
-    elif code == codes.ListResourcesRequest:
-        value = ListResources(**map, code=codes.ListResourcesRequest)
-    elif code == codes.ListModulesRequest:
-        value = ListModules(**map, code=codes.ListModulesRequest)
-    else:
+    decoder = decoders.get(code)
+    if decoder is None:
         raise ValueError(f"Unknown code: {code}")
-    return value
+    return decoder(map)
@@ -1,8 +1,12 @@
 from dataclasses import dataclass
 from ..types import codes
 from .base_model import BaseModel
-from typing import Dict, List, Literal, Union, Optional
+from typing import Any, Dict, List, Union, Optional
 
+
+# ResourceReader and ModuleReader are part of the user-facing EvaluatorOptions, so they are
+# validated models; the messages below are plain slotted classes, built and packed once per
+# message on the hot path.
 class ResourceReader(BaseModel):
     scheme: str
     hasHierarchicalUris: bool
@@ -16,18 +20,53 @@ class ModuleReader(BaseModel):
     isLocal: bool
 
 
-class Checksums(BaseModel):
+# types that msgpack packs as they are
+plain_types = (str, int, bool, float, bytes)
+
+
+class Message:
+    __slots__ = ()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the message body as packed for `pkl server`, leaving out unset fields.
+        """
+        body = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not None:
+                body[name] = value if type(value) in plain_types else encode_value(value)
+        return body
+
+
+def encode_value(value: Any) -> Any:
+    if isinstance(value, Message):
+        return value.to_dict()
+    if isinstance(value, BaseModel):
+        return value.model_dump(exclude_none=True)
+    if isinstance(value, list):
+        return [encode_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    return value
+
+
+@dataclass(slots=True)
+class Checksums(Message):
     checksums: str
 
 
-class ProjectOrDependency(BaseModel):
+@dataclass(slots=True)
+class ProjectOrDependency(Message):
     packageUri: Optional[str] = None
     type: Optional[str] = None
     projectFileUri: Optional[str] = None
     checksums: Optional[Checksums] = None
     dependencies: Optional[Dict[str, "ProjectOrDependency"]] = None
 
-class CreateEvaluator(BaseModel):
+
+@dataclass(slots=True)
+class CreateEvaluator(Message):
     requestId: int
     clientResourceReaders: Optional[List[ResourceReader]] = None
     clientModuleReaders: Optional[List[ModuleReader]] = None
@@ -40,53 +79,85 @@ class CreateEvaluator(BaseModel):
     rootDir: Optional[str] = None
     cacheDir: Optional[str] = None
     project: Optional[ProjectOrDependency] = None
-    _code: codes.OutgoingCode = codes.NewEvaluator
+    _code = codes.NewEvaluator
+
 
-class Evaluate(BaseModel):
+@dataclass(slots=True)
+class Evaluate(Message):
     requestId: int
     evaluatorId: int
     moduleUri: str
     expr: Optional[str] = None
     moduleText: Optional[str] = None
-    _code: codes.OutgoingCode = codes.Evaluate
-
-
-class ReadResource(BaseModel):
+    _code = codes.Evaluate
+
+    def to_dict(self) -> Dict[str, Any]:
+        # sent for every evaluation, and made of strings and ints only
+        body = {
+            "requestId": self.requestId,
+            "evaluatorId": self.evaluatorId,
+            "moduleUri": self.moduleUri,
+        }
+        if self.expr is not None:
+            body["expr"] = self.expr
+        if self.moduleText is not None:
+            body["moduleText"] = self.moduleText
+        return body
+
+
+@dataclass(slots=True)
+class PathElement(Message):
+    name: str
+    isDirectory: bool
+
+
+@dataclass(slots=True)
+class ReadResourceResponse(Message):
     requestId: int
     evaluatorId: int
-    uri: str
-    _code: codes.OutgoingCode
+    contents: Optional[bytes] = None
+    error: Optional[str] = None
+    _code = codes.EvaluateReadResponse
 
 
-class ReadModule(BaseModel):
+@dataclass(slots=True)
+class ReadModuleResponse(Message):
     requestId: int
     evaluatorId: int
-    uri: str
-    _code: codes.OutgoingCode
+    contents: Optional[str] = None
+    error: Optional[str] = None
+    _code = codes.EvaluateReadModuleResponse
 
-class ListResources(BaseModel):
+
+@dataclass(slots=True)
+class ListResourcesResponse(Message):
     requestId: int
     evaluatorId: int
-    uri: str
-    _code: codes.OutgoingCode
+    pathElements: Optional[List[PathElement]] = None
+    error: Optional[str] = None
+    _code = codes.ListResourcesResponse
+
 
-class ListModules(BaseModel):
+@dataclass(slots=True)
+class ListModulesResponse(Message):
     requestId: int
     evaluatorId: int
-    uri: str
-    _code: codes.OutgoingCode
+    pathElements: Optional[List[PathElement]] = None
+    error: Optional[str] = None
+    _code = codes.ListModulesResponse
 
-class CloseEvaluator(BaseModel):
-    requestId: int
+
+@dataclass(slots=True)
+class CloseEvaluator(Message):
     evaluatorId: int
-    _code: codes.OutgoingCode
+    _code = codes.CloseEvaluator
 
 OutgoingMessage = Union[
     CreateEvaluator,
     Evaluate,
-    ReadResource,
-    ReadModule,
-    ListResources,
-    ListModules,
+    ReadResourceResponse,
+    ReadModuleResponse,
+    ListResourcesResponse,
+    ListModulesResponse,
     CloseEvaluator,
 ]
@@ -1,9 +1,10 @@
 from __future__ import annotations
+from dataclasses import dataclass
 from typing import Any, Dict, List, Tuple, Union, Set, TypeAlias
 from enum import Enum
 
 # BaseObject is the Python representation of `pkl.base#Object`.
-BaseObject: TypeAlias = Dict[str, PklAny]
+BaseObject: TypeAlias = Dict[str, "PklAny"]
 
 
 # Dynamic is the Python representation of `pkl.base#Dynamic`.
@@ -32,6 +33,7 @@ class DataSizeUnit(Enum):
 #
 # It represents a quantity of binary data, represented by value (e.g. 30.5) and unit
 # (e.g. mb).
+@dataclass(slots=True)
 class DataSize:
     # value is the value of this data size.
     value: float
@@ -46,7 +48,7 @@ class DurationUnit(Enum):
     MS = "ms"
     S = "s"
     MIN = "min"
-    HOUR = "hour"
+    HOUR = "h"
     D = "d"
 
 
@@ -54,6 +56,7 @@ class DurationUnit(Enum):
 #
 # It represents an amount of time, represented by value (e.g. 30.5) and unit
 # (e.g. s).
+@dataclass(slots=True)
 class Duration:
     # value is the value of this duration.
     value: float
@@ -66,6 +69,7 @@ class Duration:
 #
 # This value exists for compatibility. IntSeq should preferrably be used as a way to describe
 # logic within a Pkl program, and not passed as data between Pkl and Python.
+@dataclass(slots=True)
 class IntSeq:
     # start is the start of this seqeunce.
     start: int
@@ -78,20 +82,21 @@ class IntSeq:
 
 
 # Regex is the Python representation of `pkl.base#Regex`.
+@dataclass(slots=True)
 class Regex:
     # pattern is the regex pattern expression in string form.
     pattern: str
 
 
 # Pair is the Python representation of `pkl.base#Pair`.
-Pair: TypeAlias = Tuple[Any, PklAny]
+Pair: TypeAlias = Tuple[Any, "PklAny"]
 
 AnyObject: TypeAlias = Union[
     BaseObject,
     Dynamic,
-    Dict[Any, PklAny],
-    List[PklAny],
-    Set[PklAny],
+    Dict[Any, "PklAny"],
+    List["PklAny"],
+    Set["PklAny"],
     Duration,
     DataSize,
     Pair,
@@ -100,4 +105,4 @@ AnyObject: TypeAlias = Union[
     Dict,
 ]
 
-PklAny: TypeAlias = Union[None, AnyObject, Dict[PklAny, PklAny], str, int, bool]
+PklAny: TypeAlias = Union[None, AnyObject, Dict["PklAny", "PklAny"], str, int, float, bool]
@@ -0,0 +1,138 @@
+"""
+A stand-in for the `pkl` binary used by the tests, speaking the `pkl server` message protocol.
+
+Evaluations are driven by the expression:
+
+    echo:<text>     returns <text>
+    json:<json>     returns the JSON value, packed as-is (used to build encoded Pkl values)
+    bytes:<text>    returns the UTF-8 encoding of <text> as Pkl Bytes
+    cat:<path>      returns the text of the file at <path>
+    read:<uri>      asks the client to read the resource at <uri>, and returns its text, or the
+                    read error
+    fail:<message>  returns <message> as an evaluation error
+    noise:<text>    sends a message with an unknown code and a log with an unknown level, then
+                    returns <text>
+    output.files... returns the module text, a JSON object of paths to text, as a Mapping
+    output.value    returns the module text, or the file at the module URI, as a JSON value
+                    packed as-is
+    exit            exits the process without responding
+    exit-once:<f>   exits without responding unless file <f> exists, creating it first
+    <other>         returns the expression itself
+"""
+import json
+import os
+import sys
+
+import msgpack
+
+NewEvaluator = 0x20
+NewEvaluatorResponse = 0x21
+CloseEvaluator = 0x22
+Evaluate = 0x23
+EvaluateResponse = 0x24
+EvaluateLog = 0x25
+EvaluateRead = 0x26
+EvaluateReadResponse = 0x27
+
+
+def evaluate(expr: str, module_text: str, module_uri: str) -> dict:
+    if expr.startswith("echo:"):
+        return {"result": msgpack.packb(expr[len("echo:") :])}
+    if expr.startswith("json:"):
+        return {"result": msgpack.packb(json.loads(expr[len("json:") :]))}
+    if expr.startswith("bytes:"):
+        return {"result": msgpack.packb([0xF, expr[len("bytes:") :].encode()])}
+    if expr.startswith("output.files"):
+        return {"result": msgpack.packb([0x3, json.loads(module_text)])}
+    if expr == "output.value":
+        if module_text is None:
+            with open(module_uri[len("file://") :]) as f:
+                module_text = f.read()
+        return {"result": msgpack.packb(json.loads(module_text))}
+    if expr.startswith("cat:"):
+        with open(expr[len("cat:") :]) as f:
+            return {"result": msgpack.packb(f.read())}
+    if expr.startswith("fail:"):
+        return {"error": expr[len("fail:") :]}
+    if expr == "exit":
+        sys.exit(1)
+    if expr.startswith("exit-once:"):
+        marker = expr[len("exit-once:") :]
+        if not os.path.exists(marker):
+            open(marker, "w").close()
+            sys.exit(1)
+        return {"result": msgpack.packb("restarted")}
+    return {"result": msgpack.packb(expr)}
+
+
+def serve():
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    unpacker = msgpack.Unpacker()
+    next_evaluator_id = 1
+    # evaluations waiting for a resource read, keyed by the request id of the read
+    reading = {}
+    read_ids = iter(range(1_000_000, 2_000_000))
+    while True:
+        data = stdin.read1(64 * 1024)
+        if not data:
+            return
+        unpacker.feed(data)
+        for code, msg in unpacker:
+            if code == NewEvaluator:
+                response = [
+                    NewEvaluatorResponse,
+                    {"requestId": msg["requestId"], "evaluatorId": next_evaluator_id},
+                ]
+                next_evaluator_id += 1
+            elif code == Evaluate and msg.get("expr", "").startswith("read:"):
+                read_id = next(read_ids)
+                reading[read_id] = msg
+                response = [
+                    EvaluateRead,
+                    {
+                        "requestId": read_id,
+                        "evaluatorId": msg["evaluatorId"],
+                        "uri": msg["expr"][len("read:") :],
+                    },
+                ]
+            elif code == EvaluateReadResponse:
+                evaluation = reading.pop(msg["requestId"])
+                contents = msg.get("contents")
+                text = msg.get("error") if contents is None else contents.decode()
+                response = [
+                    EvaluateResponse,
+                    {
+                        "requestId": evaluation["requestId"],
+                        "evaluatorId": evaluation["evaluatorId"],
+                        "result": msgpack.packb(text),
+                    },
+                ]
+            elif code == Evaluate:
+                expr = msg.get("expr", "")
+                if expr.startswith("noise:"):
+                    stdout.write(msgpack.packb([0x7F, {"evaluatorId": msg["evaluatorId"]}]))
+                    log = {"evaluatorId": msg["evaluatorId"], "level": 9, "message": "hi"}
+                    stdout.write(msgpack.packb([EvaluateLog, log]))
+                    expr = "echo:" + expr[len("noise:") :]
+                response = [
+                    EvaluateResponse,
+                    {
+                        "requestId": msg["requestId"],
+                        "evaluatorId": msg["evaluatorId"],
+                        **evaluate(expr, msg.get("moduleText"), msg.get("moduleUri")),
+                    },
+                ]
+            else:
+                continue
+            stdout.write(msgpack.packb(response))
+        stdout.flush()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--version"]:
+        print("Pkl 0.25.3 (Linux 5.15.0, native)")
+    elif sys.argv[1:] == ["server"]:
+        serve()
+    else:
+        sys.exit(f"unsupported arguments: {sys.argv[1:]}")
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+import msgpack
+
+from pkl_python.evaluator.bridge import Bridge
+from pkl_python.evaluator.evaluator_manager import EvaluatorManagerImpl
+from pkl_python.evaluator.evaluator_options import EvaluatorOptions
+from pkl_python.evaluator.module_source import TextSource
+from pkl_python.evaluator.transport import SubprocessTransport, TcpTransport, UnixSocketTransport
+from pkl_python.types import codes
+
+FAKE_PKL = os.path.join(os.path.dirname(__file__), "fake_pkl.py")
+
+
+class TestBridge(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.bridge = Bridge(SubprocessTransport(sys.executable, [FAKE_PKL, "server"]))
+        self.managers = []
+
+    async def asyncTearDown(self):
+        for manager in self.managers:
+            manager.close()
+        self.bridge.close()
+
+    def new_manager(self, transport):
+        manager = EvaluatorManagerImpl(transport=transport)
+        self.managers.append(manager)
+        return manager
+
+    async def evaluate_concurrently(self, manager, name):
+        evaluators = await asyncio.gather(
+            *(manager.new_evaluator(EvaluatorOptions()) for _ in range(3))
+        )
+        return await asyncio.gather(
+            *(ev.evaluate_expression(TextSource(""), f"echo:{name}-{i}") for i, ev in enumerate(evaluators * 10))
+        )
+
+    async def test_clients_share_one_pkl_server_over_unix_socket(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "pkl.sock")
+            server = await self.bridge.serve_unix(path)
+            self.addCleanup(server.close)
+            first = self.new_manager(UnixSocketTransport(path))
+            second = self.new_manager(UnixSocketTransport(path))
+            first_results, second_results = await asyncio.gather(
+                self.evaluate_concurrently(first, "first"),
+                self.evaluate_concurrently(second, "second"),
+            )
+        self.assertEqual([f"first-{i}" for i in range(30)], first_results)
+        self.assertEqual([f"second-{i}" for i in range(30)], second_results)
+        self.assertIsNone(first.cmd)
+        self.assertEqual(6, len(self.bridge.evaluators))
+
+    async def test_tcp_and_disconnect_cleanup(self):
+        server = await self.bridge.serve_tcp("127.0.0.1", 0)
+        self.addCleanup(server.close)
+        _, port = server.sockets[0].getsockname()
+        manager = self.new_manager(TcpTransport("127.0.0.1", port))
+        self.assertEqual(["tcp-0", "tcp-1", "tcp-2"], (await self.evaluate_concurrently(manager, "tcp"))[:3])
+        manager.close()
+        await asyncio.sleep(0.05)
+        self.assertEqual({}, self.bridge.evaluators)
+        self.assertEqual([], self.bridge.clients)
+
+    async def test_clients_cannot_use_other_clients_evaluators(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "pkl.sock")
+            server = await self.bridge.serve_unix(path)
+            self.addCleanup(server.close)
+            first = self.new_manager(UnixSocketTransport(path))
+            second = self.new_manager(UnixSocketTransport(path))
+            owned = await first.new_evaluator(EvaluatorOptions())
+            other = await second.new_evaluator(EvaluatorOptions())
+            other.evaluator_id = owned.evaluator_id
+            with self.assertRaisesRegex(Exception, "unknown evaluator id"):
+                await other.evaluate_expression(TextSource(""), "echo:x")
+            self.assertEqual("x", await owned.evaluate_expression(TextSource(""), "echo:x"))
+
+    async def test_stops_reading_pkl_while_a_client_is_not_reading(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "pkl.sock")
+            server = await self.bridge.serve_unix(path)
+            self.addCleanup(server.close)
+            reader, writer = await asyncio.open_unix_connection(path)
+            self.addCleanup(writer.close)
+            packer = msgpack.Packer()
+            writer.write(packer.pack([codes.NewEvaluator, {"requestId": 1}]))
+            unpacker = msgpack.Unpacker()
+            while True:
+                unpacker.feed(await reader.read(1024))
+                responses = list(unpacker)
+                if responses:
+                    break
+            evaluator_id = responses[0][1]["evaluatorId"]
+            text = "x" * 200 * 1024
+            for i in range(200):
+                request = {"requestId": i + 2, "evaluatorId": evaluator_id, "expr": "echo:" + text}
+                writer.write(packer.pack([codes.Evaluate, request]))
+            # 40MiB of responses are produced, but the client reads none of them
+            await asyncio.sleep(1)
+            (client,) = self.bridge.clients
+            self.assertLess(client.writer.transport.get_write_buffer_size(), 8 * 1024 * 1024)
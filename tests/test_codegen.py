@@ -0,0 +1,133 @@
+import dataclasses
+import sys
+import types
+import unittest
+
+import msgpack
+
+from pkl_python import codegen
+from pkl_python.evaluator.decoder import Decoder
+from pkl_python.evaluator.registry import Registry, default_registry
+from pkl_python.types.pkl import Duration, DurationUnit
+
+MODULE_URI = "file:///config/appConfig.pkl"
+
+
+def declared(name, *arguments, module_uri="pkl:base"):
+    return {"kind": "declared", "name": name, "moduleUri": module_uri, "arguments": list(arguments)}
+
+
+def prop(name, t):
+    return {"name": name, "type": t}
+
+
+SCHEMA = {
+    "moduleName": "appConfig",
+    "moduleUri": MODULE_URI,
+    "moduleClass": {
+        "name": "appConfig",
+        "qualifiedName": "appConfig",
+        "abstract": False,
+        "properties": [
+            prop("servers", declared("Listing", declared("Server", module_uri=MODULE_URI))),
+            prop("timeout", declared("Duration")),
+        ],
+    },
+    "classes": [
+        {
+            "name": "Server",
+            "qualifiedName": "appConfig#Server",
+            "abstract": False,
+            "properties": [
+                prop("host", declared("String")),
+                prop("port", {"kind": "nullable", "member": declared("Int")}),
+                prop("class", {"kind": "union", "members": [{"kind": "stringLiteral"}] * 2}),
+                prop("tags", declared("Mapping", declared("String"), declared("String"))),
+            ],
+        },
+        {"name": "Base", "qualifiedName": "appConfig#Base", "abstract": True, "properties": []},
+    ],
+}
+
+
+def server(host, port, tags, module_uri=MODULE_URI, extra=()):
+    members = [
+        [0x10, "host", host],
+        [0x10, "port", port],
+        [0x10, "class", "web"],
+        [0x10, "tags", [0x3, tags]],
+        *extra,
+    ]
+    return [0x1, "appConfig#Server", module_uri, members]
+
+
+class TestCodegen(unittest.TestCase):
+    def setUp(self):
+        source = codegen.generate(SCHEMA)
+        self.module = types.ModuleType("generated_app_config")
+        sys.modules[self.module.__name__] = self.module
+        exec(compile(source, "generated_app_config.py", "exec"), self.module.__dict__)
+        self.registry = Registry()
+        self.module.register_all(self.registry)
+
+    def tearDown(self):
+        del sys.modules[self.module.__name__]
+        for name in ("appConfig", "appConfig#Server"):
+            default_registry.unregister(MODULE_URI, name)
+
+    def decode(self, value):
+        return Decoder(self.registry).decode(memoryview(msgpack.packb(value)))
+
+    def test_generated_classes(self):
+        Server = self.module.Server
+        self.assertTrue(dataclasses.is_dataclass(Server))
+        self.assertTrue(hasattr(Server, "__slots__"))
+        self.assertEqual(
+            ["host", "port", "class_", "tags"], [field.name for field in dataclasses.fields(Server)]
+        )
+        self.assertEqual(
+            {"host": "str", "port": "Optional[int]", "class_": "str", "tags": "Dict[str, str]"},
+            Server.__annotations__,
+        )
+        self.assertTrue(hasattr(self.module, "Base"))
+        self.assertFalse(hasattr(self.module, "decode_base"))
+        self.assertIs(self.module.Server, default_registry.lookup(MODULE_URI, "appConfig#Server"))
+
+    def test_decode(self):
+        Server = self.module.Server
+        config = [
+            0x1,
+            "appConfig",
+            MODULE_URI,
+            [
+                [0x10, "servers", [0x5, [server("a", 80, {"env": "prod"}), server("b", None, {})]]],
+                [0x10, "timeout", [0x7, 1.5, "s"]],
+            ],
+        ]
+        self.assertEqual(
+            self.module.AppConfig(
+                [Server("a", 80, "web", {"env": "prod"}), Server("b", None, "web", {})],
+                Duration(1.5, DurationUnit.S),
+            ),
+            self.decode(config),
+        )
+        self.assertEqual([{"x": Server("a", 1, "web", {})}], self.decode([0x5, [[0x3, {"x": server("a", 1, {})}]]]))
+
+    def test_every_duration_unit(self):
+        for unit in ["ns", "us", "ms", "s", "min", "h", "d"]:
+            config = [0x1, "appConfig", MODULE_URI, [[0x10, "servers", [0x5, []]], [0x10, "timeout", [0x7, 2, unit]]]]
+            self.assertEqual(self.module.AppConfig([], Duration(2, DurationUnit(unit))), self.decode(config))
+
+    def test_schema_changes(self):
+        with self.assertRaisesRegex(ValueError, "regenerate"):
+            self.decode(server("a", 1, {}, extra=[[0x10, "weight", 2]]))
+        renamed = server("a", 1, {})
+        renamed[3][1][1] = "portNumber"
+        with self.assertRaisesRegex(ValueError, "appConfig#Server"):
+            self.decode(renamed)
+
+    def test_names(self):
+        self.assertEqual("AppConfig", codegen.class_name("com.example.appConfig"))
+        self.assertEqual("decode_app_config", codegen.function_name("AppConfig"))
+        self.assertEqual("import_", codegen.field_name("import"))
+        self.assertEqual("file:///tmp/x.pkl", codegen.module_uri("file:///tmp/x.pkl"))
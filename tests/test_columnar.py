@@ -0,0 +1,79 @@
+import unittest
+
+import msgpack
+
+from pkl_python.evaluator.columnar import decode_arrow, decode_numpy
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+def server(i):
+    return [
+        0x1,
+        "Server",
+        "file:///capacity.pkl",
+        [[0x10, "host", f"h{i}"], [0x10, "cores", i], [0x10, "load", i / 4], [0x10, "tags", [0x5, [i]]]],
+    ]
+
+
+SERVERS = msgpack.packb([0x5, [server(i) for i in range(4)]])
+
+
+@unittest.skipUnless(numpy, "numpy is not installed")
+class TestNumpy(unittest.TestCase):
+    def test_scalars(self):
+        floats = decode_numpy(msgpack.packb([0x5, [0.5, 1.0, -2.25]]))
+        self.assertEqual(numpy.float64, floats.dtype)
+        self.assertEqual([0.5, 1.0, -2.25], floats.tolist())
+        ints = decode_numpy(msgpack.packb([0x4, [1, 300, -70000, 2**40]]))
+        self.assertEqual(numpy.int64, ints.dtype)
+        self.assertEqual([1, 300, -70000, 2**40], ints.tolist())
+        for ints in [[0, 127, -32], [200, 255], [-100, -128], [1000, 65535], [-3000, 300], [2**32 - 1, 2**31], [-(2**40), 2**62]]:
+            decoded = decode_numpy(msgpack.packb([0x5, ints]))
+            self.assertEqual(numpy.int64, decoded.dtype)
+            self.assertEqual(ints, decoded.tolist())
+        self.assertEqual(numpy.bool_, decode_numpy(msgpack.packb([0x5, [True, False]])).dtype)
+        self.assertEqual(numpy.float64, decode_numpy(msgpack.packb([0x5, [1, 2.5]])).dtype)
+        self.assertEqual(object, decode_numpy(msgpack.packb([0x5, ["a", None]])).dtype)
+        self.assertEqual(0, len(decode_numpy(msgpack.packb([0x5, []]))))
+
+    def test_records(self):
+        columns = decode_numpy(SERVERS)
+        self.assertEqual(["host", "cores", "load", "tags"], list(columns))
+        self.assertEqual(numpy.int64, columns["cores"].dtype)
+        self.assertEqual([0.0, 0.25, 0.5, 0.75], columns["load"].tolist())
+        self.assertEqual(["h0", "h1", "h2", "h3"], columns["host"].tolist())
+        self.assertEqual([[0], [1], [2], [3]], columns["tags"].tolist())
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            decode_numpy(msgpack.packb([0x3, {"a": 1}]))
+        with self.assertRaises(ValueError):
+            decode_numpy(msgpack.packb([0x5, [1, [0x5, [2]]]]))
+        other = [0x1, "Other", "file:///capacity.pkl", [[0x10, "host", "x"]]]
+        with self.assertRaises(ValueError):
+            decode_numpy(msgpack.packb([0x5, [server(0), other]]))
+
+
+@unittest.skipUnless(pyarrow, "pyarrow is not installed")
+class TestArrow(unittest.TestCase):
+    def test_scalars(self):
+        array = decode_arrow(msgpack.packb([0x5, [1.5, 2.5]]))
+        self.assertEqual(pyarrow.float64(), array.type)
+        self.assertEqual([1.5, 2.5], array.to_pylist())
+        self.assertEqual([1, None], decode_arrow(msgpack.packb([0x5, [1, None]])).to_pylist())
+
+    def test_records(self):
+        batch = decode_arrow(SERVERS)
+        self.assertEqual(4, batch.num_rows)
+        self.assertEqual(["host", "cores", "load", "tags"], batch.schema.names)
+        self.assertEqual(pyarrow.int64(), batch.schema.field("cores").type)
+        self.assertEqual([[0], [1], [2], [3]], batch.column("tags").to_pylist())
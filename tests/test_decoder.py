@@ -0,0 +1,177 @@
+import unittest
+from dataclasses import dataclass, field
+from typing import List
+
+import msgpack
+
+from pkl_python.evaluator.decoder import Decoder
+from pkl_python.evaluator.registry import Registry
+from pkl_python.types.pkl import DataSize, DataSizeUnit, Duration, DurationUnit, IntSeq, Regex
+
+
+def dynamic(*members):
+    return [0x1, "Dynamic", "pkl:base", list(members)]
+
+
+class TestDecoder(unittest.TestCase):
+    def decode(self, value):
+        return Decoder().decode(memoryview(msgpack.packb(value)))
+
+    def test_primitives(self):
+        for value in [None, True, 1, -5, 2**40, 1.5, "hello"]:
+            self.assertEqual(value, self.decode(value))
+
+    def test_collections(self):
+        self.assertEqual([1, "a", None], self.decode([0x5, [1, "a", None]]))
+        self.assertEqual({1, 2}, self.decode([0x6, [1, 2]]))
+        self.assertEqual({"a": [1]}, self.decode([0x3, {"a": [0x4, [1]]}]))
+        self.assertEqual({1: "one"}, self.decode([0x2, {1: "one"}]))
+        self.assertEqual([], self.decode([0x5, []]))
+
+    def test_mixed_listings(self):
+        empty = {"properties": {}, "entries": {}, "elements": []}
+        self.assertEqual(
+            [[1, [2], empty, "x"], []],
+            self.decode([0x4, [[0x5, [1, [0x4, [2]], dynamic(), "x"]], [0x5, []]]]),
+        )
+
+    def test_lists_of_primitives_are_not_mistaken_for_objects(self):
+        self.assertEqual([[9, 1, 2], [7, 5, "s"]], self.decode([0x4, [[0x4, [9, 1, 2]], [0x4, [7, 5, "s"]]]]))
+
+    def test_scalars(self):
+        self.assertEqual(Duration(5, DurationUnit.S), self.decode([0x7, 5, "s"]))
+        self.assertEqual(DataSize(1.5, DataSizeUnit.MB), self.decode([0x8, 1.5, "mb"]))
+        self.assertEqual([1, [1, 2]], self.decode([0x9, 1, [0x5, [1, 2]]]))
+        self.assertEqual(IntSeq(0, 5, 1), self.decode([0xA, 0, 5, 1]))
+        self.assertEqual(Regex("a+"), self.decode([0xB, "a+"]))
+        self.assertEqual([{}, 1], self.decode([0x5, [[0xC], 1]]))
+
+    def test_objects(self):
+        person = [0x1, "person#Person", "file:///person.pkl", [[0x10, "name", "Bob"], [0x10, "pets", [0x5, ["cat"]]]]]
+        self.assertEqual({"name": "Bob", "pets": ["cat"]}, self.decode(person))
+        empty = {"properties": {}, "entries": {}, "elements": []}
+        self.assertEqual(
+            {"properties": {"x": 1}, "entries": {"k": "v"}, "elements": [empty]},
+            self.decode(dynamic([0x10, "x", 1], [0x11, "k", "v"], [0x12, 0, dynamic()])),
+        )
+
+    def test_every_duration_unit(self):
+        for unit in ["ns", "us", "ms", "s", "min", "h", "d"]:
+            expected = Duration(2, DurationUnit(unit))
+            self.assertEqual(expected, self.decode([0x7, 2, unit]))
+            self.assertEqual([expected], self.decode([0x5, [[0x7, 2, unit]]]))
+            properties = [[0x10, "t", [0x7, 2, unit]]]
+            self.assertEqual({"t": expected}, self.decode([0x1, "A", "file:///a.pkl", properties]))
+
+    def test_object_properties_holding_scalars(self):
+        limits = [
+            0x1,
+            "app#Limits",
+            "file:///app.pkl",
+            [[0x10, "timeout", [0x7, 30, "s"]], [0x10, "memory", [0x8, 512, "mib"]], [0x10, "pair", [0x9, 1, 2]]],
+        ]
+        self.assertEqual(
+            {"timeout": Duration(30, DurationUnit.S), "memory": DataSize(512, DataSizeUnit.MIB), "pair": [1, 2]},
+            self.decode(limits),
+        )
+        with self.assertRaises(ValueError):
+            self.decode([0x1, "app#Limits", "file:///app.pkl", [[0x10, "timeout", [0x7, 30, "fortnights"]]]])
+
+    def test_iter_elements(self):
+        decoder = Decoder()
+        data = msgpack.packb([0x5, [1, [0x4, [2]], dynamic()]])
+        elements = decoder.iter_elements(data)
+        self.assertEqual(1, next(elements))
+        # other decodes may run while the iterator is suspended
+        self.assertEqual([3], decoder.decode(msgpack.packb([0x4, [3]])))
+        self.assertEqual([[2], {"properties": {}, "entries": {}, "elements": []}], list(elements))
+        self.assertEqual([1], list(decoder.iter_elements(msgpack.packb([0x6, [1]]))))
+        with self.assertRaises(ValueError):
+            list(decoder.iter_elements(msgpack.packb([0x3, {}])))
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            self.decode({"a": 1})
+        with self.assertRaises(ValueError):
+            self.decode([0x1, "person#Person", "file:///person.pkl", [[0x11, "k", "v"]]])
+        with self.assertRaises(ValueError):
+            self.decode([0x42])
+
+
+@dataclass(slots=True)
+class Pet:
+    name: str
+
+
+@dataclass(slots=True)
+class Person:
+    name: str
+    pets: List[Pet] = field(default_factory=list)
+    age: int = 0
+    is_admin: bool = field(default=False, metadata={"pkl_name": "isAdmin"})
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+        self.registry.register("file:///person.pkl", "person#Person", Person)
+        self.registry.register("file:///person.pkl", "person#Pet")(Pet)
+
+    def decode(self, value):
+        return Decoder(self.registry).decode(msgpack.packb(value))
+
+    def test_registered_classes(self):
+        person = [
+            0x1,
+            "person#Person",
+            "file:///person.pkl",
+            [
+                [0x10, "name", "Bob"],
+                [0x10, "pets", [0x5, [[0x1, "person#Pet", "file:///person.pkl", [[0x10, "name", "Rex"]]]]]],
+                [0x10, "isAdmin", True],
+                [0x10, "unknown", [0x5, [1]]],
+            ],
+        ]
+        bob = self.decode(person)
+        self.assertEqual(Person("Bob", [Pet("Rex")], 0, True), bob)
+        self.assertFalse(hasattr(bob, "__dict__"))
+        self.assertEqual([Person("Amy")], self.decode([0x5, [[0x1, "person#Person", "file:///person.pkl", [[0x10, "name", "Amy"]]]]]))
+
+    def test_unregistered_classes(self):
+        pet = [0x1, "person#Pet", "file:///other.pkl", [[0x10, "name", "Rex"]]]
+        self.assertEqual({"name": "Rex"}, self.decode(pet))
+        self.registry.unregister("file:///person.pkl", "person#Pet")
+        self.assertEqual({"name": "Rex"}, self.decode([0x1, "person#Pet", "file:///person.pkl", [[0x10, "name", "Rex"]]]))
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            self.decode([0x1, "person#Person", "file:///person.pkl", [[0x10, "age", 3]]])
+        with self.assertRaises(ValueError):
+            self.registry.register("file:///person.pkl", "person#Plain", object)
+
+
+class TestDeepNesting(unittest.TestCase):
+    # msgpack.packb refuses to nest this deeply, so payloads are built as bytes
+    depth = 20_000
+
+    def test_deep_listings(self):
+        value = Decoder().decode(b"\x92\x05\x91" * self.depth + b"\x01")
+        for _ in range(self.depth):
+            (value,) = value
+        self.assertEqual(1, value)
+
+    def test_deep_listings_starting_with_primitives(self):
+        value = Decoder().decode(b"\x92\x05\x92\x00" * self.depth + b"\x01")
+        for _ in range(self.depth):
+            zero, value = value
+            self.assertEqual(0, zero)
+        self.assertEqual(1, value)
+
+    def test_deep_objects(self):
+        header = b"\x94\x01" + msgpack.packb("Dynamic") + msgpack.packb("pkl:base")
+        entry = b"\x91\x93\x11" + msgpack.packb("k")
+        mapping = b"\x92\x03\x81" + msgpack.packb("m")
+        value = Decoder().decode((header + entry + mapping) * self.depth + b"\x01")
+        for _ in range(self.depth):
+            value = value["entries"]["k"]["m"]
+        self.assertEqual(1, value)
@@ -0,0 +1,148 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from pkl_python.evaluator.disk_cache import DiskCache, file_dependencies, open_disk_cache
+from pkl_python.evaluator.evaluator_manager import EvaluatorManagerImpl
+from pkl_python.evaluator.evaluator_options import EvaluatorOptions
+from pkl_python.evaluator.module_source import FileSource, TextSource
+from pkl_python.evaluator.result_cache import cache_key
+from pkl_python.types import codes
+
+FAKE_PKL = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_pkl.py")]
+
+
+class TestFileDependencies(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, text):
+        with open(os.path.join(self.tmp.name, name), "w") as f:
+            f.write(text)
+        return FileSource(self.tmp.name, name).uri
+
+    def test_follows_local_imports_and_reads(self):
+        main = self.write("main.pkl", 'amends "base.pkl"\nimport "pkl:json"\ndata = read("data.txt")\n')
+        base = self.write("base.pkl", 'import "package://example.com/lib@1.0.0#/lib.pkl"\n')
+        data = self.write("data.txt", "hello")
+        dependencies = file_dependencies(main, None)
+        self.assertEqual(sorted([main, base, data]), [uri for _, uri, _ in dependencies])
+        self.assertTrue(all(hash is not None for _, _, hash in dependencies))
+        expression = self.write("expression.pkl", 'lib = import("base.pkl")\nread = 1\n')
+        self.assertEqual(sorted([expression, base]), [uri for _, uri, _ in file_dependencies(expression, None)])
+
+    def test_unknowable_dependencies(self):
+        for text in [
+            'import* "*.pkl"',
+            'x = read*("env:*")',
+            'x = read("file:" + name)',
+            'import "https://example.com/a.pkl"',
+            'import "@dep/a.pkl"',
+            'import #"lib.pkl"#',
+            'amends #"base.pkl"#',
+            'x = import(#"lib.pkl"#)',
+            'x = read(#"data.txt"#)',
+        ]:
+            self.assertIsNone(file_dependencies(self.write("main.pkl", text), None), text)
+        self.assertIsNone(file_dependencies("repl:text", 'import "a.pkl"'))
+        lib = self.write("lib.pkl", "")
+        self.assertEqual([lib], [uri for _, uri, _ in file_dependencies("repl:text", f'import "{lib}"')])
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = open_disk_cache(EvaluatorOptions(cache_dir=self.tmp.name))
+        self.addCleanup(self.cache.close)
+
+    def test_reuses_results_while_dependencies_are_unchanged(self):
+        key = cache_key("", TextSource("x"), "expr")
+        hashes = {("resource", "secret:a"): "1"}
+        reader_hash = lambda kind, uri: hashes.get((kind, uri))
+        self.cache.put(key, "0.25.3", memoryview(b"\xa1x"), [("resource", "secret:a", "1")])
+        self.assertEqual(b"\xa1x", self.cache.get(key, "0.25.3", reader_hash))
+        self.assertIsNone(self.cache.get(key, "0.26.0", reader_hash))
+        hashes[("resource", "secret:a")] = "2"
+        self.assertIsNone(self.cache.get(key, "0.25.3", reader_hash))
+        self.assertEqual((1, 2), (self.cache.hits, self.cache.misses))
+
+    def test_persists_across_instances(self):
+        key = cache_key("", TextSource("x"), "expr")
+        self.cache.put(key, "0.25.3", memoryview(b"\xa1x"), [])
+        other = DiskCache(self.cache.path)
+        self.addCleanup(other.close)
+        self.assertEqual(b"\xa1x", other.get(key, "0.25.3", None))
+        other.invalidate("repl:text")
+        self.assertIsNone(self.cache.get(key, "0.25.3", None))
+
+    def test_requires_cache_dir(self):
+        with self.assertRaises(ValueError):
+            open_disk_cache(EvaluatorOptions())
+
+
+class TestEvaluatorDiskCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(os.path.join(self.tmp.name, "cache", "results.sqlite3"))
+        self.managers = []
+        self.requests = 0
+
+    async def asyncTearDown(self):
+        for manager in self.managers:
+            manager.close()
+            await manager.cmd.wait()
+        self.cache.close()
+        self.tmp.cleanup()
+
+    async def new_evaluator(self, pkl_version=None):
+        manager = EvaluatorManagerImpl(FAKE_PKL)
+        manager.version = pkl_version
+        self.managers.append(manager)
+        request = manager.request
+
+        async def counting_request(code, *args):
+            self.requests += code == codes.Evaluate
+            return await request(code, *args)
+
+        manager.request = counting_request
+        evaluator = await manager.new_evaluator(EvaluatorOptions())
+        evaluator.disk_cache = self.cache
+        return evaluator
+
+    async def test_results_are_reused_until_an_import_changes(self):
+        lib = os.path.join(self.tmp.name, "lib.pkl")
+        with open(lib, "w") as f:
+            f.write("a = 1")
+        source = TextSource(f'import "{FileSource(lib).uri}"')
+        self.assertEqual("x", await (await self.new_evaluator()).evaluate_expression(source, "echo:x"))
+        self.assertEqual("x", await (await self.new_evaluator()).evaluate_expression(source, "echo:x"))
+        self.assertEqual(1, self.requests)
+        with open(lib, "w") as f:
+            f.write("a = 2")
+        self.assertEqual("x", await (await self.new_evaluator()).evaluate_expression(source, "echo:x"))
+        self.assertEqual(2, self.requests)
+        # nor are they reused by another version of Pkl
+        upgraded = await self.new_evaluator("0.99.0")
+        self.assertEqual("x", await upgraded.evaluate_expression(source, "echo:x"))
+        self.assertEqual(3, self.requests)
+
+    async def test_cache_is_used_off_the_event_loop(self):
+        threads = set()
+        get, put = self.cache.get, self.cache.put
+
+        def recording(method):
+            def call(*args):
+                threads.add(threading.get_ident())
+                return method(*args)
+
+            return call
+
+        self.cache.get, self.cache.put = recording(get), recording(put)
+        evaluator = await self.new_evaluator()
+        self.assertEqual("x", await evaluator.evaluate_expression(TextSource(""), "echo:x"))
+        self.assertTrue(threads)
+        self.assertNotIn(threading.get_ident(), threads)
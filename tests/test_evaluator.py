@@ -0,0 +1,406 @@
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from pkl_python.evaluator.evaluator_manager import EvaluatorManagerImpl
+from pkl_python.evaluator.evaluator_options import EvaluatorOptions
+from pkl_python.evaluator.module_source import TextSource
+from pkl_python.types.outgoing import CloseEvaluator, ResourceReader
+from pkl_python.types.project import ProjectDependencies, ProjectRemoteDependency
+
+FAKE_PKL = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_pkl.py")]
+
+
+class TestEvaluator(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.manager = EvaluatorManagerImpl(FAKE_PKL)
+
+    async def asyncTearDown(self):
+        self.manager.close()
+        if self.manager.cmd:
+            await self.manager.cmd.wait()
+
+    async def test_concurrent_evaluator_creation(self):
+        evaluators = await asyncio.gather(
+            *(self.manager.new_evaluator(EvaluatorOptions()) for _ in range(50))
+        )
+        self.assertEqual(50, len({ev.evaluator_id for ev in evaluators}))
+        self.assertEqual({}, self.manager.pending_requests)
+
+    async def test_thousands_of_evaluations_in_flight(self):
+        evaluators = [await self.manager.new_evaluator(EvaluatorOptions()) for _ in range(4)]
+        source = TextSource("")
+        results = await asyncio.gather(
+            *(evaluators[i % 4].evaluate_expression(source, f"echo:{i}") for i in range(5000))
+        )
+        self.assertEqual([str(i) for i in range(5000)], results)
+        self.assertEqual({}, self.manager.pending_requests)
+
+    async def test_errors_resolve_and_clean_up(self):
+        evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+        with self.assertRaisesRegex(Exception, "boom"):
+            await evaluator.evaluate_expression(TextSource(""), "fail:boom")
+        self.assertEqual({}, self.manager.pending_requests)
+
+    async def test_unknown_messages_are_dropped(self):
+        evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+        with self.assertLogs("pkl_python.evaluator", "WARNING") as logs:
+            self.assertEqual("x", await evaluator.evaluate_expression(TextSource(""), "noise:x"))
+        self.assertEqual(2, len(logs.records))
+        self.assertEqual(0, self.manager.restarts)
+
+    async def test_identical_evaluations_share_one_request(self):
+        evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+        request = self.manager.request
+        sent = []
+
+        def counting_request(code, msg, *args):
+            sent.append(msg.expr)
+            return request(code, msg, *args)
+
+        self.manager.request = counting_request
+        source = TextSource("")
+        results = await asyncio.gather(
+            *(evaluator.evaluate_expression(source, "json:{\"a\": [1]}") for _ in range(100)),
+            *(evaluator.evaluate_expression(source, "fail:boom") for _ in range(100)),
+            return_exceptions=True,
+        )
+        self.assertEqual(["json:{\"a\": [1]}", "fail:boom"], sent)
+        self.assertEqual(198, evaluator.coalesced)
+        self.assertTrue(all(result is results[0] for result in results[:100]))
+        self.assertTrue(all("boom" in str(result) for result in results[100:]))
+        self.assertEqual({}, evaluator.in_flight)
+        # once the first has finished, the same expression is evaluated again
+        with self.assertRaisesRegex(Exception, "boom"):
+            await evaluator.evaluate_expression(source, "fail:boom")
+        self.assertEqual(3, len(sent))
+
+    async def test_cancelling_the_first_of_identical_evaluations(self):
+        evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+        first = asyncio.create_task(evaluator.evaluate_expression(TextSource(""), "echo:x"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(evaluator.evaluate_expression(TextSource(""), "echo:x"))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual("x", await second)
+        self.assertTrue(first.cancelled())
+
+    async def test_stream_expression(self):
+        evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+        listing = [0x5, [i if i % 2 else [0x4, [i]] for i in range(2500)]]
+        source = TextSource("")
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        elements = []
+        async for element in evaluator.stream_expression(source, "json:" + json.dumps(listing), batch_size=100):
+            if not elements:
+                other = asyncio.create_task(ticker())
+                await asyncio.sleep(0)
+                start = ticks
+            elements.append(element)
+        # the stream gives the loop back every batch, so other tasks keep running meanwhile
+        self.assertGreaterEqual(ticks - start, 2500 // 100 - 1)
+        other.cancel()
+        self.assertEqual([i if i % 2 else [i] for i in range(2500)], elements)
+        with self.assertRaises(ValueError):
+            async for _ in evaluator.stream_expression(source, "echo:not a listing"):
+                pass
+
+    async def test_write_expression(self):
+        evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+        source = TextSource("")
+        text = "héllo " * 20000
+        buffer = bytearray()
+        self.assertEqual(len(text.encode()), await evaluator.write_expression(source, "echo:" + text, buffer))
+        self.assertEqual(text.encode(), bytes(buffer))
+
+        read_fd, write_fd = os.pipe()
+        with os.fdopen(read_fd, "rb") as r:
+            await evaluator.write_expression(source, "bytes:raw", write_fd)
+            os.close(write_fd)
+            self.assertEqual(b"raw", r.read())
+
+        reading, writing = socket.socketpair()
+        reader, reading_writer = await asyncio.open_connection(sock=reading)
+        _, writer = await asyncio.open_connection(sock=writing)
+        await evaluator.write_output_text(source, writer)
+        writer.close()
+        self.assertEqual(b"output.text", await reader.read())
+        reading_writer.close()
+
+    async def test_write_output_files(self):
+        evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+        files = {f"out/{i}.json": json.dumps({"i": i}) for i in range(20)}
+        with tempfile.TemporaryDirectory() as tmp:
+            written = await evaluator.write_output_files(TextSource(json.dumps(files)), tmp)
+            self.assertEqual(sorted(files), sorted(written))
+            self.assertEqual(files, await evaluator.evaluate_output_files(TextSource(json.dumps(files))))
+
+    async def test_new_project_evaluator(self):
+        def typed(name, module_uri, **properties):
+            return [0x1, name, module_uri, [[0x10, key, value] for key, value in properties.items()]]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            lib = typed("RemoteDependency", "pkl:Project", uri="package://example.com/lib@1.0.0", checksums=None)
+            project = typed(
+                "Project",
+                "pkl:Project",
+                projectFileUri=f"file://{tmp}/PklProject",
+                tests=[0x5, []],
+                dependencies=[0x3, {"lib": lib}],
+                evaluatorSettings=typed(
+                    "EvaluatorSettings",
+                    "pkl:EvaluatorSettings",
+                    env=[0x3, {"A": "1"}],
+                    allowedModules=[0x5, ["file:"]],
+                ),
+                package=None,
+            )
+            with open(os.path.join(tmp, "PklProject"), "w") as f:
+                json.dump(project, f)
+            reader = ResourceReader(scheme="secret", hasHierarchicalUris=False, isGlobbable=False)
+            evaluator = await self.manager.new_project_evaluator(
+                tmp, EvaluatorOptions(allowed_resources=["env:"], resource_readers=[reader])
+            )
+            dependencies = ProjectDependencies(
+                local_dependencies={},
+                remote_dependencies={"other": ProjectRemoteDependency("package://example.com/other@1.0.0", None)},
+            )
+            overridden = await self.manager.new_project_evaluator(
+                tmp, EvaluatorOptions(declared_project_dependencies=dependencies)
+            )
+        options = evaluator.options
+        self.assertEqual(tmp, options.project_dir)
+        self.assertEqual({"A": "1"}, options.env)
+        self.assertEqual(["file:"], options.allowed_modules)
+        self.assertEqual(["env:"], options.allowed_resources)
+        self.assertEqual([reader], options.resource_readers)
+        self.assertIsInstance(options.resource_readers[0], ResourceReader)
+        dependency = options.declared_project_dependencies.remote_dependencies["lib"]
+        self.assertEqual("package://example.com/lib@1.0.0", dependency.package_uri)
+        self.assertEqual("x", await evaluator.evaluate_expression(TextSource(""), "echo:x"))
+        self.assertIs(dependencies, overridden.options.declared_project_dependencies)
+
+    async def test_pending_requests_fail_when_pkl_exits(self):
+        self.manager.max_restarts = 0
+        evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+        pending = asyncio.create_task(evaluator.evaluate_expression(TextSource(""), "echo:x"))
+        with self.assertRaisesRegex(Exception, "Pkl process exited"):
+            await evaluator.evaluate_expression(TextSource(""), "exit")
+        with self.assertRaises(Exception):
+            await pending
+        self.assertEqual({}, self.manager.pending_requests)
+
+
+class TestSharedEvaluators(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.manager = EvaluatorManagerImpl(FAKE_PKL, evaluator_idle_timeout=0.05)
+        self.closed = []
+        send_nowait = self.manager.send_nowait
+
+        def recording_send_nowait(msg):
+            if isinstance(msg, CloseEvaluator):
+                self.closed.append(msg.evaluatorId)
+            send_nowait(msg)
+
+        self.manager.send_nowait = recording_send_nowait
+
+    async def asyncTearDown(self):
+        self.manager.close()
+        if self.manager.cmd:
+            await self.manager.cmd.wait()
+
+    async def test_equivalent_options_share_an_evaluator(self):
+        evaluators = await asyncio.gather(
+            *(self.manager.get_or_create_evaluator(EvaluatorOptions(env={"a": "1"})) for _ in range(10))
+        )
+        self.assertTrue(all(ev.evaluator is evaluators[0].evaluator for ev in evaluators))
+        other = await self.manager.get_or_create_evaluator(EvaluatorOptions(env={"a": "2"}))
+        self.assertIsNot(evaluators[0].evaluator, other.evaluator)
+        self.assertEqual(2, len(self.manager.evaluators))
+        self.assertEqual(10, evaluators[0].references)
+
+    async def test_closes_idle_evaluators(self):
+        first = await self.manager.get_or_create_evaluator(EvaluatorOptions())
+        second = await self.manager.get_or_create_evaluator(EvaluatorOptions())
+        first.close()
+        await asyncio.sleep(0.1)
+        self.assertEqual([], self.closed)
+        self.assertEqual("x", await second.evaluate_expression(TextSource(""), "echo:x"))
+        second.close()
+        # used again before the timeout, so it is kept
+        third = await self.manager.get_or_create_evaluator(EvaluatorOptions())
+        self.assertIs(first.evaluator, third.evaluator)
+        third.close()
+        await asyncio.sleep(0.1)
+        self.assertEqual([first.evaluator.evaluator_id], self.closed)
+        self.assertTrue(first.evaluator.closed)
+        self.assertEqual({}, self.manager.shared_evaluators)
+        fourth = await self.manager.get_or_create_evaluator(EvaluatorOptions())
+        self.assertIsNot(first.evaluator, fourth.evaluator)
+
+    async def test_closing_a_handle_twice_releases_it_once(self):
+        first = await self.manager.get_or_create_evaluator(EvaluatorOptions())
+        second = await self.manager.get_or_create_evaluator(EvaluatorOptions())
+        first.close()
+        first.close()
+        self.assertTrue(first.closed)
+        self.assertFalse(second.closed)
+        with self.assertRaisesRegex(Exception, "evaluator is closed"):
+            await first.evaluate_expression(TextSource(""), "echo:x")
+        await asyncio.sleep(0.1)
+        self.assertEqual([], self.closed)
+        self.assertEqual("x", await second.evaluate_expression(TextSource(""), "echo:x"))
+
+
+class TestSupervisor(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.manager = EvaluatorManagerImpl(FAKE_PKL, restart_delay=0.01)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    async def asyncTearDown(self):
+        self.manager.close()
+        await self.manager.cmd.wait()
+        self.tmp.cleanup()
+
+    async def test_restarts_pkl_and_replays_in_flight_requests(self):
+        evaluator = await self.manager.new_evaluator(EvaluatorOptions(allowed_modules=["repl:"]))
+        other = await self.manager.new_evaluator(EvaluatorOptions())
+        pid = self.manager.cmd.pid
+        marker = os.path.join(self.tmp.name, "crashed")
+        results = await asyncio.gather(
+            evaluator.evaluate_expression(TextSource(""), f"exit-once:{marker}"),
+            other.evaluate_expression(TextSource(""), "echo:in flight"),
+        )
+        self.assertEqual(["restarted", "in flight"], results)
+        self.assertNotEqual(pid, self.manager.cmd.pid)
+        self.assertEqual(1, self.manager.restarts)
+        self.assertEqual(["repl:"], evaluator.options.allowed_modules)
+        self.assertEqual({evaluator.evaluator_id, other.evaluator_id}, set(self.manager.evaluators))
+        self.assertEqual("after", await other.evaluate_expression(TextSource(""), "echo:after"))
+
+    async def test_gives_up_on_requests_that_keep_crashing_pkl(self):
+        evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+        with self.assertRaisesRegex(Exception, "Pkl process exited"):
+            await evaluator.evaluate_expression(TextSource(""), "exit")
+        self.assertEqual("ok", await evaluator.evaluate_expression(TextSource(""), "echo:ok"))
+        self.assertEqual({}, self.manager.pending_requests)
+
+
+class TestRecycling(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        self.manager.close()
+        await self.manager.cmd.wait()
+
+    async def test_renews_evaluators_after_max_evaluations(self):
+        self.manager = EvaluatorManagerImpl(FAKE_PKL, max_evaluator_evaluations=3)
+        closed = []
+        send_nowait = self.manager.send_nowait
+
+        def recording_send_nowait(msg):
+            if isinstance(msg, CloseEvaluator):
+                closed.append(msg.evaluatorId)
+            send_nowait(msg)
+
+        self.manager.send_nowait = recording_send_nowait
+        evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+        old_id = evaluator.evaluator_id
+        results = await asyncio.gather(
+            *(evaluator.evaluate_expression(TextSource(""), f"echo:{i}") for i in range(10))
+        )
+        self.assertEqual([str(i) for i in range(10)], results)
+        await evaluator.renew_task
+        self.assertNotEqual(old_id, evaluator.evaluator_id)
+        self.assertEqual([old_id], closed)
+        self.assertEqual({evaluator.evaluator_id: evaluator}, self.manager.evaluators)
+        self.assertEqual("x", await evaluator.evaluate_expression(TextSource(""), "echo:x"))
+
+    async def test_replaces_pkl_once_it_uses_too_much_memory(self):
+        self.manager = EvaluatorManagerImpl(FAKE_PKL, max_rss_bytes=1, rss_check_interval=0)
+        evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+        pid = self.manager.cmd.pid
+        first = await evaluator.evaluate_expression(TextSource(""), "echo:first")
+        recycle_task = self.manager.recycle_task
+        self.assertIsNotNone(recycle_task)
+        self.manager.max_rss_bytes = None
+        # sent while the old process drains, so held back for the new one
+        during = await evaluator.evaluate_expression(TextSource(""), "echo:during")
+        self.assertEqual(["first", "during"], [first, during])
+        await recycle_task
+        self.assertNotEqual(pid, self.manager.cmd.pid)
+        self.assertEqual(1, self.manager.recycles)
+        self.assertEqual(0, self.manager.restarts)
+        self.assertEqual({}, self.manager.pending_requests)
+
+    async def test_answers_reads_of_the_draining_process(self):
+        self.manager = EvaluatorManagerImpl(FAKE_PKL, max_rss_bytes=1, rss_check_interval=0)
+        evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+        pid = self.manager.cmd.pid
+        # the read is asked for after the first evaluation has started the drain
+        results = await asyncio.wait_for(
+            asyncio.gather(
+                evaluator.evaluate_expression(TextSource(""), "echo:first"),
+                evaluator.evaluate_expression(TextSource(""), "read:env:X"),
+            ),
+            10,
+        )
+        self.assertEqual("first", results[0])
+        self.assertIn("No resource reader found for uri env:X", results[1])
+        self.manager.max_rss_bytes = None
+        if self.manager.recycle_task is not None:
+            await self.manager.recycle_task
+        self.assertNotEqual(pid, self.manager.cmd.pid)
+        self.assertFalse(self.manager.draining)
+        self.assertEqual("after", await evaluator.evaluate_expression(TextSource(""), "echo:after"))
+
+
+class TestStartup(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        os.environ["PKL_PYTHON_CACHE_DIR"] = self.cache_dir.name
+
+    async def asyncTearDown(self):
+        del os.environ["PKL_PYTHON_CACHE_DIR"]
+        self.cache_dir.cleanup()
+
+    async def test_version_is_cached_on_disk(self):
+        self.assertEqual("0.25.3", await EvaluatorManagerImpl(FAKE_PKL).get_version())
+        with mock.patch("asyncio.create_subprocess_exec", side_effect=AssertionError):
+            manager = EvaluatorManagerImpl(FAKE_PKL)
+            self.assertEqual("0.25.3", await manager.get_version())
+            self.assertTrue(await manager.has_feature("server"))
+            self.assertFalse(await manager.has_feature("external_readers"))
+
+    async def test_warm_up_starts_with_pkl(self):
+        # the manager can be created outside of an event loop
+        manager = await asyncio.to_thread(EvaluatorManagerImpl, FAKE_PKL, warm_up=True, warm_up_iterations=3)
+        self.assertIsNone(manager.warm_up_task)
+        await manager.start()
+        await manager.warm_up_task
+        self.assertIsNone(manager.cmd.returncode)
+        self.assertEqual({}, manager.evaluators)
+        self.assertEqual("0.25.3", manager.version)
+        manager.close()
+        await manager.cmd.wait()
+
+    async def test_warm_up_failures_are_logged(self):
+        manager = EvaluatorManagerImpl(FAKE_PKL, warm_up=True)
+        with mock.patch.object(manager, "get_version", side_effect=Exception("no version")):
+            with self.assertLogs("pkl_python.evaluator", "WARNING") as logs:
+                await manager.start()
+                await asyncio.wait([manager.warm_up_task])
+                await asyncio.sleep(0)
+        self.assertIn("no version", logs.output[0])
+        manager.close()
+        await manager.cmd.wait()
@@ -1,8 +1,18 @@
+import asyncio
+import io
 import unittest
 import json
-from pkl_python.evaluator.evaluator_manager import create_evaluator_request, pack_message
+from pkl_python.evaluator.evaluator_manager import (
+    EvaluatorManagerImpl,
+    create_evaluator_request,
+    next_read_size,
+    pack_message,
+)
 import msgpack
-from pkl_python.types.codes import NewEvaluator
+from pkl_python.types import codes
+from pkl_python.types.codes import EvaluateResponse, NewEvaluator
+from pkl_python.types.incoming import decode
+from pkl_python.types.outgoing import Evaluate, ListResourcesResponse, PathElement
 from pkl_python.evaluator.evaluator_options import EvaluatorOptions
 from pkl_python.types.outgoing import ModuleReader
 
@@ -11,13 +21,13 @@ class TestEvaluatorManager(unittest.TestCase):
         self.maxDiff = None
 
     def test_create_evaluator_request(self):
-        _, req = create_evaluator_request(EvaluatorOptions(
+        req = create_evaluator_request(EvaluatorOptions(
             allowed_modules=["pkl:", "repl:", "file:", "customfs:"],
             module_readers=[
                 ModuleReader(scheme="customfs", hasHierarchicalUris=True, isGlobbable=True, isLocal=True)
             ]
-        ))
-        msg = pack_message(msgpack.Packer(), NewEvaluator, req.model_dump(exclude_none=True))   
+        ), 135)
+        msg = pack_message(msgpack.Packer(), NewEvaluator, req.to_dict())
         expected_code = 0x20
         expected_msg = {   "requestId": 135,
                         "allowedModules": ["pkl:", "repl:", "file:", "customfs:"],
@@ -32,4 +42,129 @@ class TestEvaluatorManager(unittest.TestCase):
                     }
         actual_code, actual_msg = msgpack.unpackb(msg)
         self.assertEqual(expected_code, actual_code)
-        self.assertDictEqual(expected_msg, actual_msg)
\ No newline at end of file
+        self.assertDictEqual(expected_msg, actual_msg)
+
+class TestMessages(unittest.TestCase):
+    def test_decode(self):
+        response = decode((EvaluateResponse, {"evaluatorId": 1, "requestId": 2, "result": b"\xa1x", "new": 1}))
+        self.assertEqual((1, 2, None), (response.evaluatorId, response.requestId, response.error))
+        self.assertIsInstance(response.result, memoryview)
+        log = decode((codes.EvaluateLog, {"evaluatorId": 1, "level": 0, "message": "hi"}))
+        self.assertEqual(("hi", None), (log.message, log.frameUri))
+        read = decode((codes.EvaluateRead, {"evaluatorId": 1, "requestId": 3, "uri": "env:HOME"}))
+        self.assertEqual("env:HOME", read.uri)
+        self.assertFalse(hasattr(read, "__dict__"))
+        with self.assertRaisesRegex(ValueError, "Unknown code"):
+            decode((0x7F, {}))
+
+    def test_to_dict(self):
+        self.assertEqual(
+            {"requestId": 1, "evaluatorId": 2, "moduleUri": "repl:text", "expr": "x"},
+            Evaluate(requestId=1, evaluatorId=2, moduleUri="repl:text", expr="x").to_dict(),
+        )
+        response = ListResourcesResponse(requestId=1, evaluatorId=2)
+        response.pathElements = [PathElement(name="a", isDirectory=False)]
+        self.assertEqual(
+            {"requestId": 1, "evaluatorId": 2, "pathElements": [{"name": "a", "isDirectory": False}]},
+            response.to_dict(),
+        )
+
+
+class RecordingEvaluatorManager(EvaluatorManagerImpl):
+    def __init__(self):
+        super().__init__()
+        self.received = []
+
+    def handle_decode(self, item):
+        self.received.append(decode(item))
+
+
+class TestReadMessages(unittest.IsolatedAsyncioTestCase):
+    async def test_reads_all_buffered_messages(self):
+        manager = RecordingEvaluatorManager()
+        stream = asyncio.StreamReader()
+        packer = msgpack.Packer()
+        stream.feed_data(
+            b"".join(
+                pack_message(packer, EvaluateResponse, {"evaluatorId": 1, "requestId": i, "result": b"\xa1x"})
+                for i in range(50)
+            )
+        )
+        stream.feed_eof()
+        await manager.read_messages(stream)
+        self.assertEqual(list(range(50)), [msg.requestId for msg in manager.received])
+
+    async def test_reassembles_large_result(self):
+        manager = RecordingEvaluatorManager()
+        stream = asyncio.StreamReader()
+        result = bytes(range(256)) * 20_000
+        msg = pack_message(msgpack.Packer(), EvaluateResponse, {"evaluatorId": 1, "requestId": 7, "result": result})
+        for i in range(0, len(msg), 1000):
+            stream.feed_data(msg[i : i + 1000])
+        stream.feed_eof()
+        await manager.read_messages(stream)
+        (response,) = manager.received
+        self.assertIsInstance(response.result, memoryview)
+        self.assertEqual(result, response.result)
+
+    def test_next_read_size(self):
+        self.assertEqual(128, next_read_size(64, 64, 64, 256))
+        self.assertEqual(256, next_read_size(256, 256, 64, 256))
+        self.assertEqual(128, next_read_size(256, 10, 64, 256))
+        self.assertEqual(256, next_read_size(256, 100, 64, 256))
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.writes = []
+        self.drained = asyncio.Event()
+        self.drained.set()
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+    async def drain(self):
+        await self.drained.wait()
+
+
+class TestSend(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.writer = RecordingWriter()
+
+    def start_flusher(self, manager):
+        manager.flusher = asyncio.create_task(manager.flush_messages(self.writer))
+        self.addCleanup(manager.flusher.cancel)
+
+    def evaluate(self, request_id):
+        return Evaluate(requestId=request_id, evaluatorId=1, moduleUri="repl:text")
+
+    async def test_coalesces_concurrent_sends(self):
+        manager = EvaluatorManagerImpl()
+        self.start_flusher(manager)
+        await asyncio.gather(*(manager.send(codes.Evaluate, self.evaluate(i)) for i in range(1000)))
+        await asyncio.sleep(0.01)
+        self.assertEqual(1, len(self.writer.writes))
+        messages = list(msgpack.Unpacker(io.BytesIO(self.writer.writes[0])))
+        self.assertEqual(list(range(1000)), [msg["requestId"] for _, msg in messages])
+
+    async def test_flushes_once_flush_bytes_are_buffered(self):
+        manager = EvaluatorManagerImpl(flush_interval=60, flush_bytes=1)
+        self.start_flusher(manager)
+        await manager.send(codes.Evaluate, self.evaluate(1))
+        await asyncio.sleep(0.01)
+        self.assertEqual(1, len(self.writer.writes))
+
+    async def test_blocks_senders_while_pipe_is_full(self):
+        manager = EvaluatorManagerImpl(max_pending_bytes=1)
+        self.start_flusher(manager)
+        self.writer.drained.clear()
+        await manager.send(codes.Evaluate, self.evaluate(1))
+        await asyncio.sleep(0.01)
+        await manager.send(codes.Evaluate, self.evaluate(2))
+        blocked = asyncio.create_task(manager.send(codes.Evaluate, self.evaluate(3)))
+        await asyncio.sleep(0.01)
+        self.assertFalse(blocked.done())
+        self.writer.drained.set()
+        await blocked
+        await asyncio.sleep(0.01)
+        self.assertEqual(3, len(self.writer.writes))
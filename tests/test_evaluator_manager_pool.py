@@ -0,0 +1,39 @@
+import asyncio
+import os
+import sys
+import unittest
+
+from pkl_python.evaluator.evaluator_manager_pool import EvaluatorManagerPool
+from pkl_python.evaluator.evaluator_options import EvaluatorOptions
+
+FAKE_PKL = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_pkl.py")]
+
+
+class TestEvaluatorManagerPool(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.pool = EvaluatorManagerPool(2, FAKE_PKL)
+
+    async def asyncTearDown(self):
+        self.pool.close()
+
+    async def test_spreads_evaluators_over_children(self):
+        for _ in range(4):
+            await self.pool.new_evaluator(EvaluatorOptions())
+        self.assertEqual([2, 2], self.pool.evaluator_counts())
+        self.assertEqual([0, 0], self.pool.in_flight_counts())
+        self.assertNotEqual(self.pool.managers[0].cmd.pid, self.pool.managers[1].cmd.pid)
+
+    async def test_spreads_concurrent_evaluators_over_children(self):
+        self.pool.close()
+        self.pool = EvaluatorManagerPool(4, FAKE_PKL)
+        await asyncio.gather(*(self.pool.new_evaluator(EvaluatorOptions()) for _ in range(8)))
+        self.assertEqual([2, 2, 2, 2], self.pool.evaluator_counts())
+        self.assertEqual([0, 0, 0, 0], self.pool.placing)
+
+    async def test_prefers_child_with_fewest_in_flight_requests(self):
+        await self.pool.new_evaluator(EvaluatorOptions())
+        await self.pool.new_evaluator(EvaluatorOptions())
+        self.pool.managers[0].pending_requests[1] = asyncio.Future()
+        self.assertEqual([1, 0], self.pool.in_flight_counts())
+        evaluator = await self.pool.new_evaluator(EvaluatorOptions())
+        self.assertIs(self.pool.managers[1], evaluator.manager)
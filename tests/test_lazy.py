@@ -0,0 +1,83 @@
+import json
+import os
+import sys
+import unittest
+
+import msgpack
+
+from pkl_python.evaluator.decoder import Decoder
+from pkl_python.evaluator.evaluator_options import EvaluatorOptions
+from pkl_python.evaluator.lazy import LazyDynamic, LazyMapping, LazySequence, decode_lazy
+from pkl_python.evaluator.module_source import TextSource
+from pkl_python.evaluator.sync_evaluator_manager import SyncEvaluatorManager
+
+FAKE_PKL = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_pkl.py")]
+
+
+def typed(class_name, **properties):
+    return [0x1, class_name, "file:///app.pkl", [[0x10, key, value] for key, value in properties.items()]]
+
+
+CONFIG = typed(
+    "Config",
+    name="app",
+    servers=[0x5, [typed("Server", host=f"h{i}", port=i) for i in range(3)]],
+    limits=[0x3, {"cpu": 2, "memory": [0x8, 1.5, "gib"]}],
+    extra=[
+        0x1,
+        "Dynamic",
+        "pkl:base",
+        [[0x10, "x", 1], [0x11, "k", [0x4, [1, 2]]], [0x12, 0, "first"], [0x12, 1, "second"]],
+    ],
+    # never read by the tests below; decoding it would fail
+    broken=[0x42],
+)
+
+
+class TestLazy(unittest.TestCase):
+    def setUp(self):
+        self.view = decode_lazy(msgpack.packb(CONFIG))
+
+    def test_views(self):
+        self.assertIsInstance(self.view, LazyMapping)
+        self.assertEqual("app", self.view["name"])
+        self.assertEqual(["name", "servers", "limits", "extra", "broken"], list(self.view))
+        servers = self.view["servers"]
+        self.assertIsInstance(servers, LazySequence)
+        self.assertEqual(3, len(servers))
+        self.assertEqual("h2", servers[-1]["host"])
+        self.assertEqual([0, 1], [server["port"] for server in servers[:2]])
+        self.assertIs(servers[0], servers[0])
+        with self.assertRaises(IndexError):
+            servers[3]
+        self.assertEqual(2, self.view["limits"]["cpu"])
+        self.assertEqual(1.5, self.view["limits"]["memory"].value)
+
+    def test_dynamic(self):
+        extra = self.view["extra"]
+        self.assertIsInstance(extra, LazyDynamic)
+        self.assertEqual({"x": 1}, extra["properties"])
+        self.assertEqual([1, 2], extra.entries["k"])
+        self.assertEqual(["first", "second"], extra.elements)
+
+    def test_materialize(self):
+        expected = Decoder().decode(msgpack.packb(CONFIG[3][1][2]))
+        self.assertEqual(expected, self.view["servers"].materialize())
+        self.assertEqual(expected, self.view["servers"])
+        extra = self.view["extra"]
+        self.assertEqual(Decoder().decode(msgpack.packb(CONFIG[3][3][2])), extra.materialize())
+
+    def test_untouched_members_are_not_decoded(self):
+        with self.assertRaises(ValueError):
+            self.view["broken"]
+        with self.assertRaises(ValueError):
+            self.view.materialize()
+
+
+class TestLazyEvaluation(unittest.TestCase):
+    def test_evaluate_expression_lazy(self):
+        manager = SyncEvaluatorManager(FAKE_PKL)
+        self.addCleanup(manager.close)
+        evaluator = manager.new_evaluator(EvaluatorOptions())
+        view = evaluator.evaluate_expression(TextSource(""), "json:" + json.dumps(CONFIG), lazy=True)
+        self.assertEqual("h1", view["servers"][1]["host"])
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+import msgpack
+
+from pkl_python.evaluator.output import output_payload, write_files, write_payload
+
+
+class TestOutput(unittest.TestCase):
+    def test_output_payload(self):
+        for size in [0, 31, 32, 255, 256, 65535, 65536]:
+            text = "x" * size
+            self.assertEqual(text.encode(), bytes(output_payload(msgpack.packb(text))))
+            self.assertEqual(text.encode(), bytes(output_payload(msgpack.packb(text.encode()))))
+        self.assertEqual(b"\x00\xff", bytes(output_payload(msgpack.packb([0xF, b"\x00\xff"]))))
+        with self.assertRaises(ValueError):
+            output_payload(msgpack.packb(1))
+
+    def test_payload_is_not_copied(self):
+        data = memoryview(msgpack.packb("hello"))
+        self.assertIs(data.obj, output_payload(data).obj)
+
+    def test_write_payload_retries_partial_writes(self):
+        class Trickle:
+            def __init__(self):
+                self.data = b""
+
+            def write(self, chunk):
+                self.data += bytes(chunk[:2])
+                return min(2, len(chunk))
+
+        sink = Trickle()
+        self.assertEqual(5, write_payload(memoryview(b"hello"), sink))
+        self.assertEqual(b"hello", sink.data)
+
+
+class TestWriteFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, files):
+        return write_files(memoryview(msgpack.packb([0x3, files])), self.tmp.name, max_workers=4)
+
+    def read(self, path):
+        with open(os.path.join(self.tmp.name, path), encoding="utf-8") as f:
+            return f.read()
+
+    def test_writes_files(self):
+        files = {f"dir{i % 3}/file{i}.yaml": f"n: {i}\nname: ä{i}\n" for i in range(50)}
+        self.assertEqual(sorted(files), sorted(self.write(files)))
+        for path, text in files.items():
+            self.assertEqual(text, self.read(path))
+        self.assertEqual([], [name for name in os.listdir(os.path.join(self.tmp.name, "dir0")) if name.endswith(".tmp")])
+
+    def test_skips_unchanged_files(self):
+        self.write({"a.txt": "one", "b.txt": "two"})
+        mtime = os.stat(os.path.join(self.tmp.name, "a.txt")).st_mtime_ns
+        self.assertEqual(["b.txt"], self.write({"a.txt": "one", "b.txt": "TWO"}))
+        self.assertEqual(mtime, os.stat(os.path.join(self.tmp.name, "a.txt")).st_mtime_ns)
+        self.assertEqual("TWO", self.read("b.txt"))
+
+    def test_rejects_paths_outside_of_dest_dir(self):
+        with self.assertRaisesRegex(ValueError, "outside"):
+            self.write({"../escape.txt": "x"})
+        with self.assertRaisesRegex(ValueError, "outside"):
+            self.write({"/etc/escape.txt": "x"})
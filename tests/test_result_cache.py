@@ -0,0 +1,102 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from pkl_python.evaluator.evaluator_manager import EvaluatorManagerImpl
+from pkl_python.evaluator.evaluator_options import EvaluatorOptions, options_fingerprint
+from pkl_python.evaluator.module_source import FileSource, TextSource
+from pkl_python.evaluator.result_cache import ResultCache, cache_key
+
+FAKE_PKL = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_pkl.py")]
+
+
+class TestResultCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = ResultCache(max_entries=2)
+        for expr in ["a", "b", "c"]:
+            cache.put(cache_key("", TextSource(""), expr), memoryview(b"\xa1x"))
+        self.assertIsNone(cache.get(cache_key("", TextSource(""), "a")))
+        self.assertIsNotNone(cache.get(cache_key("", TextSource(""), "b")))
+        self.assertEqual((1, 1, 1), (cache.hits, cache.misses, cache.evictions))
+
+    def test_byte_bound(self):
+        cache = ResultCache(max_bytes=10)
+        cache.put(cache_key("", TextSource(""), "a"), memoryview(b"x" * 6))
+        cache.put(cache_key("", TextSource(""), "b"), memoryview(b"x" * 6))
+        self.assertEqual(1, len(cache.entries))
+        self.assertEqual(6, cache.size)
+
+    def test_ttl(self):
+        cache = ResultCache(ttl=60)
+        key = cache_key("", TextSource(""), "a")
+        cache.put(key, memoryview(b"\xa1x"))
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get(key))
+        self.assertEqual(0, cache.size)
+
+    def test_invalidate(self):
+        cache = ResultCache()
+        cache.put(cache_key("", TextSource("a"), "x"), memoryview(b"\xa1x"))
+        cache.put(cache_key("", FileSource("/tmp/b.pkl"), "x"), memoryview(b"\xa1x"))
+        cache.invalidate(FileSource("/tmp/b.pkl").uri)
+        self.assertEqual(1, len(cache.entries))
+        cache.clear()
+        self.assertEqual((0, 0), (len(cache.entries), cache.size))
+
+    def test_options_fingerprint(self):
+        self.assertEqual(
+            options_fingerprint(EvaluatorOptions(allowed_modules=["pkl:"])),
+            options_fingerprint(EvaluatorOptions(allowed_modules=["pkl:"])),
+        )
+        self.assertNotEqual(
+            options_fingerprint(EvaluatorOptions(allowed_modules=["pkl:"])),
+            options_fingerprint(EvaluatorOptions(allowed_modules=["file:"])),
+        )
+
+
+class TestEvaluatorResultCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.manager = EvaluatorManagerImpl(FAKE_PKL)
+        self.evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+        self.evaluator.result_cache = ResultCache()
+        self.requests = 0
+        request = self.manager.request
+
+        async def counting_request(*args):
+            self.requests += 1
+            return await request(*args)
+
+        self.manager.request = counting_request
+
+    async def asyncTearDown(self):
+        self.manager.close()
+        await self.manager.cmd.wait()
+
+    async def test_repeated_evaluations_are_cached(self):
+        source = TextSource("a = 1")
+        first = await self.evaluator.evaluate_expression(source, "json:[5, [1, 2]]")
+        self.assertIs(first, await self.evaluator.evaluate_expression(source, "json:[5, [1, 2]]"))
+        self.assertEqual("x", await self.evaluator.evaluate_expression(source, "echo:x"))
+        self.assertEqual("x", await self.evaluator.evaluate_expression(TextSource("a = 2"), "echo:x"))
+        self.assertEqual(3, self.requests)
+        self.assertEqual(1, self.evaluator.result_cache.hits)
+
+    async def test_errors_are_not_cached(self):
+        for _ in range(2):
+            with self.assertRaisesRegex(Exception, "boom"):
+                await self.evaluator.evaluate_expression(TextSource(""), "fail:boom")
+        self.assertEqual(2, self.requests)
+
+    async def test_file_sources_are_invalidated_when_modified(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".pkl") as f:
+            source = FileSource(f.name)
+            await self.evaluator.evaluate_expression(source, "echo:x")
+            await self.evaluator.evaluate_expression(source, "echo:x")
+            self.assertEqual(1, self.requests)
+            stat = os.stat(f.name)
+            os.utime(f.name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+            await self.evaluator.evaluate_expression(source, "echo:x")
+            self.assertEqual(2, self.requests)
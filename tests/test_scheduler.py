@@ -0,0 +1,70 @@
+import asyncio
+import os
+import sys
+import unittest
+
+from pkl_python.evaluator.evaluator_manager import EvaluatorManagerImpl
+from pkl_python.evaluator.evaluator_options import EvaluatorOptions
+from pkl_python.evaluator.module_source import TextSource
+from pkl_python.evaluator.scheduler import Priority, Scheduler
+
+FAKE_PKL = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_pkl.py")]
+
+
+class TestScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_admits_interactive_before_batch(self):
+        scheduler = Scheduler(max_in_flight=1)
+        await scheduler.acquire(Priority.BATCH)
+        admitted = []
+
+        async def run(name, priority):
+            await scheduler.acquire(priority)
+            admitted.append(name)
+
+        tasks = [
+            asyncio.create_task(run("batch-1", Priority.BATCH)),
+            asyncio.create_task(run("batch-2", Priority.BATCH)),
+            asyncio.create_task(run("interactive", Priority.INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+        self.assertEqual([], admitted)
+        self.assertEqual(2, scheduler.stats[Priority.BATCH].queued)
+        for _ in tasks:
+            scheduler.release()
+            await asyncio.sleep(0)
+        self.assertEqual(["interactive", "batch-1", "batch-2"], admitted)
+        self.assertEqual(1, scheduler.in_flight)
+        self.assertEqual(3, scheduler.stats[Priority.BATCH].admitted)
+        self.assertGreater(scheduler.stats[Priority.BATCH].max_wait, 0)
+
+    async def test_cancelled_waiters_give_up_their_turn(self):
+        scheduler = Scheduler(max_in_flight=1)
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        scheduler.release()
+        self.assertEqual(0, scheduler.in_flight)
+        self.assertEqual(0, scheduler.stats[Priority.INTERACTIVE].queued)
+
+    async def test_bounds_evaluations_in_flight(self):
+        manager = EvaluatorManagerImpl(FAKE_PKL, max_in_flight=8)
+        evaluator = await manager.new_evaluator(EvaluatorOptions())
+        peak = 0
+        send = manager.send_request
+
+        async def send_request(code, msg):
+            nonlocal peak
+            peak = max(peak, manager.scheduler.in_flight)
+            return await send(code, msg)
+
+        manager.send_request = send_request
+        results = await asyncio.gather(
+            *(evaluator.evaluate_expression(TextSource(""), f"echo:{i}", Priority(i % 2)) for i in range(200))
+        )
+        manager.close()
+        await manager.cmd.wait()
+        self.assertEqual([str(i) for i in range(200)], results)
+        self.assertEqual(8, peak)
+        self.assertEqual(100, manager.scheduler.stats[Priority.BATCH].admitted)
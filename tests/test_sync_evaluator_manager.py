@@ -0,0 +1,64 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from pkl_python.evaluator.evaluator_options import EvaluatorOptions
+from pkl_python.evaluator.module_source import TextSource
+from pkl_python.evaluator.sync_evaluator_manager import SyncEvaluatorManager
+
+FAKE_PKL = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_pkl.py")]
+
+
+class TestSyncEvaluatorManager(unittest.TestCase):
+    def setUp(self):
+        self.manager = SyncEvaluatorManager(FAKE_PKL)
+        self.addCleanup(self.manager.close)
+
+    def test_reuses_pkl_process_across_calls(self):
+        evaluator = self.manager.new_evaluator(EvaluatorOptions())
+        self.assertEqual("a", evaluator.evaluate_expression(TextSource(""), "echo:a"))
+        pid = self.manager.manager.cmd.pid
+        other = self.manager.new_evaluator(EvaluatorOptions())
+        self.assertEqual("b", other.evaluate_expression(TextSource(""), "echo:b"))
+        self.assertEqual(pid, self.manager.manager.cmd.pid)
+
+    def test_calls_from_many_threads(self):
+        evaluator = self.manager.new_evaluator(EvaluatorOptions())
+        with ThreadPoolExecutor(8) as pool:
+            results = list(
+                pool.map(lambda i: evaluator.evaluate_expression(TextSource(""), f"echo:{i}"), range(200))
+            )
+        self.assertEqual([str(i) for i in range(200)], results)
+
+    def test_stream_expression(self):
+        evaluator = self.manager.new_evaluator(EvaluatorOptions())
+        elements = evaluator.stream_expression(TextSource(""), "json:[5, [1, 2, 3]]")
+        self.assertEqual([1, 2, 3], list(elements))
+
+    def test_write_output_bytes(self):
+        evaluator = self.manager.new_evaluator(EvaluatorOptions())
+        with tempfile.TemporaryFile() as f:
+            self.assertEqual(1, evaluator.write_expression(TextSource(""), "echo:x", f))
+            self.assertEqual(12, evaluator.write_output_bytes(TextSource(""), f))
+            f.seek(0)
+            self.assertEqual(b"xoutput.bytes", f.read())
+
+    def test_write_output_files(self):
+        evaluator = self.manager.new_evaluator(EvaluatorOptions())
+        files = {"a.yaml": "a: 1\n", "nested/b.yaml": "b: 2\n"}
+        with tempfile.TemporaryDirectory() as tmp:
+            written = evaluator.write_output_files(TextSource(json.dumps(files)), tmp)
+            self.assertEqual(sorted(files), sorted(written))
+            with open(os.path.join(tmp, "nested", "b.yaml")) as f:
+                self.assertEqual("b: 2\n", f.read())
+            self.assertEqual([], evaluator.write_output_files(TextSource(json.dumps(files)), tmp))
+
+    def test_close_stops_loop_thread(self):
+        thread = self.manager.thread
+        self.manager.close()
+        self.assertFalse(thread.is_alive())
+        self.assertNotIn(thread, threading.enumerate())
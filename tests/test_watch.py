@@ -0,0 +1,67 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from pkl_python.evaluator import watch
+from pkl_python.evaluator.evaluator_manager import EvaluatorManagerImpl
+from pkl_python.evaluator.evaluator_options import EvaluatorOptions
+from pkl_python.evaluator.module_source import FileSource
+
+FAKE_PKL = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_pkl.py")]
+
+
+class TestWatch(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.data = os.path.join(self.tmp.name, "data.txt")
+        self.write("main.pkl", 'data = read("data.txt")\n')
+        self.write("data.txt", "one")
+        self.manager = EvaluatorManagerImpl(FAKE_PKL)
+        self.evaluator = await self.manager.new_evaluator(EvaluatorOptions())
+
+    async def asyncTearDown(self):
+        self.manager.close()
+
+    def write(self, name, text):
+        with open(os.path.join(self.tmp.name, name), "w") as f:
+            f.write(text)
+
+    async def check_watch(self):
+        source = FileSource(self.tmp.name, "main.pkl")
+        values = self.evaluator.watch(source, f"cat:{self.data}", debounce=0.05, poll_interval=0.01)
+        try:
+            self.assertEqual("one", await asyncio.wait_for(values.__anext__(), 10))
+            changed = asyncio.ensure_future(values.__anext__())
+            # writing the same contents, or touching the file, does not produce a value
+            await asyncio.sleep(0.1)
+            self.write("data.txt", "one")
+            await asyncio.sleep(0.2)
+            os.utime(self.data)
+            await asyncio.sleep(0.2)
+            self.assertFalse(changed.done())
+            self.assertEqual(1, len(self.manager.evaluators))
+            # a burst of writes produces one value, the last
+            self.write("data.txt", "two")
+            self.write("data.txt", "three")
+            self.assertEqual("three", await asyncio.wait_for(changed, 10))
+            # a write made while the consumer holds a value is not missed
+            self.write("data.txt", "four")
+            self.assertEqual("four", await asyncio.wait_for(values.__anext__(), 10))
+            self.assertEqual(1, len(self.manager.evaluators))
+        finally:
+            await values.aclose()
+
+    async def test_watch(self):
+        await self.check_watch()
+
+    async def test_watch_polling(self):
+        with mock.patch.object(watch, "libc", False):
+            await self.check_watch()
+
+
+if __name__ == "__main__":
+    unittest.main()